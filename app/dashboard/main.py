@@ -10,12 +10,14 @@ st.set_page_config(
 import logging
 import src.config as config
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from requests.exceptions import ConnectionError
 from tenacity import retry, stop_after_attempt, wait_exponential
 
-from src.visualization import FragmentVisualizer, create_thumbnail
-from src.utils import process_image
-from src.helpers import check_api_health
+from src.visualization import FragmentVisualizer
+from src.session_store import SessionStore
+from src.utils import filter_fragments, process_image
+from src.helpers import check_api_health, get_client_id, get_http_session
 
 
 
@@ -42,7 +44,9 @@ class DashboardApp:
     def initialize_session_state(self):
         """Initialize session state variables"""
         if 'processed_images' not in st.session_state:
-            st.session_state.processed_images = {}
+            st.session_state.processed_images = SessionStore()
+        if 'uploader_key' not in st.session_state:
+            st.session_state.uploader_key = 0
         if 'total_time' not in st.session_state:
             st.session_state.total_time = 0
         if 'selected_image' not in st.session_state:
@@ -78,16 +82,17 @@ class DashboardApp:
             
     def show_welcome_message(self):
         """Display welcome message when no image is selected"""
-        st.markdown("""
+        st.markdown(f"""
         <div class="welcome-container">
             <h3>👋 Welcome to the Rock Fragment Detection Dashboard!</h3>
             <p>This tool helps you analyze rock fragments in images using a machine learning model.</p>
             <p>Get started by:</p>
             <ol>
-                <li>Upload images using the sidebar (up to 10 images)</li>
+                <li>Upload images using the sidebar (up to {config.MAX_FILES} images)</li>
                 <li>Adjust the detection threshold if needed</li>
                 <li>Select an image from the sidebar to view its analysis</li>
             </ol>
+            <p>To analyse a whole survey at once, open the <b>Batch Analysis</b> page.</p>
         </div>
         """, unsafe_allow_html=True)
     @retry(
@@ -101,18 +106,23 @@ class DashboardApp:
             st.info("👈 Select an image from the sidebar to view its analysis")
             return
 
-        fragments = data['fragments']
+        # Detections were fetched once at the floor threshold, the slider only filters them locally
+        score_threshold = st.session_state.score_threshold
+        fragments = filter_fragments(data['fragments'], score_threshold)
         if not fragments:
             st.warning("⚠️ No fragments detected in this image. Try adjusting the threshold.")
             return
 
         # Display original image at the top
         st.markdown('<div class="card-container">', unsafe_allow_html=True)
-        st.image(data['file'], use_container_width=True, caption="Original Image")
+        st.image(data['preview'], use_container_width=True, caption="Original Image")
         st.markdown('</div>', unsafe_allow_html=True)
 
         # Use the new FragmentVisualizer class for all visualizations
-        visualizer = FragmentVisualizer(fragments, data['file'])
+        visualizer = FragmentVisualizer(
+            fragments, data['file'], score_threshold,
+            preview=data['preview'], image_size=data['size']
+        )
         visualizer.display_all_visualizations(data['process_time'])
     
     def display_sidebar(self):
@@ -133,6 +143,11 @@ class DashboardApp:
             current_file_count = len(st.session_state.processed_images)
             st.metric("Total Processing Time", f"{st.session_state.total_time:.2f} sec")
             st.metric("Processed Images", f"{current_file_count}/{config.MAX_FILES}")
+            store = st.session_state.processed_images
+            st.caption(
+                f"Image memory: {store.memory_bytes / 2**20:.0f}/{store.memory_budget / 2**20:.0f} MB, "
+                f"spilled to disk: {store.disk_bytes / 2**20:.0f} MB"
+            )
             
     def handle_file_upload(self):
         """Handle file upload section in the sidebar"""
@@ -141,13 +156,14 @@ class DashboardApp:
         remaining_slots = config.MAX_FILES - current_file_count
         
         # Detection threshold slider
-        score_threshold = st.slider(
+        st.slider(
             'Detection Threshold',
-            min_value=0.0,
+            min_value=config.DETECTION_FLOOR_THRESHOLD,
             max_value=1.0,
             value=0.5,
             step=0.05,
-            help="Adjust the confidence threshold for fragment detection"
+            key="score_threshold",
+            help="Adjust the confidence threshold for fragment detection, applies instantly to all processed images"
         )
         
         if remaining_slots > 0:
@@ -157,7 +173,8 @@ class DashboardApp:
                 "Choose images",
                 type=config.SUPPORTED_FORMATS,
                 accept_multiple_files=True,
-                help=f"Upload up to {config.MAX_FILES} images (Supported formats: {', '.join(config.SUPPORTED_FORMATS)})"
+                help=f"Upload up to {config.MAX_FILES} images (Supported formats: {', '.join(config.SUPPORTED_FORMATS)})",
+                key=f"uploader_{st.session_state.uploader_key}"
             )
 
             if uploaded_files and len(uploaded_files) + current_file_count > config.MAX_FILES:
@@ -166,24 +183,46 @@ class DashboardApp:
                 
             # Process uploaded files
             if uploaded_files:
-                with st.spinner("Processing images..."):
-                    self.process_uploaded_files(uploaded_files, score_threshold)
+                self.process_uploaded_files(uploaded_files)
         else:
-            st.error("Maximum file limit reached (10 files)")
+            st.error(f"Maximum file limit reached ({config.MAX_FILES} files)")
             
-    def process_uploaded_files(self, uploaded_files, score_threshold):
-        """Process uploaded files and store results in session state"""
-        for uploaded_file in uploaded_files:
-            if uploaded_file.name not in st.session_state.processed_images:
+    def process_uploaded_files(self, uploaded_files):
+        """Process uploaded files concurrently and store results in session state as they arrive.
+        Every detection above the floor threshold is kept, so the threshold slider never needs the API again"""
+        pending = [f for f in uploaded_files if f.name not in st.session_state.processed_images]
+        if not pending:
+            return
+
+        # One (cached) health check for the whole batch instead of one per image
+        try:
+            api_healthy = check_api_health()
+        except Exception as e:
+            api_healthy = False
+            logger.error(f"Failed to check API health: {str(e)}")
+        if not api_healthy:
+            st.error("❌ Model API is not available. Please try again later.")
+            return
+
+        session = get_http_session()
+        client_id = get_client_id()
+        progress = st.progress(0.0, text=f"Processing 0/{len(pending)} images...")
+        with ThreadPoolExecutor(max_workers=config.MAX_CONCURRENT_REQUESTS) as executor:
+            futures = {
+                executor.submit(
+                    process_image, uploaded_file, config.DETECTION_FLOOR_THRESHOLD, session, client_id=client_id
+                ): uploaded_file
+                for uploaded_file in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                uploaded_file = futures[future]
                 try:
-                    response, process_time = process_image(uploaded_file, score_threshold)
+                    response, process_time = future.result()
+                    # A refused (429) or timed out (504) image is an error, not an image without fragments
+                    response.raise_for_status()
                     data = response.json()
                     fragments = data.get("fragments", [])
-                    st.session_state.processed_images[uploaded_file.name] = {
-                        'file': uploaded_file,
-                        'fragments': fragments,
-                        'process_time': process_time
-                    }
+                    st.session_state.processed_images.add(uploaded_file, fragments, process_time)
                     st.session_state.total_time += process_time
                     st.success(f"✅ Processed {uploaded_file.name}")
                 except ConnectionError as e:
@@ -192,6 +231,10 @@ class DashboardApp:
                 except Exception as e:
                     st.error(f"❌ Error processing {uploaded_file.name}: {str(e)}")
                     logger.error(f"Error details: {str(e)}", exc_info=True)
+                progress.progress(done / len(pending), text=f"Processing {done}/{len(pending)} images...")
+        progress.empty()
+        # The store keeps its own copy, a fresh uploader on the next rerun lets Streamlit free the uploads
+        st.session_state.uploader_key += 1
         
     def display_image_selector(self):
         """Display the image selector in the sidebar"""
@@ -200,14 +243,14 @@ class DashboardApp:
         
         # Use a grid for selection
         for filename, data in st.session_state.processed_images.items():
+            fragment_count = len(filter_fragments(data['fragments'], st.session_state.score_threshold))
             st.markdown('<div class="thumbnail-container">', unsafe_allow_html=True)
             col1, col2 = st.columns([1, 3])
             with col1:
-                thumbnail = create_thumbnail(data['file'])
-                st.image(thumbnail, width=50)
+                st.image(data['thumbnail'], width=50)
             with col2:
                 if st.button(
-                    f"{filename}\n{len(data['fragments'])} fragments",
+                    f"{filename}\n{fragment_count} fragments",
                     key=f"select_{filename}",
                     use_container_width=True,
                 ):
@@ -216,7 +259,7 @@ class DashboardApp:
             
         # Clear all button
         if st.button("🗑️ Clear All", type="secondary", use_container_width=True):
-            st.session_state.processed_images = {}
+            st.session_state.processed_images.clear()
             st.session_state.total_time = 0
             st.session_state.selected_image = None
             st.rerun()
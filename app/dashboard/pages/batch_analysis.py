@@ -0,0 +1,179 @@
+import streamlit as st
+
+st.set_page_config(
+    page_title="Batch Analysis",
+    page_icon="📦",
+    layout="wide"
+)
+
+import logging
+import time
+import numpy as np
+import src.config as config
+from src.batch import analyse_batch, cdf_points, image_summary, list_batch_images
+from src.helpers import check_api_health, get_client_id, get_http_session
+from src.utils import get_size_metrics_table, process_image
+from src.visualization import FragmentVisualizer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class BatchAnalysisPage:
+    """Site-level analysis of a whole survey: one fragmentation curve over many images"""
+    def __init__(self):
+        if 'batch' not in st.session_state:
+            st.session_state.batch = None
+        # Only the last drilled-down image keeps its masks in memory
+        if 'batch_drilldown' not in st.session_state:
+            st.session_state.batch_drilldown = None
+
+    def run(self):
+        st.title("Batch Analysis 📦")
+        st.caption("Drop a folder, a zip archive or many images of a survey to get its combined fragmentation curve.")
+
+        uploaded_files = self.get_uploads()
+        if not uploaded_files:
+            return
+        images = list_batch_images(uploaded_files)
+        if not images:
+            st.warning("⚠️ No supported images found.")
+            return
+
+        score_threshold = st.slider(
+            'Detection Threshold', min_value=0.0, max_value=1.0, value=0.5, step=0.05,
+            help="Confidence threshold applied to every image of the batch"
+        )
+
+        # Results are kept per (set of images, threshold); an interrupted batch resumes where it stopped
+        source = (tuple(image.name for image in images), score_threshold)
+        if st.session_state.batch is None or st.session_state.batch['source'] != source:
+            st.session_state.batch = {'source': source, 'results': {}, 'errors': {}}
+        batch = st.session_state.batch
+
+        pending = [image for image in images if image.name not in batch['results']]
+        st.info(f"{len(images)} images, {len(batch['results'])} analysed")
+
+        placeholders = {
+            'progress': st.empty(),
+            'metrics': st.empty(),
+            'charts': st.empty(),
+            'table': st.empty(),
+        }
+        if pending and st.button(f"▶️ Analyse {len(pending)} image(s)", type="primary"):
+            self.process_batch(pending, score_threshold, len(images), placeholders)
+        else:
+            self.display_aggregate(placeholders)
+
+        if batch['errors']:
+            with st.expander(f"❌ {len(batch['errors'])} image(s) failed"):
+                for name, error in batch['errors'].items():
+                    st.write(f"**{name}**: {error}")
+
+        if batch['results']:
+            self.display_drilldown(images, score_threshold)
+
+    def get_uploads(self):
+        mode = st.radio("Source", ["Folder", "Zip archive or images"], horizontal=True)
+        if mode == "Folder":
+            return st.file_uploader(
+                "Choose a folder", type=config.SUPPORTED_FORMATS, accept_multiple_files="directory", key="batch_folder"
+            )
+        return st.file_uploader(
+            "Choose zip archives or images", type=config.SUPPORTED_FORMATS + ["zip"],
+            accept_multiple_files=True, key="batch_files"
+        )
+
+    def process_batch(self, pending, score_threshold, total, placeholders):
+        """Send the images through the API with bounded concurrency, redrawing the aggregate as results arrive"""
+        try:
+            api_healthy = check_api_health()
+        except Exception as e:
+            api_healthy = False
+            logger.error(f"Failed to check API health: {str(e)}")
+        if not api_healthy:
+            st.error("❌ Model API is not available. Please try again later.")
+            return
+
+        batch = st.session_state.batch
+        last_refresh = 0.0
+        for image, result, process_time in analyse_batch(pending, score_threshold, get_http_session(), get_client_id()):
+            if isinstance(result, Exception):
+                batch['errors'][image.name] = str(result)
+                logger.error(f"Error processing {image.name}: {str(result)}")
+            else:
+                batch['errors'].pop(image.name, None)
+                batch['results'][image.name] = {
+                    'sizes': [fragment.get("size_cm", 0.0) for fragment in result.get("fragments", [])],
+                    'process_time': process_time,
+                }
+
+            done = len(batch['results']) + len(batch['errors'])
+            placeholders['progress'].progress(min(done / total, 1.0), text=f"Analysed {done}/{total} images...")
+            if time.monotonic() - last_refresh >= config.BATCH_REFRESH_SECONDS:
+                self.display_aggregate(placeholders)
+                last_refresh = time.monotonic()
+
+        placeholders['progress'].empty()
+        self.display_aggregate(placeholders)
+
+    def display_aggregate(self, placeholders):
+        """Combined CDF, percentile table and per-image summary of all results so far"""
+        results = st.session_state.batch['results']
+        sizes = [size for result in results.values() for size in result['sizes']]
+        if not sizes:
+            return
+
+        with placeholders['metrics'].container():
+            cols = st.columns(4)
+            cols[0].metric("🖼️ Images", f"{len(results)}")
+            cols[1].metric("🔢 Total Fragments", f"{len(sizes)}")
+            cols[2].metric("📏 D50", f"{np.percentile(sizes, 50):.2f} cm")
+            cols[3].metric("📊 D90", f"{np.percentile(sizes, 90):.2f} cm")
+
+        # Charted in the browser from a fixed number of points, whatever the number of fragments
+        with placeholders['charts'].container():
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.line_chart(cdf_points(sizes), x="Size (cm)", y="Cumulative Percentage (%)")
+            with col2:
+                st.dataframe(get_size_metrics_table(sizes), use_container_width=True, hide_index=True)
+
+        placeholders['table'].dataframe(
+            [image_summary(name, result['sizes'], result['process_time']) for name, result in results.items()],
+            use_container_width=True, hide_index=True
+        )
+
+    def display_drilldown(self, images, score_threshold):
+        """Full analysis of a single image, fetched with its masks only when selected"""
+        st.markdown("---")
+        st.subheader("🔍 Image Details")
+        names = [image.name for image in images if image.name in st.session_state.batch['results']]
+        name = st.selectbox("Image", [None] + names, format_func=lambda name: name or "Select an image...")
+        if name is None:
+            return
+
+        drilldown = st.session_state.batch_drilldown
+        if drilldown is None or drilldown['key'] != (name, score_threshold):
+            image = next(image for image in images if image.name == name)
+            with st.spinner(f"Loading {name}..."):
+                try:
+                    response, process_time = process_image(image, score_threshold)
+                    response.raise_for_status()
+                except Exception as e:
+                    st.error(f"❌ Error processing {name}: {str(e)}")
+                    return
+            drilldown = {
+                'key': (name, score_threshold),
+                'image': image,
+                'fragments': response.json().get("fragments", []),
+                'process_time': process_time,
+            }
+            st.session_state.batch_drilldown = drilldown
+
+        if not drilldown['fragments']:
+            st.warning("⚠️ No fragments detected in this image.")
+            return
+        visualizer = FragmentVisualizer(drilldown['fragments'], drilldown['image'], score_threshold)
+        visualizer.display_all_visualizations(drilldown['process_time'])
+
+BatchAnalysisPage().run()
@@ -0,0 +1,98 @@
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+import src.config as config
+from src.utils import process_image
+
+class BatchImage:
+    """One image of a batch, read from its source only when it is sent to the API or drilled into"""
+    def __init__(self, name, read):
+        self.name = name
+        self._read = read
+
+    def getvalue(self):
+        return self._read()
+
+def list_batch_images(uploaded_files):
+    """Images of a batch, from uploaded image files, a folder upload or zip archives"""
+    images = []
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            archive = zipfile.ZipFile(uploaded_file)
+            for member in archive.infolist():
+                if not member.is_dir() and is_supported_image(member.filename):
+                    images.append(BatchImage(
+                        f"{uploaded_file.name}/{member.filename}",
+                        lambda archive=archive, member=member: archive.read(member)
+                    ))
+        elif is_supported_image(uploaded_file.name):
+            images.append(BatchImage(uploaded_file.name, uploaded_file.getvalue))
+    return images
+
+def is_supported_image(filename):
+    name = os.path.basename(filename)
+    # Skip hidden files and macOS resource forks shipped in archives
+    return not name.startswith(".") and name.rsplit(".", 1)[-1].lower() in config.SUPPORTED_FORMATS
+
+class NamedBytes:
+    """In-memory image handed to a worker thread, with the interface process_image expects"""
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+def analyse_batch(images, score_threshold, session, client_id=None, max_in_flight=config.MAX_CONCURRENT_REQUESTS):
+    """Send images through the API and yield (image, response data or exception, process time) as
+    results arrive. At most `max_in_flight` images are read and in flight at any time."""
+    images = iter(images)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = {}
+
+        def submit_next():
+            image = next(images, None)
+            if image is not None:
+                # Sources (zip archives) are read on this thread only, workers get the bytes
+                request_image = NamedBytes(image.name, image.getvalue())
+                future = executor.submit(
+                    process_image, request_image, score_threshold, session,
+                    include_mask=False, include_metrics=False, priority=config.BATCH_PRIORITY, client_id=client_id
+                )
+                in_flight[future] = image
+
+        for _ in range(max_in_flight):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                image = in_flight.pop(future)
+                submit_next()
+                try:
+                    response, process_time = future.result()
+                    response.raise_for_status()
+                    yield image, response.json(), process_time
+                except Exception as e:
+                    yield image, e, 0.0
+
+def cdf_points(sizes, resolution=100):
+    """Cumulative size distribution sampled at `resolution` + 1 percentiles, cheap to chart for any number of fragments"""
+    percentiles = np.linspace(0, 100, resolution + 1)
+    return pd.DataFrame({
+        "Size (cm)": np.percentile(sizes, percentiles),
+        "Cumulative Percentage (%)": percentiles,
+    })
+
+def image_summary(name, sizes, process_time):
+    """One row of the per-image table"""
+    return {
+        "Image": name,
+        "Fragments": len(sizes),
+        "Mean (cm)": round(float(np.mean(sizes)), 2) if sizes else None,
+        "D50 (cm)": round(float(np.percentile(sizes, 50)), 2) if sizes else None,
+        "D90 (cm)": round(float(np.percentile(sizes, 90)), 2) if sizes else None,
+        "Time (s)": round(process_time, 2),
+    }
@@ -1,8 +1,25 @@
 import os 
+import tempfile
 
 API_URL = os.getenv("MODEL_API_URL", "http://localhost:5000") + "/predict"
 API_HEALTH_URL = os.getenv("MODEL_API_URL", "http://localhost:5000") + "/health"
-MAX_FILES = 10
+MAX_FILES = int(os.getenv("MAX_FILES", 200))  # Images per session
 SUPPORTED_FORMATS = ["jpg", "jpeg", "png"]
 MAX_RETRIES = 3
-INITIAL_RETRY_DELAY = 1  # seconds
\ No newline at end of file
+INITIAL_RETRY_DELAY = 1  # seconds
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 4))  # Parallel uploads to the API
+# Images are analysed once at this threshold, the dashboard slider filters the detections locally
+DETECTION_FLOOR_THRESHOLD = float(os.getenv("DETECTION_FLOOR_THRESHOLD", 0.05))
+HEALTH_CACHE_TTL = 10  # seconds
+RENDER_CACHE_MAX_MB = int(os.getenv("RENDER_CACHE_MAX_MB", 256))  # Memory budget of cached figures
+FRAGMENT_PAGE_SIZES = [24, 48, 96]  # Fragments per page in the individual fragment view
+MONTAGE_COLUMNS = 6
+MONTAGE_TILE_SIZE = 160  # pixels
+# Per-session memory for processed images, least recently used originals beyond it are spilled to disk
+SESSION_MEMORY_BUDGET_MB = int(os.getenv("SESSION_MEMORY_BUDGET_MB", 256))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fragment-dashboard"))
+PREVIEW_MAX_SIZE = 1280  # pixels, longest side of the "Original Image" preview
+THUMBNAIL_SIZE = 100  # pixels
+INTERACTIVE_VIEW_HEIGHT = 720  # pixels, height of the interactive fragment view
+BATCH_PRIORITY = "bulk"  # API scheduling class of batch analysis requests, served after interactive ones
+BATCH_REFRESH_SECONDS = 1.0  # Minimum time between two redraws of the batch aggregate
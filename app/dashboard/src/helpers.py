@@ -1,21 +1,45 @@
+import uuid
+
 import requests
 from requests import RequestException
+from requests.adapters import HTTPAdapter
 import logging 
+import streamlit as st
 from tenacity       import retry, stop_after_attempt, wait_exponential
 import src.config as config 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@st.cache_resource
+def get_http_session():
+    """Keep-alive HTTP session shared by all reruns and upload threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=config.MAX_CONCURRENT_REQUESTS
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def get_client_id():
+    """Identity of this browser session, sent as X-Client-ID. Every user reaches the API through
+    this one server, without it they would all share a single per-client request limit"""
+    if 'client_id' not in st.session_state:
+        st.session_state.client_id = uuid.uuid4().hex
+    return st.session_state.client_id
+
+@st.cache_data(ttl=config.HEALTH_CACHE_TTL, show_spinner=False)
 @retry(
     stop=stop_after_attempt(config.MAX_RETRIES),
     wait=wait_exponential(multiplier=config.INITIAL_RETRY_DELAY),
     reraise=True
 )
 def check_api_health():
-    """Check if the model API is healthy with retry logic"""
+    """Check if the model API is healthy with retry logic, cached for HEALTH_CACHE_TTL seconds"""
     try:
-        response = requests.get(config.API_HEALTH_URL, timeout=5)
+        response = get_http_session().get(config.API_HEALTH_URL, timeout=5)
         if response.status_code == 200:
             return True
         logger.error(f"API health check failed with status code: {response.status_code}")
@@ -0,0 +1,124 @@
+import base64
+import json
+
+import numpy as np
+from maskcodec import decode_rle, encode_polygon
+
+OUTLINE_TOLERANCE = 1.0  # pixels, Douglas-Peucker simplification of the outlines sent to the browser
+
+def fragment_geometry(fragments, colors, sizes):
+    """Compact per-fragment data for the browser: box, simplified outline rings, color and hover details"""
+    geometry = []
+    for i, fragment in enumerate(fragments):
+        bbox = fragment.get("bbox", None)
+        if not bbox:
+            continue
+        x1, y1, x2, y2 = bbox
+        outline = []
+        if mask_data := fragment.get("mask_data", None):
+            mask = decode_rle(mask_data.get("rle", []), mask_data.get("shape", [y2-y1, x2-x1]))
+            # Every ring of every part, holes are cut out by the even-odd fill rule
+            outline = [
+                (np.asarray(ring, dtype=np.int64).reshape(-1, 2) + (x1, y1)).tolist()
+                for rings in encode_polygon(mask, (0, 0, mask.shape[1], mask.shape[0]), OUTLINE_TOLERANCE)
+                for ring in rings
+            ]
+        metrics = fragment.get("metrics") or {}
+        geometry.append({
+            "n": i + 1,
+            "box": [int(v) for v in bbox],
+            "outline": outline,
+            "color": colors[i],
+            "size": round(float(sizes[i]), 2),
+            "score": round(float(fragment.get("score", 0.0)), 3),
+            "area": round(float(metrics.get("area", 0.0)), 1),
+            "perimeter": round(float(metrics.get("perimeter", 0.0)), 1),
+            "circularity": round(float(metrics.get("circularity", 0.0)), 2),
+        })
+    return geometry
+
+def build_interactive_html(image_bytes, image_size, geometry, mime="image/jpeg"):
+    """Self-contained page drawing the fragments over the image as SVG, in the original image coordinates"""
+    width, height = image_size
+    image_uri = f"data:{mime};base64,{base64.b64encode(image_bytes).decode()}"
+    return (
+        _TEMPLATE
+        .replace("__WIDTH__", str(width))
+        .replace("__HEIGHT__", str(height))
+        .replace("__IMAGE__", image_uri)
+        .replace("__FRAGMENTS__", json.dumps(geometry, separators=(",", ":")))
+    )
+
+_TEMPLATE = """
+<style>
+  body { margin: 0; font-family: "Source Sans Pro", sans-serif; font-size: 13px; }
+  .controls { height: 28px; display: flex; gap: 16px; align-items: center; }
+  svg { width: 100%; height: calc(100vh - 32px); display: block; }
+  .fragment { fill-opacity: 0.3; stroke-width: 2; vector-effect: non-scaling-stroke; cursor: pointer; }
+  .fragment.active { fill-opacity: 0.6; stroke-width: 4; }
+  .box { fill: none; stroke-width: 2; vector-effect: non-scaling-stroke; pointer-events: none; }
+  .hide-masks .fragment { fill-opacity: 0; stroke-opacity: 0; }
+  .hide-boxes .box { display: none; }
+  #tooltip { position: fixed; display: none; pointer-events: none; background: rgba(255, 255, 255, 0.95);
+             border: 1px solid #ccc; border-radius: 4px; padding: 6px 8px; line-height: 1.4; }
+</style>
+<div class="controls">
+  <label><input type="checkbox" id="show-masks" checked> Masks</label>
+  <label><input type="checkbox" id="show-boxes"> Bounding boxes</label>
+  <span id="count"></span>
+</div>
+<svg id="view" viewBox="0 0 __WIDTH__ __HEIGHT__" preserveAspectRatio="xMidYMid meet" class="hide-boxes">
+  <image href="__IMAGE__" x="0" y="0" width="__WIDTH__" height="__HEIGHT__"/>
+  <g id="boxes"></g>
+  <g id="masks"></g>
+</svg>
+<div id="tooltip"></div>
+<script>
+  const fragments = __FRAGMENTS__;
+  const ns = "http://www.w3.org/2000/svg";
+  const view = document.getElementById("view");
+  const tooltip = document.getElementById("tooltip");
+  document.getElementById("count").textContent = fragments.length + " fragments";
+
+  for (const f of fragments) {
+    const [x1, y1, x2, y2] = f.box;
+    const box = document.createElementNS(ns, "rect");
+    box.setAttribute("class", "box");
+    box.setAttribute("x", x1); box.setAttribute("y", y1);
+    box.setAttribute("width", x2 - x1); box.setAttribute("height", y2 - y1);
+    box.setAttribute("stroke", f.color);
+    document.getElementById("boxes").appendChild(box);
+
+    // Fragments without a mask are hovered through their box
+    const shape = document.createElementNS(ns, "path");
+    const rings = f.outline.length ? f.outline : [[[x1, y1], [x2, y1], [x2, y2], [x1, y2]]];
+    shape.setAttribute("d", rings.map(ring => "M" + ring.map(p => p.join(",")).join("L") + "Z").join(""));
+    shape.setAttribute("fill-rule", "evenodd");
+    shape.setAttribute("class", "fragment");
+    shape.setAttribute("fill", f.color);
+    shape.setAttribute("stroke", f.color);
+    shape.addEventListener("mouseenter", () => {
+      shape.classList.add("active");
+      tooltip.innerHTML =
+        `<b>#${f.n}</b><br>Size: ${f.size.toFixed(1)} cm<br>Score: ${f.score.toFixed(2)}` +
+        (f.area ? `<br>Area: ${f.area} px²<br>Perimeter: ${f.perimeter} px<br>Circularity: ${f.circularity}` : "");
+      tooltip.style.display = "block";
+    });
+    shape.addEventListener("mousemove", (e) => {
+      // Keep the tooltip inside the frame
+      const left = Math.min(e.clientX + 12, window.innerWidth - tooltip.offsetWidth - 4);
+      const top = Math.min(e.clientY + 12, window.innerHeight - tooltip.offsetHeight - 4);
+      tooltip.style.left = left + "px";
+      tooltip.style.top = top + "px";
+    });
+    shape.addEventListener("mouseleave", () => {
+      shape.classList.remove("active");
+      tooltip.style.display = "none";
+    });
+    document.getElementById("masks").appendChild(shape);
+  }
+
+  document.getElementById("show-masks").addEventListener("change", (e) => view.classList.toggle("hide-masks", !e.target.checked));
+  document.getElementById("show-boxes").addEventListener("change", (e) => view.classList.toggle("hide-boxes", !e.target.checked));
+</script>
+"""
@@ -0,0 +1,86 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import numpy as np
+import streamlit as st
+from PIL import Image
+import src.config as config
+
+class RenderCache:
+    """
+    LRU cache of rendered figures (PNG bytes), bounded by total size in bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            # Items larger than the whole budget are simply not cached
+            if len(value) > self.max_bytes:
+                return
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_or_render(self, key, render):
+        """Return the cached PNG for key, or call render() for a matplotlib figure
+        or an image array and cache it"""
+        png = self.get(key)
+        if png is None:
+            rendered = render()
+            png = array_to_png(rendered) if isinstance(rendered, np.ndarray) else figure_to_png(rendered)
+            self.put(key, png)
+        return png
+
+@st.cache_resource
+def get_render_cache():
+    """Process-wide cache shared by all sessions and reruns"""
+    return RenderCache(config.RENDER_CACHE_MAX_MB * 1024 * 1024)
+
+# st.image re-encodes anything wider than its maximum content width on every call
+MAX_PNG_WIDTH = 1400
+
+def figure_to_png(fig):
+    """Rasterize a figure like st.pyplot does (capped to MAX_PNG_WIDTH pixels), then free it"""
+    buffer = io.BytesIO()
+    dpi = min(200, MAX_PNG_WIDTH / fig.get_size_inches()[0])
+    fig.savefig(buffer, format="png", bbox_inches="tight", dpi=dpi)
+    plt.close(fig)
+    return buffer.getvalue()
+
+def array_to_png(array):
+    """Encode an HxW or HxWx3 uint8 image"""
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="png")
+    return buffer.getvalue()
+
+def image_key(image):
+    """Content hash of an uploaded file, a stored image or a PIL image"""
+    if key := getattr(image, "key", None):
+        return key
+    data = image.tobytes() if isinstance(image, Image.Image) else image.getvalue()
+    return hashlib.sha1(data).hexdigest()
+
+def fragments_key(fragments):
+    """Hash identifying a set of detections by their ids, boxes and scores"""
+    digest = hashlib.sha1()
+    for fragment in fragments:
+        digest.update(repr((fragment.get("id"), fragment.get("bbox"), fragment.get("score"))).encode())
+    return digest.hexdigest()
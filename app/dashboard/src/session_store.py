@@ -0,0 +1,136 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+
+from PIL import Image
+import src.config as config
+
+class StoredImage:
+    """
+    Original upload kept by a SessionStore, either in memory or spilled to the disk cache.
+    Behaves like an UploadedFile for the visualizations (name and getvalue())
+    """
+    def __init__(self, store, name, data):
+        self._store = store
+        self.name = name
+        self.key = hashlib.sha1(data).hexdigest()
+        self.size = len(data)
+        self.path = os.path.join(store.cache_dir, f"{self.key}.bin")
+        self._data = data
+
+    @property
+    def in_memory(self):
+        return self._data is not None
+
+    def getvalue(self):
+        self._store.touch(self.name)
+        if self._data is not None:
+            return self._data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def spill(self):
+        """Write the original to the disk cache and drop it from memory"""
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(self._data)
+        self._data = None
+
+class SessionStore:
+    """
+    Processed images of one dashboard session, by file name.
+
+    Only a downscaled preview and a thumbnail (both encoded) stay in memory for every image.
+    Originals are kept in memory until the session's memory budget is exceeded, then the
+    least recently used ones are spilled to a local disk cache and read back on demand.
+    """
+    def __init__(self, memory_budget=None, cache_dir=None):
+        if memory_budget is None:
+            memory_budget = config.SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+        cache_dir = cache_dir or config.IMAGE_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.memory_budget = memory_budget
+        self.cache_dir = tempfile.mkdtemp(prefix="session-", dir=cache_dir)
+        self._records = {}
+        # Least recently used first, kept apart so the records stay in upload order
+        self._recent = OrderedDict()
+        # Remove the spilled files when the session (and its store) goes away
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.cache_dir, True)
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __getitem__(self, name):
+        return self._records[name]
+
+    def __len__(self):
+        return len(self._records)
+
+    def __bool__(self):
+        return bool(self._records)
+
+    def items(self):
+        return self._records.items()
+
+    @property
+    def memory_bytes(self):
+        """Bytes held in memory: previews, thumbnails and the originals not spilled yet"""
+        return sum(
+            len(record["preview"]) + len(record["thumbnail"]) + (record["file"].size if record["file"].in_memory else 0)
+            for record in self._records.values()
+        )
+
+    @property
+    def disk_bytes(self):
+        return sum(record["file"].size for record in self._records.values() if not record["file"].in_memory)
+
+    def add(self, uploaded_file, fragments, process_time):
+        """Store the analysis of an upload, keeping only encoded previews of the image in memory"""
+        data = uploaded_file.getvalue()
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        self._records[uploaded_file.name] = {
+            "file": StoredImage(self, uploaded_file.name, data),
+            "fragments": fragments,
+            "process_time": process_time,
+            "size": image.size,
+            "preview": encode_preview(image, config.PREVIEW_MAX_SIZE, "JPEG"),
+            "thumbnail": encode_preview(image, config.THUMBNAIL_SIZE, "PNG"),
+        }
+        self.touch(uploaded_file.name)
+        self._enforce_budget()
+
+    def touch(self, name):
+        """Mark an image as recently used"""
+        if name in self._records:
+            self._recent[name] = None
+            self._recent.move_to_end(name)
+
+    def clear(self):
+        self._records.clear()
+        self._recent.clear()
+        for entry in os.scandir(self.cache_dir):
+            os.remove(entry.path)
+
+    def _enforce_budget(self):
+        # Spill originals, least recently used first, until the session fits its budget again
+        excess = self.memory_bytes - self.memory_budget
+        for name in self._recent:
+            record = self._records[name]
+            if excess <= 0:
+                break
+            if record["file"].in_memory:
+                excess -= record["file"].size
+                record["file"].spill()
+
+def encode_preview(image, max_size, image_format):
+    """Downscaled copy of the image, encoded so that it is small in memory and served as is by st.image"""
+    preview = image.convert("RGB")
+    preview.thumbnail((max_size, max_size))
+    buffer = io.BytesIO()
+    preview.save(buffer, format=image_format, **({"quality": 85} if image_format == "JPEG" else {}))
+    return buffer.getvalue()
@@ -1,11 +1,10 @@
 import pandas as pd
 import numpy as np
 import time 
-import requests
 import logging 
 from requests.exceptions import RequestException, ConnectionError
 import src.config as config 
-from   src.helpers import check_api_health
+from   src.helpers import get_client_id, get_http_session
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,10 +17,20 @@ def get_size_metrics_table(sizes):
     }
     return pd.DataFrame(data)
 
-def process_image(image_file, score_threshold=0.5):
-    """Process the image through the API with retry logic"""
+def filter_fragments(fragments, score_threshold):
+    """Detections above the threshold, same rule as the API's score_threshold"""
+    return [fragment for fragment in fragments if fragment.get("score", 0.0) > score_threshold]
+
+def process_image(image_file, score_threshold=0.5, session=None, include_mask=True, include_metrics=True, priority=None,
+                  client_id=None):
+    """Process the image through the API with retry logic.
+    Pass `session` and `client_id` when calling from worker threads, which cannot reach Streamlit's
+    cache or session state. `priority` sets the API scheduling class (interactive or bulk)."""
     try:
-        return try_extract_image(image_file, score_threshold)
+        return try_extract_image(
+            image_file, score_threshold, session or get_http_session(),
+            include_mask, include_metrics, priority, client_id or get_client_id()
+        )
     except RequestException as e:
         logger.error(f"Error processing image: {str(e)}")
         raise ConnectionError(f"Failed to connect to Model API: {str(e)}") from e
@@ -29,20 +38,24 @@ def process_image(image_file, score_threshold=0.5):
         logger.error(f"Error processing image: {str(e)}")
         raise
 
-def try_extract_image(image_file, score_threshold):
-    # Check API health first
-    if not check_api_health():
-        raise ConnectionError("Model API is not available. Please try again later.")
-
+def try_extract_image(image_file, score_threshold, session, include_mask=True, include_metrics=True, priority=None,
+                      client_id=None):
+    # API health is checked (and cached) by the caller, once per batch of uploads
     start_time = time.time()
     files = {"file": (image_file.name, image_file.getvalue())}
     params = {
         "score_threshold": score_threshold,
-        "include_mask": True,  # Always request mask data
-        "include_metrics": True  # Include metrics for visualization
+        "include_mask": include_mask,  # Mask data for the visualizations
+        "include_metrics": include_metrics  # Include metrics for visualization
     }
+    headers = {}
+    if priority:
+        headers["X-Priority"] = priority
+    if client_id:
+        # The API limits requests in flight per client, this keeps dashboard users apart
+        headers["X-Client-ID"] = client_id
 
-    response = requests.post(config.API_URL, files=files, params=params, timeout=30)
+    response = session.post(config.API_URL, files=files, params=params, headers=headers, timeout=30)
     process_time = time.time() - start_time
 
     if response.status_code != 200:
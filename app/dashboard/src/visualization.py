@@ -1,35 +1,79 @@
+import io
+import math
 import streamlit as st 
 import numpy as np 
 from PIL import Image
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-from matplotlib.colors import ListedColormap
 import random
 import cv2
+import streamlit.components.v1 as components
+from maskcodec import decode_rle, decode_rle_into
+import src.config as config
+from src.interactive_view import build_interactive_html, fragment_geometry
+from src.render_cache import fragments_key, get_render_cache, image_key
+from src.session_store import encode_preview
+
+def fragment_size(fragment):
+    """Calibrated size of a fragment when available, otherwise its estimated size"""
+    return fragment.get("real_size_cm", fragment.get("size_cm", 0.0))
+
+def hex_to_rgb(color_hex):
+    return tuple(int(color_hex[k:k+2], 16) for k in (1, 3, 5))
+
+# Sort options of the individual fragment view: label -> (sort key, descending)
+FRAGMENT_ORDERS = {
+    "Size (largest first)": (fragment_size, True),
+    "Size (smallest first)": (fragment_size, False),
+    "Score (highest first)": (lambda fragment: fragment.get("score", 0.0), True),
+    "Detection order": (None, False),
+}
 
 class FragmentVisualizer:
     """
     A class to handle all fragment visualizations in the dashboard
     """
-    def __init__(self, fragments, original_image):
+    def __init__(self, fragments, original_image, threshold=None, preview=None, image_size=None):
         self.fragments = fragments
-        
-        # Convert original image to numpy array if it's not already
-        if isinstance(original_image, Image.Image):
-            self.img_array = np.array(original_image)
-        else:
-            self.img_array = np.array(Image.open(original_image))
-            
-        self.height, self.width = self.img_array.shape[:2]
+        self.original_image = original_image
+        # Encoded downscaled image and (width, height) of the original, for the interactive view
+        self.preview = preview
+        self.image_size = image_size
+        self._img_array = None
         self.num_fragments = len(fragments)
         self.colors = self._generate_colors(self.num_fragments)
+
+        # Rendered figures are cached per (image, fragment set, threshold) across reruns
+        self.cache = get_render_cache()
+        self.cache_key = (image_key(original_image), fragments_key(fragments), threshold)
+
+    @property
+    def img_array(self):
+        """Decoded image, only loaded when a figure actually has to be rendered"""
+        if self._img_array is None:
+            # Convert original image to numpy array if it's not already
+            if isinstance(self.original_image, Image.Image):
+                self._img_array = np.array(self.original_image)
+            else:
+                self._img_array = np.array(Image.open(io.BytesIO(self.original_image.getvalue())))
+        return self._img_array
+
+    @property
+    def height(self):
+        return self.img_array.shape[0]
+
+    @property
+    def width(self):
+        return self.img_array.shape[1]
+
+    def _show_cached_figure(self, name, render, caption=None):
+        """Display a figure or image array from the render cache, rendering it only on a cache miss"""
+        png = self.cache.get_or_render(self.cache_key + (name,), render)
+        st.image(png, use_container_width=True, caption=caption)
     
     def display_metrics(self, process_time):
         """Display key metrics about the fragments in a single row"""
-        sizes = [
-            fragment.get("real_size_cm", fragment.get("size_cm", 0.0))
-            for fragment in self.fragments
-        ]
+        sizes = [fragment_size(fragment) for fragment in self.fragments]
         
         if not sizes:
             st.warning("No fragment size data available")
@@ -75,15 +119,8 @@ class FragmentVisualizer:
         
         with tab1:
             st.markdown('<div class="card-container">', unsafe_allow_html=True)
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                # Combined masks visualization
-                self.display_combined_masks()
-                
-            with col2:
-                # Bounding boxes visualization
-                self.display_bounding_boxes()
+            # Masks and boxes are drawn by the browser, hover a fragment for its details
+            self.display_interactive_view()
             st.markdown('</div>', unsafe_allow_html=True)
         
         with tab2:
@@ -102,8 +139,8 @@ class FragmentVisualizer:
                 )
             
             with col2:
-                if cdf_fig := plot_cdf(sizes):
-                    st.pyplot(cdf_fig)
+                if sizes:
+                    self._show_cached_figure("cdf", lambda: plot_cdf(sizes))
             st.markdown('</div>', unsafe_allow_html=True)
         
         with tab3:
@@ -112,12 +149,36 @@ class FragmentVisualizer:
             self.display_fragment_masks()
     st.markdown('</div>', unsafe_allow_html=True)
 
+    def display_interactive_view(self):
+        """Send the image and the fragment outlines to the browser once, which draws the overlay itself"""
+        if not self.fragments:
+            st.warning("No fragments to display")
+            return
+
+        key = self.cache_key + ("interactive",)
+        html = self.cache.get(key)
+        if html is None:
+            html = self._render_interactive_view().encode()
+            self.cache.put(key, html)
+        components.html(html.decode(), height=config.INTERACTIVE_VIEW_HEIGHT)
+
+    def _render_interactive_view(self):
+        preview = self.preview
+        if preview is None:
+            preview = encode_preview(Image.fromarray(self._rgb_image()), config.PREVIEW_MAX_SIZE, "JPEG")
+        image_size = self.image_size or (self.width, self.height)
+        sizes = [fragment_size(fragment) for fragment in self.fragments]
+        return build_interactive_html(preview, image_size, fragment_geometry(self.fragments, self.colors, sizes))
+
     def display_bounding_boxes(self):
         """Display all fragment bounding boxes with size labels on a single image"""
         if not self.fragments:
             st.warning("No fragments to display")
             return
 
+        self._show_cached_figure("bounding_boxes", self._render_bounding_boxes)
+
+    def _render_bounding_boxes(self):
         # Create figure with appropriate size
         fig_width = 8
         fig_height = fig_width * (self.height / self.width)
@@ -157,160 +218,180 @@ class FragmentVisualizer:
         # Adjust layout
         plt.tight_layout()
 
-        # Display the figure
-        st.pyplot(fig)
+        return fig
 
     def display_combined_masks(self):
         """Display all fragment masks combined on a single image with different colors"""
         if not self.fragments:
             st.warning("No fragments to display")
             return
-        
-        fig, ax = plt.subplots(figsize=(8, 8 * (self.height / self.width)))
-        
-        # Display original image
-        ax.imshow(self.img_array)
-        ax.set_title("Segmented Fragments")
-        ax.axis('off')
-        
-        # Create an RGBA array for the colored overlay
-        colored_overlay = np.zeros((self.height, self.width, 4), dtype=np.uint8)
-        
-        # Process each fragment
+
+        self._show_cached_figure("combined_masks", self._render_combined_masks, caption="Segmented Fragments")
+
+    def _render_combined_masks(self):
+        """Composite the colored masks and their outlines onto the image in one NumPy pass"""
+        label_image = self._build_label_image()
+
+        # Color lookup table: row 0 is the background, row i+1 the color of fragment i
+        lut = np.zeros((self.num_fragments + 1, 3), dtype=np.float32)
+        for i, color_hex in enumerate(self.colors):
+            lut[i + 1] = hex_to_rgb(color_hex)
+
+        image = self._rgb_image().astype(np.float32)
+        inside = (label_image > 0)[..., None]
+        colored = lut[label_image]
+
+        # 25% tinted fill, same look as the former 50% overlay drawn at alpha 0.5
+        composite = np.where(inside, image * 0.75 + colored * 0.25, image)
+
+        # Outlines: pixels whose right or bottom neighbour belongs to another fragment, drawn on both sides
+        edges = np.zeros(label_image.shape, dtype=bool)
+        horizontal = label_image[:, 1:] != label_image[:, :-1]
+        vertical = label_image[1:, :] != label_image[:-1, :]
+        edges[:, 1:] |= horizontal
+        edges[:, :-1] |= horizontal
+        edges[1:, :] |= vertical
+        edges[:-1, :] |= vertical
+        edges &= label_image > 0
+        composite[edges] = colored[edges]
+
+        return composite.astype(np.uint8)
+
+    def _build_label_image(self):
+        """Single instance-label image of the whole frame, pixel value = fragment index + 1"""
+        label_image = np.zeros((self.height, self.width), dtype=np.int32)
         for i, fragment in enumerate(self.fragments):
             bbox = fragment.get("bbox", None)
             mask_data = fragment.get("mask_data", None)
-            
+
             if bbox and mask_data:
-                # Extract mask parameters
                 x1, y1, x2, y2 = bbox
-                mask_rle = mask_data.get("rle", [])
-                mask_shape = mask_data.get("shape", [y2-y1, x2-x1])
-                
-                # Create binary mask from RLE
-                cropped_mask = self._rle_to_binary_mask(mask_rle, mask_shape)
-                
-                # Create a full-size mask
-                full_mask = np.zeros((self.height, self.width), dtype=np.uint8)
-                
-                # Place cropped mask into full mask at the correct position
-                y2 = min(y1 + mask_shape[0], self.height)
-                x2 = min(x1 + mask_shape[1], self.width)
-                
-                # Handle boundary cases
-                mask_h = min(cropped_mask.shape[0], y2 - y1)
-                mask_w = min(cropped_mask.shape[1], x2 - x1)
-                full_mask[y1:y1+mask_h, x1:x1+mask_w] = cropped_mask[:mask_h, :mask_w]
-                
-                # Convert color from hex to rgba with alpha=0.5
-                color_hex = self.colors[i]
-                r = int(color_hex[1:3], 16)
-                g = int(color_hex[3:5], 16)
-                b = int(color_hex[5:7], 16)
-                
-                # Add this mask to the colored overlay
-                colored_overlay[full_mask > 0] = [r, g, b, 128]  # Alpha=128 (50% transparency)
-                
-                # Add contour around the fragment
-                contours, _ = cv2.findContours(full_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                for contour in contours:
-                    ax.plot(contour[:, 0, 0], contour[:, 0, 1], color=color_hex, linewidth=1.5)
-        
-        # Display the colored mask overlay
-        ax.imshow(colored_overlay, alpha=0.5)
-        
-        # Adjust layout
-        plt.tight_layout()
-        
-        # Display the figure
-        st.pyplot(fig)
+                # Decode the cropped RLE straight into the frame at the bbox offset
+                decode_rle_into(
+                    mask_data.get("rle", []),
+                    mask_data.get("shape", [y2-y1, x2-x1]),
+                    label_image,
+                    (x1, y1),
+                    value=i + 1
+                )
+        return label_image
+
+    def _rgb_image(self):
+        """Original image as an HxWx3 array"""
+        if self.img_array.ndim == 2:
+            return np.stack([self.img_array] * 3, axis=-1)
+        return self.img_array[..., :3]
 
     def display_fragment_masks(self):
-        """Display individual fragment masks in a grid layout"""
+        """Display individual fragments page by page, each page as a single montage image"""
         if not self.fragments:
             st.warning("No fragments to display")
             return
 
-        # Determine grid layout based on number of fragments
-        if self.num_fragments <= 3:
-            cols = self.num_fragments
-        elif self.num_fragments <= 8:
-            cols = 4
-        else:
-            cols = 5
+        # Widget state is kept per fragment set, so switching images starts from their own first page
+        key = f"fragments_{self.cache_key[1][:12]}"
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            order = st.selectbox("Sort by", list(FRAGMENT_ORDERS), key=f"{key}_order")
+        with col2:
+            page_size = st.selectbox("Per page", config.FRAGMENT_PAGE_SIZES, key=f"{key}_page_size")
+        num_pages = math.ceil(self.num_fragments / page_size)
+        with col3:
+            page = st.number_input(
+                f"Page (of {num_pages})", min_value=1, max_value=num_pages, step=1,
+                key=f"{key}_page_{order}_{page_size}"
+            )
+
+        start = (page - 1) * page_size
+        indices = self._sorted_indices(order)[start:start + page_size]
+        self._show_cached_figure(
+            ("fragment_page", order, page_size, page),
+            lambda: self._render_montage(indices),
+            caption=f"Fragments {start + 1}-{start + len(indices)} of {self.num_fragments}"
+        )
+        st.dataframe(self._page_table(indices), use_container_width=True, hide_index=True)
+
+    def _sorted_indices(self, order):
+        """Fragment indices in the selected display order"""
+        sort_key, reverse = FRAGMENT_ORDERS[order]
+        if sort_key is None:
+            return list(range(self.num_fragments))
+        return sorted(range(self.num_fragments), key=lambda i: sort_key(self.fragments[i]), reverse=reverse)
+
+    def _page_table(self, indices):
+        """Size, score and mask metrics of the fragments shown on the page"""
+        rows = []
+        for i in indices:
+            fragment = self.fragments[i]
+            metrics = fragment.get("metrics") or {}
+            rows.append({
+                "#": i + 1,
+                "Size (cm)": round(fragment_size(fragment), 1),
+                "Score": round(fragment.get("score", 0.0), 3),
+                "Area (px²)": round(metrics.get("area", 0.0), 1),
+                "Perimeter (px)": round(metrics.get("perimeter", 0.0), 1),
+                "Circularity": round(metrics.get("circularity", 0.0), 2),
+            })
+        return rows
+
+    def _render_montage(self, indices):
+        """Tile the page's fragment crops into one image, so the cost depends on the page size only"""
+        tile = config.MONTAGE_TILE_SIZE
+        columns = min(config.MONTAGE_COLUMNS, len(indices))
+        rows = math.ceil(len(indices) / columns)
+        montage = np.full((rows * tile, columns * tile, 3), 255, dtype=np.uint8)
+
+        image = self._rgb_image()
+        for n, i in enumerate(indices):
+            row, col = divmod(n, columns)
+            montage[row*tile:(row+1)*tile, col*tile:(col+1)*tile] = self._render_fragment_tile(i, image, tile)
+        return montage
+
+    def _render_fragment_tile(self, i, image, size):
+        """Crop of one fragment with its mask tinted in the fragment color, fitted into a size x size tile"""
+        fragment = self.fragments[i]
+        color = hex_to_rgb(self.colors[i])
+        tile = np.full((size, size, 3), 245, dtype=np.uint8)
+        label_height, padding = 18, 4
+
+        bbox = fragment.get("bbox", None)
+        if bbox:
+            x1, y1, x2, y2 = bbox
+            crop = image[max(y1, 0):y2, max(x1, 0):x2].astype(np.float32)
+            if crop.size:
+                if mask_data := fragment.get("mask_data", None):
+                    mask = decode_rle(mask_data.get("rle", []), mask_data.get("shape", [y2-y1, x2-x1]))
+                    inside = mask[:crop.shape[0], :crop.shape[1]] > 0
+                    crop[inside] = crop[inside] * 0.5 + np.array(color, dtype=np.float32) * 0.5
+
+                # Fit the crop below the label, keeping its aspect ratio
+                crop_h, crop_w = crop.shape[:2]
+                scale = min((size - 2 * padding) / crop_w, (size - label_height - 2 * padding) / crop_h)
+                new_w, new_h = max(1, round(crop_w * scale)), max(1, round(crop_h * scale))
+                resized = cv2.resize(
+                    crop.astype(np.uint8), (new_w, new_h),
+                    interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_NEAREST
+                )
+                top = label_height + padding + (size - label_height - 2 * padding - new_h) // 2
+                left = (size - new_w) // 2
+                tile[top:top + new_h, left:left + new_w] = resized
 
-        # Create grid of columns for displaying masks
-        mask_cols = st.columns(min(cols, self.num_fragments))
+        cv2.rectangle(tile, (0, 0), (size - 1, size - 1), color, 2)
+        cv2.putText(
+            tile, f"#{i+1}: {fragment_size(fragment):.1f} cm", (padding + 2, label_height - 4),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1, cv2.LINE_AA
+        )
+        return tile
 
-        for i, fragment in enumerate(self.fragments):
-            col_idx = i % cols
-
-            with mask_cols[col_idx]:
-                # Get bounding box and mask data
-                bbox = fragment.get("bbox", None)
-                mask_data = fragment.get("mask_data", None)
-
-                if bbox and mask_data:
-                    # Extract mask parameters
-                    x1, y1, x2, y2 = bbox
-                    mask_rle = mask_data.get("rle", [])
-                    mask_shape = mask_data.get("shape", [y2-y1, x2-x1])
-
-                    # Create binary mask from RLE
-                    mask = self._rle_to_binary_mask(mask_rle, mask_shape)
-
-                    # Create visualization
-                    fig, ax = plt.subplots(figsize=(3, 3))
-
-                    # Create a cropped view of the original image
-                    cropped_img = self.img_array[y1:y2, x1:x2]
-
-                    # Apply the mask as an overlay
-                    overlay = np.zeros_like(cropped_img)
-                    if cropped_img.ndim == 3:  # Color image
-                        overlay[:, :, 0] = mask * 255  # Red channel
-                        overlay = overlay.astype(np.uint8)
-                        alpha = 0.5
-                        img_with_mask = cv2.addWeighted(cropped_img, 1, overlay, alpha, 0)
-                        ax.imshow(img_with_mask)
-                    else:  # Grayscale image
-                        ax.imshow(cropped_img, cmap='gray')
-                        ax.imshow(mask, alpha=0.5, cmap=ListedColormap(['none', self.colors[i]]))
-
-                    # Remove axis labels
-                    ax.set_xticks([])
-                    ax.set_yticks([])
-
-                    # Add fragment number and size
-                    fragment_size = fragment.get("size_cm", 0)
-                    ax.set_title(f"#{i+1}: {fragment_size:.1f} cm", fontsize=10)
-
-                    st.pyplot(fig)
-                    plt.close(fig)
-
-                    if metrics := fragment.get("metrics", None):
-                        metrics_html = f"""
-                        <div class="fragment-metrics">
-                            <span class="fragment-tag" style="background-color: {self.colors[i]}">#{i+1}</span>
-                            <strong>Size:</strong> {fragment_size:.1f} cm<br>
-                            <strong>Area:</strong> {metrics.get('area', 0):.1f} px²<br>
-                            <strong>Perimeter:</strong> {metrics.get('perimeter', 0):.1f} px<br>
-                            <strong>Circularity:</strong> {metrics.get('circularity', 0):.2f}
-                        </div>
-                        """
-                        st.markdown(metrics_html, unsafe_allow_html=True)
-                else:
-                    st.write(f"Fragment #{i+1}")
-                    st.write("No mask data available")
-    
     def _generate_colors(self, n):
-        """Generate n visually distinct colors"""
+        """Generate n visually distinct colors, the same ones for the same n on every rerun"""
+        rng = random.Random(n)
         colors = []
         for i in range(n):
             # Use HSV color space for better visual distinction
             hue = i / n
-            saturation = 0.7 + random.random() * 0.3
-            value = 0.7 + random.random() * 0.3
+            saturation = 0.7 + rng.random() * 0.3
+            value = 0.7 + rng.random() * 0.3
             
             # Convert HSV to RGB
             h = hue * 6
@@ -336,18 +417,6 @@ class FragmentVisualizer:
         
         return colors
     
-    def _rle_to_binary_mask(self, rle, shape):
-        """Convert run-length encoding back to binary mask."""
-        height, width = shape
-        mask = np.zeros(height * width, dtype=np.uint8)
-        
-        for start, length in rle:
-            if 0 <= start < len(mask) and length > 0:
-                end = min(start + length, len(mask))
-                mask[start:end] = 1
-        
-        return mask.reshape(height, width)
-
 # For backward compatibility
 def create_thumbnail(image_file, max_size=(100, 100)):
     """Create a thumbnail from an image file"""
@@ -0,0 +1,11 @@
+"""Mask encodings shared by the model API and the dashboard."""
+from maskcodec.codec import (
+    decode_label_map,
+    decode_label_map_rle,
+    decode_rle,
+    decode_rle_into,
+    encode_label_map,
+    encode_label_map_rle,
+    encode_polygon,
+    encode_rle,
+)
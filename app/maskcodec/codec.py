@@ -0,0 +1,156 @@
+import base64
+import cv2 # type: ignore
+import numpy as np
+
+# ============= Binary masks: RLE =============
+def encode_rle(mask: np.ndarray) -> list:
+    """Convert binary mask to run-length encoding format.
+    Returns a list of [start, length] pairs where start is the index (in the
+    flattened mask) of the first 1 and length is the number of consecutive 1s."""
+    flat = np.asarray(mask).ravel() != 0
+    # Pad with 0 on both sides so every run has a rising and a falling edge
+    padded = np.concatenate(([False], flat, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    return np.stack([starts, ends - starts], axis=1).tolist()
+
+def _clip_runs(runs: np.ndarray, size: int):
+    """Drop runs starting outside [0, size) or with no length, and cut runs at `size`,
+    the same rules as the original per-run decoder. Returns (starts, lengths, kept)."""
+    starts, lengths = runs[:, 0], runs[:, 1]
+    kept = (starts >= 0) & (starts < size) & (lengths > 0)
+    starts = starts[kept]
+    lengths = np.minimum(starts + lengths[kept], size) - starts
+    return starts, lengths, kept
+
+def _run_pixels(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Flat indices covered by the runs: start, start + 1, ..., start + length - 1 for every run."""
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+
+def _rle_pixels(rle, size: int) -> np.ndarray:
+    runs = np.asarray(rle, dtype=np.int64).reshape(-1, 2)
+    starts, lengths, _ = _clip_runs(runs, size)
+    return _run_pixels(starts, lengths)
+
+def decode_rle(rle, shape) -> np.ndarray:
+    """Convert run-length encoding back to binary mask.
+    Args:
+        rle: List of [start, length] pairs
+        shape: [height, width] of the mask
+    Returns:
+        Binary uint8 mask of shape (height, width)
+    """
+    height, width = shape
+    mask = np.zeros(height * width, dtype=np.uint8)
+    mask[_rle_pixels(rle, mask.size)] = 1
+    return mask.reshape(height, width)
+
+def decode_rle_into(rle, shape, out: np.ndarray, offset, value=1) -> np.ndarray:
+    """Paint a cropped RLE mask straight into a larger buffer.
+    Args:
+        rle: List of [start, length] pairs of the cropped mask
+        shape: [height, width] of the cropped mask
+        out: Preallocated full-frame array, modified in place
+        offset: (x, y) of the crop's top-left corner in `out`, i.e. bbox[:2]
+        value: Value written for mask pixels, e.g. an instance id
+    Returns:
+        `out`. Pixels falling outside of it are dropped.
+    """
+    height, width = shape
+    x, y = offset
+    pixels = _rle_pixels(rle, height * width)
+    rows = pixels // width + y
+    cols = pixels % width + x
+    inside = (rows >= 0) & (rows < out.shape[0]) & (cols >= 0) & (cols < out.shape[1])
+    out[rows[inside], cols[inside]] = value
+    return out
+
+# ============= Instance-ID images (label maps) =============
+def encode_label_map_rle(label_map: np.ndarray) -> list:
+    """Convert an instance-ID image to run-length encoding.
+    Returns a list of [start, length, value] triples for every non-zero run
+    of the flattened image."""
+    flat = label_map.ravel()
+    if flat.size == 0:
+        return []
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(flat)) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    values = flat[starts]
+    keep = values != 0
+    return np.stack([starts[keep], lengths[keep], values[keep]], axis=1).tolist()
+
+def decode_label_map_rle(rle, shape, dtype=np.uint16) -> np.ndarray:
+    """Inverse of encode_label_map_rle."""
+    height, width = shape
+    label_map = np.zeros(height * width, dtype=dtype)
+    runs = np.asarray(rle, dtype=np.int64).reshape(-1, 3)
+    starts, lengths, kept = _clip_runs(runs, label_map.size)
+    # Every pixel takes the value of the run it falls in
+    label_map[_run_pixels(starts, lengths)] = np.repeat(runs[kept, 2], lengths)
+    return label_map.reshape(height, width)
+
+def encode_label_map(label_map: np.ndarray, encoding: str = "png") -> dict:
+    """Compress a uint16 instance-ID image for transport ('png' or 'rle')."""
+    encoded = {
+        "encoding": encoding,
+        "shape": list(label_map.shape),
+        "dtype": "uint16"
+    }
+    if encoding == "png":
+        ok, buffer = cv2.imencode(".png", label_map.astype(np.uint16, copy=False))
+        if not ok:
+            raise ValueError("Failed to encode label map as PNG")
+        encoded["data"] = base64.b64encode(buffer.tobytes()).decode("ascii")
+    elif encoding == "rle":
+        encoded["rle"] = encode_label_map_rle(label_map)
+    else:
+        raise ValueError(f"Unknown label map encoding: {encoding}")
+    return encoded
+
+def decode_label_map(encoded: dict) -> np.ndarray:
+    """Inverse of encode_label_map."""
+    if encoded["encoding"] == "png":
+        buffer = np.frombuffer(base64.b64decode(encoded["data"]), dtype=np.uint8)
+        return cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    if encoded["encoding"] == "rle":
+        return decode_label_map_rle(encoded["rle"], encoded["shape"])
+    raise ValueError(f"Unknown label map encoding: {encoded['encoding']}")
+
+# ============= Outlines =============
+def encode_polygon(mask: np.ndarray, bbox, tolerance: float = 1.0) -> list:
+    """Trace the outline of a binary mask inside its bounding box, as a multi-polygon:
+    one entry per separate part, each a list of rings (the outer boundary, then its
+    holes), each ring a list of [x, y] points in image coordinates simplified with
+    Douglas-Peucker at the given pixel tolerance. Same layout as GeoJSON MultiPolygon
+    coordinates, without repeating the first point at the end of a ring."""
+    x1, y1, x2, y2 = bbox
+    # Trace on the bbox crop only, contour points are shifted back to the full frame
+    cropped_mask = np.ascontiguousarray(mask[y1:y2, x1:x2], dtype=np.uint8)
+    if cropped_mask.size == 0:
+        return []
+
+    # Two-level hierarchy: outer boundaries, and the holes inside each of them
+    contours, hierarchy = cv2.findContours(cropped_mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=(x1, y1))
+    if not contours:
+        return []
+
+    def ring(contour):
+        if tolerance > 0:
+            contour = cv2.approxPolyDP(contour, tolerance, True)
+        return contour.reshape(-1, 2).tolist()
+
+    # hierarchy rows are [next, previous, first child, parent]
+    links = hierarchy[0]
+    polygons = []
+    for index, (_, _, child, parent) in enumerate(links):
+        if parent != -1:
+            continue
+        rings = [ring(contours[index])]
+        while child != -1:
+            rings.append(ring(contours[child]))
+            child = links[child][0]
+        polygons.append(rings)
+    # Largest part first, like the single outline this used to return
+    polygons.sort(key=lambda rings: -cv2.contourArea(np.asarray(rings[0], dtype=np.int32)))
+    return polygons
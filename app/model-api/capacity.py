@@ -0,0 +1,41 @@
+"""CPUs available to the container, and how to split them between processes and
+ONNX Runtime threads. Shared by the server launcher and the offline batch CLI."""
+import os
+from typing import Tuple
+
+def cpu_quota() -> float:
+    """Number of CPUs this container may use: CPU_QUOTA, the cgroup quota, or the host count."""
+    if os.getenv("CPU_QUOTA"):
+        return float(os.environ["CPU_QUOTA"])
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return float(os.cpu_count() or 1)
+
+def plan_workers(cpus: float) -> Tuple[int, int]:
+    """Split the CPUs into (workers, ONNX Runtime intra-op threads per worker).
+    WEB_CONCURRENCY and ORT_INTRA_OP_THREADS override either side."""
+    threads = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+    workers = int(os.getenv("WEB_CONCURRENCY", "0"))
+    if not workers:
+        per_worker = threads or int(os.getenv("ORT_THREADS_PER_WORKER", "2"))
+        workers = min(int(os.getenv("MAX_WORKERS", "4")), int(cpus // per_worker))
+    workers = max(1, workers)
+    if not threads:
+        threads = max(1, int(cpus // workers))
+    return workers, threads
@@ -0,0 +1,170 @@
+"""Logging of the model API.
+
+Records are handed to a queue on the thread that logs them and written by a
+single listener thread, so formatting, the console and app.log never hold up a
+request. Each record carries the context of the request that produced it
+(see log_context). Per-fragment messages go through sampled loggers, which let
+a few records of each kind through and count the rest.
+
+    LOG_LEVEL   INFO by default
+    LOG_FORMAT  "text" (default) or "json", one object per line
+    LOG_FILE    app.log by default, empty to log to the console only
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+# Records waiting for the listener, beyond this new ones are dropped rather than blocking requests
+QUEUE_SIZE = 10000
+
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields (request_id, client, ...) to the records logged inside the block,
+    including those of tasks it starts and of the session pool threads it submits to."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def bind_log_context(**fields):
+    """Attach fields to the records logged by the current task from now on."""
+    _context.set({**_context.get(), **fields})
+
+class ContextFilter(logging.Filter):
+    """Copies the request context onto the record while still on the logging thread."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.__dict__.update(_context.get())
+        if not hasattr(record, "request_id"):
+            record.request_id = "-"
+        return True
+
+class AsyncQueueHandler(QueueHandler):
+    """Enqueues records without blocking. When the listener cannot keep up, records are
+    dropped and counted instead of piling up in memory."""
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments now, they may change once the call returns.
+        # The format string, timestamp and traceback are rendered by the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request context and any `extra` fields."""
+    STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.STANDARD})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most `burst` records of each message template through every `period` seconds.
+    The next record let through says how many were suppressed meanwhile."""
+    def __init__(self, burst: int = 5, period: float = 10.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._windows: Dict[Tuple[str, str], list] = {}  # template -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+def sampled_logger(name: str, burst: int = 5, period: float = 10.0) -> logging.Logger:
+    """Logger for messages repeated for every fragment of every image."""
+    logger = logging.getLogger(name)
+    if not any(isinstance(f, RateLimitFilter) for f in logger.filters):
+        logger.addFilter(RateLimitFilter(burst, period))
+    return logger
+
+_handler: Optional[AsyncQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+def setup_logging():
+    """Route every record of this process through the queue. Safe to call more than once,
+    forked server workers get their own listener thread."""
+    global _handler, _listener
+    if _handler is not None:
+        return
+
+    formatter = JsonFormatter() if os.getenv("LOG_FORMAT", "text") == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    log_file = os.getenv("LOG_FILE", "app.log")
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _handler = AsyncQueueHandler(queue.Queue(QUEUE_SIZE))
+    _handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    # The listener thread does not survive a fork, the child starts its own
+    os.register_at_fork(after_in_child=_restart_listener)
+
+def _restart_listener():
+    global _listener
+    _handler.queue = queue.Queue(QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+def stop_logging():
+    """Write the records still queued."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
@@ -1,38 +1,57 @@
+from logging_config import log_context, setup_logging
+# Before the routers are imported, they already log while loading the model
+setup_logging()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from routers import predict
+from routers import history, predict, shm, stream, video
+from routers.core.deadline import Deadline
+from metrics import monitor_event_loop_lag, start_metrics_server
 import uvicorn
 import logging
 import asyncio
+import functools
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 import os
+import uuid
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('app.log')
-    ]
-)
 logger = logging.getLogger(__name__)
 
+REQUEST_ID_HEADER = "X-Request-ID"
+
 # Add timeout middleware
 class TimeoutMiddleware(BaseHTTPMiddleware):
+    # Extra time given to the endpoint so it can answer with its own (possibly partial) response
+    GRACE_PERIOD = 1.0
+
     async def dispatch(self, request: Request, call_next):
-        try:
-            return await asyncio.wait_for(call_next(request), timeout=60.0)
-        except asyncio.TimeoutError:
-            return JSONResponse(
-                status_code=504,
-                content={"detail": "Request timeout"}
-            )
+        # Attach the request deadline so every stage downstream shares the same budget
+        deadline = Deadline.from_headers(
+            request.headers, predict.MODEL_CONFIG.timeout, predict.MODEL_CONFIG.max_timeout
+        )
+        request.state.deadline = deadline
+        # Every record logged for this request carries its id, the client gets it back
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex[:16]
+        client = request.client.host if request.client else None
+        with log_context(request_id=request_id, client=client, path=request.url.path):
+            try:
+                response = await asyncio.wait_for(call_next(request), timeout=deadline.remaining() + self.GRACE_PERIOD)
+            except asyncio.TimeoutError:
+                predict.timeout_counter.add(1, {"stage": "response"})
+                logger.warning("Request exceeded its deadline of %.1fs", deadline.timeout)
+                response = JSONResponse(
+                    status_code=504,
+                    content={"detail": "Request timeout"}
+                )
+        response.headers[REQUEST_ID_HEADER] = request_id
+        return response
 
 # Create FastAPI app with optimized settings
 app = FastAPI()
+# Started with the event loop, see startup()
+loop_lag_monitor = None
 
 # Add middleware
 app.add_middleware(TimeoutMiddleware)
@@ -49,6 +68,41 @@ app.include_router(
     predict.router,
     tags=["prediction"]
 )
+app.include_router(
+    video.router,
+    tags=["prediction"]
+)
+app.include_router(
+    stream.router,
+    tags=["prediction"]
+)
+app.include_router(
+    shm.router,
+    tags=["prediction"]
+)
+app.include_router(
+    history.router,
+    tags=["history"]
+)
+
+@app.on_event("startup")
+async def startup():
+    # Runs in every worker process after the fork
+    start_metrics_server()
+    predict.get_session()
+    global loop_lag_monitor
+    loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if loop_lag_monitor is not None:
+        loop_lag_monitor.cancel()
+    # Let inferences that are still running finish before the worker exits
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(predict.SESSION_POOL.shutdown, wait=True))
+    logger.info("Session pool drained")
+    if predict.HISTORY is not None:
+        # Write the fragments still buffered
+        predict.HISTORY.close()
 
 @app.get("/health")
 async def health_check():
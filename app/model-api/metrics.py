@@ -1,19 +1,65 @@
+import asyncio
+import os
 from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.view import ExplicitBucketHistogramAggregation, View
 from opentelemetry.exporter.prometheus import PrometheusMetricReader
 from prometheus_client import start_http_server
 
-# Start Prometheus client
-start_http_server(port=8099, addr="0.0.0.0")
-
 # Create resource and exporter
 resource = Resource(attributes={SERVICE_NAME: "gdgaic-lossteach-model"})
 reader = PrometheusMetricReader()
-provider = MeterProvider(resource=resource, metric_readers=[reader])
+MB = 1024 * 1024
+# Default buckets are sized for seconds, memory histograms need byte sized ones
+memory_view = View(
+    instrument_name="predict_memory_*_bytes",
+    aggregation=ExplicitBucketHistogramAggregation(
+        [MB * size for size in (4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)]
+    ),
+)
+provider = MeterProvider(resource=resource, metric_readers=[reader], views=[memory_view])
 
 # Set global provider
 metrics.set_meter_provider(provider)
 
 # Create and expose meter
-meter = metrics.get_meter("lossteach-ggaic", "1.0")
\ No newline at end of file
+meter = metrics.get_meter("lossteach-ggaic", "1.0")
+
+_loop_lag = 0.0
+
+async def monitor_event_loop_lag(interval: float = 0.25):
+    """Sleep for `interval` over and over, any extra delay before waking up is time the
+    event loop was busy with something else, e.g. blocking code in a handler."""
+    global _loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        _loop_lag = max(_loop_lag, loop.time() - started - interval)
+
+def observe_event_loop_lag(options: CallbackOptions):
+    # The largest lag since the last scrape, so short stalls between scrapes are not missed
+    global _loop_lag
+    lag, _loop_lag = _loop_lag, 0.0
+    yield Observation(lag)
+
+meter.create_observable_gauge(
+    name="event_loop_lag_seconds",
+    callbacks=[observe_event_loop_lag],
+    description="Largest delay of the asyncio event loop since the last scrape",
+    unit="seconds",
+)
+
+_server_pid = None
+
+def start_metrics_server():
+    """Start the Prometheus client of this process.
+    Every server worker is a separate process with its own metrics, so the
+    launcher gives each one its own METRICS_PORT."""
+    global _server_pid
+    if _server_pid == os.getpid():
+        return
+    start_http_server(port=int(os.getenv("METRICS_PORT", "8099")), addr="0.0.0.0")
+    _server_pid = os.getpid()
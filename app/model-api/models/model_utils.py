@@ -1,16 +1,26 @@
 import logging
+import os
+import tempfile
 import traceback
+import numpy as np
 import onnxruntime as ort
 from pathlib import Path
+from typing import Optional, Union
 
 logger = logging.getLogger(__name__)
 
 # Get the model path
 MODEL_PATH = Path(__file__).parent / "model.onnx"
+# Extra input of graphs exported with pth_to_onnx.py --fused
+SCORE_THRESHOLD_INPUT = "score_threshold"
+# Mask output of graphs exported with pth_to_onnx.py --roi_masks
+ROI_MASKS_OUTPUT = "roi_masks"
+# Weights file written next to a model by share_model_weights, ONNX Runtime maps it into memory
+EXTERNAL_DATA_SUFFIX = ".data"
 
 def load_model(filepath=None, device=None):
     try:
-        return try_load_model(MODEL_PATH)
+        return try_load_model(filepath or MODEL_PATH)
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
         logger.error(traceback.format_exc())
@@ -18,7 +28,7 @@ def load_model(filepath=None, device=None):
 
 def try_load_model(filepath):
     # Create an ONNX Runtime session
-    session = ort.InferenceSession(str(filepath))
+    session = create_session(load_model_bytes(filepath))
     
     # Get the input name(s) for the model
     input_name = session.get_inputs()[0].name
@@ -28,5 +38,97 @@ def try_load_model(filepath):
     
     return session, input_name
 
-# Load the model
-model, input_name = load_model()
\ No newline at end of file
+def load_model_bytes(filepath) -> bytes:
+    """Read the model once. When this happens before the server forks its workers,
+    the buffer is shared copy-on-write between all of them, the sessions built from it
+    still copy the weights. Works for .onnx files and for pre-optimized .ort files
+    (onnxruntime.tools.convert_onnx_models_to_ort)."""
+    with open(filepath, "rb") as f:
+        return f.read()
+
+def has_external_weights(filepath) -> bool:
+    return os.path.exists(f"{filepath}{EXTERNAL_DATA_SUFFIX}")
+
+def load_model_source(filepath) -> Union[bytes, str]:
+    """What sessions are built from: the path of a model with external weights, which ONNX
+    Runtime maps into memory so every process shares their pages, otherwise the bytes."""
+    if has_external_weights(filepath):
+        return str(filepath)
+    return load_model_bytes(filepath)
+
+def share_model_weights(filepath, output_dir: str) -> str:
+    """Write a copy of an .onnx model whose weights worker processes share, and return its path.
+
+    ONNX Runtime copies the weights of a model into every session, and rewrites some of them
+    (e.g. the blocked layout of convolutions) into more private copies while optimizing it.
+    Here the model is optimized once, and the weights of the optimized graph are moved into
+    a file next to it. Sessions built from that path map the file instead of copying it,
+    and find nothing left to rewrite. The optimized graph may use instructions of this CPU,
+    so it is written where it runs, before the workers start. Needs the onnx package."""
+    import onnx
+
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.join(output_dir, f"{Path(filepath).stem}.shared.onnx")
+    weights_name = f"{Path(output).name}{EXTERNAL_DATA_SUFFIX}"
+    with tempfile.TemporaryDirectory(dir=output_dir) as work_dir:
+        options = ort.SessionOptions()
+        # No thread pool is left behind in a process that is about to fork
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        options.optimized_model_filepath = os.path.join(work_dir, "optimized.onnx")
+        ort.InferenceSession(str(filepath), sess_options=options, providers=['CPUExecutionProvider'])
+
+        staged = os.path.join(work_dir, "model.onnx")
+        # The weights file is found relative to the model, it is named after the final one
+        onnx.save_model(
+            onnx.load(options.optimized_model_filepath), staged, save_as_external_data=True,
+            all_tensors_to_one_file=True, location=weights_name, size_threshold=1024
+        )
+        os.replace(os.path.join(work_dir, weights_name), os.path.join(output_dir, weights_name))
+        os.replace(staged, output)
+    logger.info("Wrote %s with shared weights", output)
+    return output
+
+def create_session(
+    model: Union[bytes, str],
+    intra_op_threads: int = 0,
+    providers: Optional[list] = None,
+    thread_affinities: Optional[str] = None,
+    allow_spinning: bool = True,
+) -> ort.InferenceSession:
+    options = ort.SessionOptions()
+    if intra_op_threads > 0:
+        options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = 1
+    if thread_affinities and intra_op_threads > 1:
+        # CPUs of intra-op threads 1..n-1, e.g. "3;4" (1-based ids, thread 0 is the caller)
+        options.add_session_config_entry("session.intra_op_thread_affinities", thread_affinities)
+    if not allow_spinning:
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    # session.use_ort_model_bytes_directly and use_ort_model_bytes_for_initializers would leave
+    # the weights of an .ort model in the bytes, but the Python binding hands ONNX Runtime a
+    # temporary copy of the bytes: the initializers would point into freed memory and the
+    # outputs come back as zeros or NaN. Weights are shared through share_model_weights instead.
+
+    return ort.InferenceSession(
+        model,
+        sess_options=options,
+        providers=providers or ['CPUExecutionProvider']  # Can be extended to include CUDA provider
+    )
+
+def has_fused_postprocess(session: ort.InferenceSession) -> bool:
+    """True for graphs that filter by score and binarize masks themselves (pth_to_onnx.py --fused).
+    They only return the detections above the threshold, with uint8 masks."""
+    return any(model_input.name == SCORE_THRESHOLD_INPUT for model_input in session.get_inputs())
+
+def has_roi_masks(session: ort.InferenceSession) -> bool:
+    """True for graphs that return the M x M mask of each detection instead of masks pasted
+    into the full frame (pth_to_onnx.py --roi_masks)."""
+    return session.get_outputs()[-1].name == ROI_MASKS_OUTPUT
+
+def model_inputs(session: ort.InferenceSession, image_tensor: np.ndarray, score_threshold: float) -> dict:
+    """Feed of a session run, with the score threshold for fused graphs."""
+    inputs = {session.get_inputs()[0].name: image_tensor}
+    if has_fused_postprocess(session):
+        inputs[SCORE_THRESHOLD_INPUT] = np.array(score_threshold, dtype=np.float32)
+    return inputs
@@ -3,6 +3,11 @@ from torchvision.models.detection import maskrcnn_resnet50_fpn_v2, MaskRCNN_ResN
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 from torchvision.models.detection.mask_rcnn import MaskRCNNPredictor
 
+# Extra input of graphs exported with --fused, the API detects it by this name (models/model_utils.py)
+SCORE_THRESHOLD_INPUT = 'score_threshold'
+# Mask output of graphs exported with --roi_masks, detected by name as well
+ROI_MASKS_OUTPUT = 'roi_masks'
+
 def build_model(num_classes):
     weights = MaskRCNN_ResNet50_FPN_V2_Weights.COCO_V1
     model = maskrcnn_resnet50_fpn_v2(weights=weights)
@@ -13,25 +18,106 @@ def build_model(num_classes):
     model.roi_heads.mask_predictor = MaskRCNNPredictor(in_features_mask, hidden_layer, num_classes)
     return model
 
-def convert_pth_to_onnx(pth_path, onnx_path, num_classes=2, input_shape=(1, 3, 512, 512), device='cpu'):
+def detect_with_roi_masks(model, images):
+    """Mask R-CNN up to the mask head: detections with boxes in input coordinates, and the
+    M x M (28 x 28) mask probabilities of each detection instead of masks pasted into the
+    full frame."""
+    original_sizes = [image.shape[-2:] for image in images]
+    image_list, _ = model.transform(images)
+    features = model.backbone(image_list.tensors)
+    proposals, _ = model.rpn(image_list, features)
+    detections, _ = model.roi_heads(features, proposals, image_list.image_sizes)
+    masks = detections[0].pop("masks")
+    detections = model.transform.postprocess(detections, image_list.image_sizes, original_sizes)
+    return detections[0], masks
+
+class RoiMaskOutputs(torch.nn.Module):
+    """Mask R-CNN returning per-detection ROI masks, the API pastes them into the frame
+    only for the fragments and outputs that need pixels.
+    Outputs keep the positions the API reads: boxes, scores, labels, masks."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        detections, masks = detect_with_roi_masks(self.model, images)
+        return detections["boxes"], detections["scores"], detections["labels"], masks
+
+class FusedPostprocess(torch.nn.Module):
+    """Mask R-CNN with the API post-processing folded into the graph. Detections scoring at
+    or below the `score_threshold` input are dropped and masks are binarized to uint8, so only
+    the surviving detections leave ONNX Runtime, at a quarter of the size of float32 masks.
+    With roi_masks the masks stay M x M probabilities, binarized by the API after pasting.
+    Outputs keep the positions the API reads: boxes, scores, labels, masks."""
+    def __init__(self, model, mask_threshold=0.5, roi_masks=False):
+        super().__init__()
+        self.model = model
+        self.mask_threshold = mask_threshold
+        self.roi_masks = roi_masks
+
+    def forward(self, images, score_threshold):
+        if self.roi_masks:
+            detections, masks = detect_with_roi_masks(self.model, images)
+        else:
+            detections = self.model(images)[0]
+            masks = detections["masks"]
+        keep = detections["scores"] > score_threshold
+        masks = masks[keep]
+        if not self.roi_masks:
+            masks = (masks > self.mask_threshold).to(torch.uint8)
+        return detections["boxes"][keep], detections["scores"][keep], detections["labels"][keep], masks
+
+def convert_pth_to_onnx(pth_path, onnx_path, num_classes=2, input_shape=(1, 3, 512, 512), device='cpu',
+                        fused=False, mask_threshold=0.5, roi_masks=False):
     model = build_model(num_classes)
     state_dict = torch.load(pth_path, map_location=device)
     model.load_state_dict(state_dict)
+    export_onnx(model, onnx_path, input_shape, device, fused, mask_threshold, roi_masks)
+
+def export_onnx(model, onnx_path, input_shape=(1, 3, 512, 512), device='cpu', fused=False, mask_threshold=0.5,
+                roi_masks=False):
     model.eval()
     model.to(device)
 
     dummy_input = torch.randn(*input_shape, device=device)
-    # Export only the raw outputs (no postprocessing)
-    torch.onnx.export(
-        model,
-        dummy_input,
-        onnx_path,
-        input_names=['input'],
-        output_names=['boxes', 'labels', 'scores', 'masks'],
-        opset_version=11,
-        do_constant_folding=True,
-        dynamic_axes={'input': {0: 'batch_size'}}
-    )
+    masks_output = ROI_MASKS_OUTPUT if roi_masks else 'masks'
+    output_names = ['boxes', 'scores', 'labels', masks_output]
+    detections = {name: {0: 'detections'} for name in output_names}
+    if fused:
+        # Score filtering and mask binarization run inside the graph
+        torch.onnx.export(
+            FusedPostprocess(model, mask_threshold, roi_masks),
+            (dummy_input, torch.tensor(0.5, device=device)),
+            onnx_path,
+            input_names=['input', SCORE_THRESHOLD_INPUT],
+            output_names=output_names,
+            opset_version=11,
+            do_constant_folding=True,
+            dynamic_axes={'input': {0: 'batch_size'}, **detections}
+        )
+    elif roi_masks:
+        torch.onnx.export(
+            RoiMaskOutputs(model),
+            dummy_input,
+            onnx_path,
+            input_names=['input'],
+            output_names=output_names,
+            opset_version=11,
+            do_constant_folding=True,
+            dynamic_axes={'input': {0: 'batch_size'}, **detections}
+        )
+    else:
+        # Export only the raw outputs (no postprocessing)
+        torch.onnx.export(
+            model,
+            dummy_input,
+            onnx_path,
+            input_names=['input'],
+            output_names=['boxes', 'labels', 'scores', 'masks'],
+            opset_version=11,
+            do_constant_folding=True,
+            dynamic_axes={'input': {0: 'batch_size'}}
+        )
     print(f"Exported to {onnx_path}")
 
 if __name__ == "__main__":
@@ -41,11 +127,17 @@ if __name__ == "__main__":
     parser.add_argument('--onnx', type=str, required=True, help='Output ONNX file')
     parser.add_argument('--num_classes', type=int, default=2, help='Number of classes (including background)')
     parser.add_argument('--input_size', type=int, nargs=2, default=[512, 512], help='Input H W')
+    parser.add_argument('--fused', action='store_true', help='Filter by a score_threshold input and binarize masks inside the graph')
+    parser.add_argument('--mask_threshold', type=float, default=0.5, help='Mask probability threshold of --fused graphs')
+    parser.add_argument('--roi_masks', action='store_true', help='Return the 28x28 mask of each detection instead of pasting it into the full frame')
     args = parser.parse_args()
 
     convert_pth_to_onnx(
         args.pth,
         args.onnx,
         num_classes=args.num_classes,
-        input_shape=(1, 3, args.input_size[0], args.input_size[1])
+        input_shape=(1, 3, args.input_size[0], args.input_size[1]),
+        fused=args.fused,
+        mask_threshold=args.mask_threshold,
+        roi_masks=args.roi_masks
     )
\ No newline at end of file
@@ -0,0 +1,324 @@
+"""Offline batch analysis of archived images, without going through HTTP.
+
+Walks directories, .zip and .tar archives for images and runs every image through
+the same pipeline as /predict (preprocessing, inference, process_masks, mask
+metrics and size analytics). The work is sharded in chunks over a pool of worker
+processes, each with its own ONNX Runtime session sized to its share of the CPUs.
+Results are written to Parquet files in the output directory:
+
+    images/part-NNNNN.parquet     one row per image (fragment count, size statistics, error)
+    fragments/part-NNNNN.parquet  one row per fragment (bbox, score, size, mask metrics)
+
+Every finished chunk is written as its own part, so an interrupted run continues
+where it stopped when started again with the same output directory. Images that
+failed are analysed again, their earlier row with the error stays in its part.
+
+    python offline.py /data/blasts/2019 /data/blasts/2020.zip --output results/
+"""
+import argparse
+import functools
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import tarfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterator, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from capacity import cpu_quota
+from models.model_utils import has_external_weights, share_model_weights
+from routers.core.config import ModelConfig
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+ARCHIVE_SEPARATOR = "/"  # Members are named "<archive>/<member>", like the dashboard batch page
+
+IMAGE_SCHEMA = pa.schema([
+    ("image", pa.string()),
+    ("width", pa.int32()),
+    ("height", pa.int32()),
+    ("fragments", pa.int32()),
+    ("min_size", pa.float64()),
+    ("max_size", pa.float64()),
+    ("mean_size", pa.float64()),
+    ("med_size", pa.float64()),
+    ("std_size", pa.float64()),
+    ("elapsed", pa.float64()),
+    ("error", pa.string()),
+])
+FRAGMENT_SCHEMA = pa.schema([
+    ("image", pa.string()),
+    ("fragment_id", pa.int32()),
+    ("x1", pa.int32()),
+    ("y1", pa.int32()),
+    ("x2", pa.int32()),
+    ("y2", pa.int32()),
+    ("score", pa.float32()),
+    ("size_cm", pa.float64()),
+    # Null when mask metrics are disabled
+    ("area", pa.float64()),
+    ("perimeter", pa.float64()),
+    ("circularity", pa.float64()),
+    ("contour_count", pa.int32()),
+])
+
+# (image name, file path, archive member or None)
+ImageRef = Tuple[str, str, Optional[str]]
+
+# ============= Listing =============
+def list_images(inputs: List[str]) -> List[ImageRef]:
+    """Every image under the given directories, archives and files. Directories are walked in
+    name order, archive members are kept in the order they are stored, so the workers read
+    compressed tars front to back instead of seeking back and decompressing them again."""
+    images = []
+    for source in inputs:
+        path = Path(source)
+        if path.is_dir():
+            for file in sorted(path.rglob("*")):
+                images.extend(list_file(file))
+        elif path.is_file():
+            images.extend(list_file(path))
+        else:
+            raise FileNotFoundError(f"No such file or directory: {source}")
+    return list(dict.fromkeys(images))
+
+def list_file(path: Path) -> List[ImageRef]:
+    if not path.is_file() or path.name.startswith("."):
+        return []
+    if path.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            members = [m.filename for m in archive.infolist() if not m.is_dir()]
+    elif path.name.lower().endswith(TAR_EXTENSIONS):
+        with tarfile.open(path) as archive:
+            members = [m.name for m in archive.getmembers() if m.isfile()]
+    else:
+        return [(str(path), str(path), None)] if is_image(path.name) else []
+    return [(f"{path}{ARCHIVE_SEPARATOR}{member}", str(path), member) for member in members if is_image(member)]
+
+def is_image(filename: str) -> bool:
+    name = os.path.basename(filename)
+    # Skip hidden files and macOS resource forks shipped in archives
+    return not name.startswith(".") and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+# ============= Output =============
+def completed_images(output: Path) -> Set[str]:
+    """Images already analysed by a previous run, without those that failed. A fragments part
+    is written before its images part, so a part without images was interrupted and is dropped."""
+    done = set()
+    image_parts = {part.name for part in (output / "images").glob("part-*.parquet")}
+    for part in (output / "fragments").glob("part-*.parquet"):
+        if part.name not in image_parts:
+            part.unlink()
+    for name in image_parts:
+        rows = pq.read_table(output / "images" / name, columns=["image", "error"]).to_pydict()
+        done.update(image for image, error in zip(rows["image"], rows["error"]) if error is None)
+    return done
+
+def next_part_index(output: Path) -> int:
+    indices = [int(part.stem.split("-")[1]) for part in (output / "images").glob("part-*.parquet")]
+    return max(indices, default=-1) + 1
+
+def write_part(output: Path, index: int, image_rows: list, fragment_rows: list):
+    name = f"part-{index:05d}.parquet"
+    write_table(pa.Table.from_pylist(fragment_rows, schema=FRAGMENT_SCHEMA), output / "fragments" / name)
+    # The images part marks the chunk as done, so it goes last
+    write_table(pa.Table.from_pylist(image_rows, schema=IMAGE_SCHEMA), output / "images" / name)
+
+def write_table(table: pa.Table, path: Path):
+    temp_path = path.with_suffix(".tmp")
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, path)
+
+# ============= Workers =============
+_predict = None
+
+def init_worker(log_level: int):
+    """Runs once in every worker process: load the pipeline and create its session."""
+    global _predict
+    # The parent handles Ctrl+C and stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level)
+
+    import cv2 # type: ignore
+    import torch
+    # Parallelism comes from the processes, only ONNX Runtime gets more than one thread
+    cv2.setNumThreads(1)
+    torch.set_num_threads(1)
+
+    from routers import predict
+    _predict = predict
+    predict.get_session()
+
+@functools.lru_cache(maxsize=8)
+def open_archive(path: str):
+    """Archives stay open for the life of the worker, tar members are indexed once. A compressed
+    tar can only seek forward cheaply, members are read in the order list_images keeps them."""
+    if path.lower().endswith(".zip"):
+        return zipfile.ZipFile(path)
+    archive = tarfile.open(path)
+    return archive, {member.name: member for member in archive.getmembers()}
+
+def read_image(path: str, member: Optional[str]) -> bytes:
+    if member is None:
+        with open(path, "rb") as f:
+            return f.read()
+    archive = open_archive(path)
+    if isinstance(archive, zipfile.ZipFile):
+        return archive.read(member)
+    archive, members = archive
+    return archive.extractfile(members[member]).read()
+
+def analyse_chunk(chunk: List[ImageRef], score_threshold: float, include_metrics: bool) -> Tuple[list, list]:
+    """Analyse a chunk of images in this worker, returning its image and fragment rows."""
+    image_rows, fragment_rows = [], []
+    for name, path, member in chunk:
+        start_time = time.time()
+        row = {"image": name, "fragments": 0}
+        try:
+            fragments, size_metrics, (row["height"], row["width"]) = analyse_image(
+                read_image(path, member), score_threshold, include_metrics
+            )
+            row["fragments"] = len(fragments)
+            if size_metrics is not None:
+                row.update(size_metrics.model_dump(exclude={"size_distribution"}))
+            fragment_rows.extend(fragment_row(name, fragment) for fragment in fragments)
+        except Exception as e:
+            logger.exception("Failed to analyse %s", name)
+            row["error"] = str(e) or type(e).__name__
+        row["elapsed"] = time.time() - start_time
+        image_rows.append(row)
+    return image_rows, fragment_rows
+
+def analyse_image(contents: bytes, score_threshold: float, include_metrics: bool):
+    """The /predict pipeline on one encoded image, without scheduler or deadline."""
+    import cv2 # type: ignore
+    import numpy as np
+    from routers.core.deadline import Deadline
+    from utils.image_processing import frame_to_tensor
+
+    frame = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Unsupported or corrupted image")
+    # Archived photos come in any size, they are resized like video frames
+    image_tensor = frame_to_tensor(frame, _predict.MODEL_CONFIG.input_size)
+
+    session = _predict.get_session()
+    ort_outs = session.run(None, _predict.model_inputs(session, image_tensor, score_threshold))
+    boxes, scores, mask_probs = _predict.unpack_outputs(ort_outs)
+    response = _predict.postprocess(
+        boxes, scores, mask_probs, Deadline(math.inf), score_threshold, include_metrics=include_metrics
+    )
+    if not isinstance(response, dict):
+        # Nothing above the threshold
+        return [], None, frame.shape[:2]
+    return response["fragments"], response["size_metrics"], frame.shape[:2]
+
+def fragment_row(name: str, fragment: dict) -> dict:
+    x1, y1, x2, y2 = fragment["bbox"]
+    row = {
+        "image": name, "fragment_id": fragment["id"], "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+        "score": fragment["score"], "size_cm": fragment["size_cm"]
+    }
+    if fragment.get("metrics") is not None:
+        row.update(fragment["metrics"].model_dump())
+    return row
+
+def chunked(images: List[ImageRef], size: int) -> Iterator[List[ImageRef]]:
+    for i in range(0, len(images), size):
+        yield images[i:i + size]
+
+# ============= Main =============
+def plan_pool(cpus: float, workers: int, threads: int) -> Tuple[int, int]:
+    """Split the CPUs into (worker processes, ONNX Runtime threads per worker).
+    Offline throughput is best with more processes and few threads each."""
+    if not workers:
+        workers = max(1, int(cpus // (threads or 1)))
+    if not threads:
+        threads = max(1, int(cpus // workers))
+    return workers, threads
+
+def parse_args(argv=None) -> argparse.Namespace:
+    config = ModelConfig()
+    parser = argparse.ArgumentParser(description="Analyse archived blast images without the API server.")
+    parser.add_argument("inputs", nargs="+", help="Image directories, .zip/.tar archives or image files")
+    parser.add_argument("--output", "-o", required=True, help="Directory of the Parquet results, reused to resume")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (default: CPUs / threads)")
+    parser.add_argument("--threads", type=int, default=1, help="ONNX Runtime threads per worker (0: CPUs / workers)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Images per task and per output part")
+    parser.add_argument("--score-threshold", type=float, default=config.scrore_threshold)
+    parser.add_argument("--no-mask-metrics", dest="mask_metrics", action="store_false",
+                        help="Skip per-fragment area, perimeter and circularity (much faster)")
+    parser.add_argument("--model", default=config.model_path, help="ONNX or ORT model file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    output = Path(args.output)
+    (output / "images").mkdir(parents=True, exist_ok=True)
+    (output / "fragments").mkdir(parents=True, exist_ok=True)
+
+    images = list_images(args.inputs)
+    done = completed_images(output)
+    pending = [image for image in images if image[0] not in done]
+    logger.info(f"Found {len(images)} images, {len(images) - len(pending)} already analysed")
+    if not pending:
+        return
+
+    workers, threads = plan_pool(cpu_quota(), args.workers, args.threads)
+    workers = min(workers, math.ceil(len(pending) / args.chunk_size))
+    model_path, config = args.model, ModelConfig()
+    if config.share_weights and model_path.endswith(".onnx") and not has_external_weights(model_path):
+        # Prepared once here, the workers then map the same weights instead of each copying them
+        model_path = share_model_weights(model_path, config.model_cache_dir)
+    # Read by ModelConfig when the workers import the pipeline
+    os.environ["MODEL_PATH"] = model_path
+    os.environ["ORT_INTRA_OP_THREADS"] = str(threads)
+    # Processes already split the CPUs, each runs a single session
+    os.environ["SESSION_POOL_MODE"] = "latency"
+    logger.info(f"Starting {workers} worker(s) with {threads} ONNX Runtime thread(s) each")
+
+    run_start = time.time()
+    part_index = next_part_index(output)
+    analysed, failed, fragments = 0, 0, 0
+    # Workers start from a clean interpreter rather than a fork of this one
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(workers, initializer=init_worker, initargs=(logging.WARNING,))
+    start_time, baseline = None, 0
+    try:
+        task = functools.partial(analyse_chunk, score_threshold=args.score_threshold, include_metrics=args.mask_metrics)
+        for image_rows, fragment_rows in pool.imap_unordered(task, chunked(pending, args.chunk_size)):
+            # Rate is measured from the first result, without the model load of the workers
+            if start_time is None:
+                start_time, baseline = time.time(), len(image_rows)
+            write_part(output, part_index, image_rows, fragment_rows)
+            part_index += 1
+            analysed += len(image_rows)
+            failed += sum(row.get("error") is not None for row in image_rows)
+            fragments += len(fragment_rows)
+            elapsed = time.time() - start_time
+            rate = (analysed - baseline) / elapsed if elapsed > 0 else 0.0
+            logger.info(f"{analysed}/{len(pending)} images, {fragments} fragments, {failed} failed, {rate:.1f} images/s")
+        pool.close()
+    except KeyboardInterrupt:
+        logger.warning(f"Interrupted after {analysed} images, run the same command again to resume")
+        pool.terminate()
+        raise SystemExit(130)
+    finally:
+        pool.join()
+    elapsed = time.time() - run_start
+    logger.info(
+        f"Analysed {analysed} images ({failed} failed) into {output} in {elapsed:.1f}s, "
+        f"{analysed / elapsed:.1f} images/s including worker start-up"
+    )
+
+if __name__ == "__main__":
+    main()
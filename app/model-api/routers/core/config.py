@@ -1,9 +1,36 @@
 from pydantic import BaseModel
 import os
+import tempfile
 
 class ModelConfig(BaseModel):
-    model_path:         str   = os.path.join(os.path.dirname(__file__),'..','..', 'models','model.onnx')
+    model_path:         str   = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__),'..','..', 'models','model.onnx'))
+    share_weights:      bool  = os.getenv("MODEL_SHARE_WEIGHTS", "1") == "1"  # Serve an optimized copy with external weights that all workers map (needs onnx)
+    model_cache_dir:    str   = os.getenv("MODEL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "model-api"))  # Where that copy is written
     scrore_threshold:   float = 0.3
     input_size:         tuple = (512, 512)
     device:             str   = "cpu"
-    timeout:            int   = 30
\ No newline at end of file
+    timeout:            int   = 30   # Default request deadline in seconds
+    max_timeout:        int   = 60   # Upper bound for client supplied deadlines (X-Request-Timeout)
+    degrade_margin:     float = 2.0  # Skip masks/metrics when less than this many seconds are left
+    inference_workers:  int   = 1    # Threads running each session, extra requests wait in the queue
+    intra_op_threads:   int   = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))  # Threads of all sessions together, 0 lets ONNX Runtime use every core
+    session_pool_mode:  str   = os.getenv("SESSION_POOL_MODE", "latency")  # "latency": one wide session, "throughput": one narrow session per SESSION_THREADS threads
+    session_threads:    int   = int(os.getenv("SESSION_THREADS", "1"))  # Intra-op threads of each session in throughput mode
+    pin_threads:        str   = os.getenv("SESSION_PIN_THREADS", "auto")  # Bind each session to its own cores: "1", "0" or "auto" (only with an exclusive cpuset)
+    default_priority:   str   = "interactive"  # Class of requests without X-Priority header or known API key
+    bulk_min_share:     float = 0.2  # Share of inference slots guaranteed to waiting bulk requests
+    max_client_concurrency: int = 4  # Requests a single client may have queued or running (0 = no limit)
+    api_key_priorities: str   = os.getenv("API_KEY_PRIORITIES", "")  # "key1:bulk,key2:interactive"
+    polygon_tolerance:  float = 1.0  # Max outline deviation in pixels when simplifying polygons
+    ws_max_in_flight:   int   = 4    # Frames of one /ws/predict connection queued or running at once
+    video_sample_fps:   float = 1.0  # Frames per second analysed by /predict/video unless the client asks otherwise
+    video_max_frames:   int   = 900  # Upper bound of sampled frames per video
+    video_duplicate_distance: int = 6  # Frames whose dHash differs from the last analysed one by at most this many bits are skipped
+    shm_dir:            str   = os.getenv("SHM_DIR", "/dev/shm")  # Frames for /predict/shm are read from files in this directory only
+    shm_allowed_hosts:  str   = os.getenv("SHM_ALLOWED_HOSTS", "127.0.0.1,::1")  # Clients allowed to use /predict/shm
+    history_dir:        str   = os.getenv("HISTORY_DIR", "")  # Keep every detected fragment in a Parquet store here (empty = disabled)
+    history_flush_rows: int   = int(os.getenv("HISTORY_FLUSH_ROWS", "5000"))  # Buffered fragments that trigger a write
+    history_flush_seconds: float = float(os.getenv("HISTORY_FLUSH_SECONDS", "30"))  # Max age of buffered fragments
+    memory_budget_mb:   int   = int(os.getenv("MEMORY_BUDGET_MB", "1024"))  # Estimated memory of admitted requests per worker (0 = no limit)
+    expected_detections: int  = 20   # Detections assumed per image until requests have been seen
+    max_detections:     int   = 100  # Detections the model returns at most per image
@@ -0,0 +1,41 @@
+import time
+from typing import Mapping, Optional
+
+# Clients can shorten (never extend past the server maximum) their time budget with this header
+DEADLINE_HEADER = "X-Request-Timeout"
+
+class Deadline:
+    """Absolute time budget of a single request, carried through every stage."""
+    def __init__(self, timeout: float):
+        self.timeout = float(timeout)
+        self.expires_at = time.monotonic() + self.timeout
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str):
+        """Raise TimeoutError if the deadline passed before `stage` could start."""
+        if self.expired():
+            raise TimeoutError(f"{stage} exceeded the request deadline of {self.timeout:.1f}s")
+
+    @classmethod
+    def from_headers(cls, headers: Mapping[str, str], default: float, maximum: float) -> "Deadline":
+        """Build a deadline from the client header, falling back to `default` and capped at `maximum`."""
+        timeout = parse_timeout(headers.get(DEADLINE_HEADER))
+        if timeout is None:
+            timeout = default
+        return cls(min(timeout, maximum))
+
+def parse_timeout(value: Optional[str]) -> Optional[float]:
+    """Parse a positive number of seconds, ignoring malformed values."""
+    if value is None:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return timeout if timeout > 0 else None
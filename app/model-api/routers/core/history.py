@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_SITE = "unknown"
+
+# An image without fragments is kept as a single row whose fragment columns are null
+FRAGMENT_SCHEMA = pa.schema([
+    ("image_id", pa.string()),
+    ("timestamp", pa.timestamp("ms", tz="UTC")),
+    ("fragment_id", pa.int32()),
+    ("x1", pa.int32()),
+    ("y1", pa.int32()),
+    ("x2", pa.int32()),
+    ("y2", pa.int32()),
+    ("score", pa.float32()),
+    ("size_cm", pa.float64()),
+    # Null unless the request asked for metrics
+    ("area", pa.float64()),
+    ("perimeter", pa.float64()),
+    ("circularity", pa.float64()),
+    ("contour_count", pa.int32()),
+    # Partition columns, stored in the directory names
+    ("site", pa.string()),
+    ("date", pa.string()),
+])
+PARTITIONING = ds.partitioning(
+    pa.schema([("site", pa.string()), ("date", pa.string())]), flavor="hive"
+)
+
+class FragmentHistory:
+    """Append-only store of detected fragments, as Parquet files partitioned by site and day
+    (root/site=<site>/date=<YYYY-MM-DD>/). Rows are buffered in memory and written in the
+    background once `flush_rows` are waiting, and every `flush_seconds` by a timer so the rows
+    of a quiet worker reach the disk too. Queries only read the files, results can be up to
+    `flush_seconds` late. Every process writes its own files, so server workers never share a file."""
+    def __init__(self, root: str, flush_rows: int = 5000, flush_seconds: float = 30.0):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._rows: List[dict] = []
+        self._lock = threading.Lock()
+        # Writes are blocking, they run on one thread so files are written in order. It is
+        # started per process on first use, so a preloading server can fork safely.
+        self._writer: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._wakeup = threading.Event()
+        self._closed = False
+        os.makedirs(root, exist_ok=True)
+
+    def append(self, image_id: str, site: Optional[str], timestamp: datetime, fragments: Sequence[dict]):
+        """Buffer the fragments of one analysed image (fragments as built by build_response).
+        An image without fragments still gets a row, so it counts in the queries."""
+        timestamp = as_utc(timestamp)
+        site = site or UNKNOWN_SITE
+        date = timestamp.strftime("%Y-%m-%d")
+        rows = [fragment_row(image_id, site, date, timestamp, fragment) for fragment in fragments] \
+            or [{"image_id": image_id, "site": site, "date": date, "timestamp": timestamp}]
+        with self._lock:
+            self._rows.extend(rows)
+            due = len(self._rows) >= self.flush_rows
+            if self._pid != os.getpid():
+                self._start_writer()
+        if due:
+            self._wakeup.set()
+
+    def _start_writer(self):
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._pid = os.getpid()
+        self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            self._wakeup.wait(timeout=self.flush_seconds)
+            self._wakeup.clear()
+            closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """Write the buffered rows, blocking until they are on disk."""
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return
+        try:
+            ds.write_dataset(
+                pa.Table.from_pylist(rows, schema=FRAGMENT_SCHEMA), self.root, format="parquet",
+                partitioning=PARTITIONING,
+                basename_template=f"part-{os.getpid()}-{uuid.uuid4().hex[:12]}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+            logger.info("Wrote %d rows to the history store", len(rows))
+        except Exception as e:
+            logger.error("Failed to write %d rows to the history store: %s", len(rows), e)
+
+    def close(self):
+        """Write what is still buffered and stop the writer."""
+        self._closed = True
+        if self._pid == os.getpid() and self._writer.is_alive():
+            self._wakeup.set()
+            self._writer.join()
+        else:
+            self.flush()
+
+    def query(self, columns: List[str], start: Optional[datetime] = None, end: Optional[datetime] = None,
+              sites: Optional[List[str]] = None) -> pa.Table:
+        """Read only `columns` of the fragments detected in [start, end) at `sites`. Partitions
+        outside the sites and days are skipped without being opened. Buffered rows are not
+        written for a query, that would leave one small file per poll."""
+        dataset = ds.dataset(self.root, format="parquet", schema=FRAGMENT_SCHEMA, partitioning=PARTITIONING)
+        condition = None
+        if sites:
+            condition = ds.field("site").isin(sites)
+        if start is not None:
+            start = as_utc(start)
+            condition = combine(condition, ds.field("date") >= start.strftime("%Y-%m-%d"))
+            condition = combine(condition, ds.field("timestamp") >= pa.scalar(start, FRAGMENT_SCHEMA.field("timestamp").type))
+        if end is not None:
+            end = as_utc(end)
+            condition = combine(condition, ds.field("date") <= end.strftime("%Y-%m-%d"))
+            condition = combine(condition, ds.field("timestamp") < pa.scalar(end, FRAGMENT_SCHEMA.field("timestamp").type))
+        return dataset.to_table(columns=columns, filter=condition)
+
+def as_utc(timestamp: datetime) -> datetime:
+    """Timestamps without a timezone are taken as UTC."""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+def combine(condition, other):
+    return other if condition is None else condition & other
+
+def fragment_row(image_id: str, site: str, date: str, timestamp: datetime, fragment: dict) -> dict:
+    x1, y1, x2, y2 = fragment["bbox"]
+    row = {
+        "image_id": image_id, "site": site, "date": date, "timestamp": timestamp,
+        "fragment_id": fragment["id"], "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+        "score": fragment["score"], "size_cm": fragment["size_cm"]
+    }
+    if fragment.get("metrics") is not None:
+        row.update(fragment["metrics"].model_dump())
+    return row
@@ -0,0 +1,140 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Sequence
+
+import numpy as np
+
+from routers.core.deadline import Deadline
+
+FLOAT32 = 4
+UINT8 = 1
+UINT16 = 2
+ROI_MASK_SIZE = 28  # Side of the Mask R-CNN mask head output
+
+def estimate_request_memory(height: int, width: int, detections: int, binary_masks: bool = False,
+                            label_map: bool = False, fused: bool = False, roi_masks: bool = False) -> int:
+    """Bytes a request holds at its peak, before the number of detections is known: the input
+    tensor, the N x 1 x H x W float32 mask probabilities from the model and their copy made by
+    the score filter, the uint8 masks of process_masks and the label map. Cropped masks in
+    build_response are views and cost nothing extra. Fused graphs return only the kept
+    detections with uint8 masks, which are used as they are. ROI mask graphs return M x M
+    probabilities, pasted into uint8 frames only when pixels are needed."""
+    pixels = height * width
+    mask_pixels = ROI_MASK_SIZE * ROI_MASK_SIZE if roi_masks else pixels
+    mask_itemsize = UINT8 if fused and not roi_masks else FLOAT32
+    total = 3 * pixels * FLOAT32 + detections * mask_pixels * mask_itemsize
+    if not fused:
+        total += detections * mask_pixels * mask_itemsize
+    if binary_masks and mask_itemsize != UINT8:
+        total += detections * pixels * UINT8
+    if label_map:
+        total += pixels * UINT16
+    return total
+
+def measure_request_memory(image_tensor: np.ndarray, outputs: Sequence[np.ndarray], kept: int,
+                           binary_masks: bool = False, label_map: bool = False) -> int:
+    """Same as estimate_request_memory, from the arrays the request actually holds once
+    inference returned and `kept` detections passed the score threshold."""
+    mask_probs = outputs[-1]
+    pixels = image_tensor.shape[-2] * image_tensor.shape[-1]
+    mask_pixels = mask_probs.shape[-2] * mask_probs.shape[-1] if mask_probs.ndim >= 2 else 0
+    total = image_tensor.nbytes + sum(output.nbytes for output in outputs)
+    if kept < len(mask_probs):
+        # Copy made by the score filter
+        total += kept * mask_pixels * mask_probs.itemsize
+    if binary_masks and mask_probs.dtype != np.uint8:
+        total += kept * pixels * UINT8
+    if label_map:
+        total += pixels * UINT16
+    return total
+
+class Reservation:
+    """Memory held by one request. Starts at the estimate, follows the arrays the
+    request actually holds once they are known (see resize), and remembers its peak."""
+    def __init__(self, budget: "MemoryBudget", nbytes: int):
+        self.budget = budget
+        self.estimate = nbytes
+        self.nbytes = nbytes
+        self.peak = 0
+
+    def resize(self, nbytes: int):
+        """Account for the memory actually held now. Growing past the budget is allowed,
+        the arrays already exist, but it holds back the next admissions."""
+        self.peak = max(self.peak, nbytes)
+        self.budget._adjust(nbytes - self.nbytes)
+        self.nbytes = nbytes
+
+class MemoryBudget:
+    """Admits requests in arrival order while their estimated memory fits in `budget_bytes`
+    (0 = no limit, only accounting). A request larger than the whole budget is admitted
+    once nothing else is reserved, so it runs alone rather than never. Arrival order knows
+    nothing of priorities: reserve once the request holds its inference slot, so the
+    scheduler decides the order and no queued request holds memory."""
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.reserved = 0
+        self._waiters = deque()  # (future, nbytes)
+
+    def queue_depth(self) -> int:
+        return sum(1 for waiter, _ in self._waiters if not waiter.done())
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, deadline: Deadline):
+        """Wait within the deadline until `nbytes` fit in the budget. Yields the Reservation."""
+        await self._acquire(nbytes, deadline)
+        reservation = Reservation(self, nbytes)
+        try:
+            yield reservation
+        finally:
+            self._adjust(-reservation.nbytes)
+
+    def _fits(self, nbytes: int) -> bool:
+        return not self.budget_bytes or self.reserved == 0 or self.reserved + nbytes <= self.budget_bytes
+
+    async def _acquire(self, nbytes: int, deadline: Deadline):
+        if not self.queue_depth() and self._fits(nbytes):
+            self.reserved += nbytes
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, nbytes))
+        try:
+            await asyncio.wait_for(waiter, timeout=deadline.remaining())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as we gave up, give the memory back
+                self._adjust(-nbytes)
+            if isinstance(e, asyncio.TimeoutError):
+                raise TimeoutError(
+                    f"Waiting for memory exceeded the request deadline of {deadline.timeout:.1f}s"
+                ) from e
+            raise
+
+    def _adjust(self, delta: int):
+        self.reserved += delta
+        # First in, first out: a large request at the head is not overtaken by smaller ones
+        while self._waiters:
+            waiter, nbytes = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+            elif self._fits(nbytes):
+                self._waiters.popleft()
+                self.reserved += nbytes
+                waiter.set_result(None)
+            else:
+                break
+
+class DetectionWindow:
+    """Detection counts of the last requests. The estimate for the next one is the largest
+    recent count, so a run of dense images raises it at once and it decays as they pass."""
+    def __init__(self, default: int, maximum: int, size: int = 50):
+        self.default = default
+        self.maximum = maximum
+        self._recent = deque(maxlen=size)
+
+    def record(self, detections: int):
+        self._recent.append(detections)
+
+    def expected(self) -> int:
+        return min(self.maximum, max(self._recent, default=self.default))
@@ -0,0 +1,161 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Dict, Mapping, Optional, Tuple
+
+from routers.core.deadline import Deadline
+
+PRIORITY_HEADER = "X-Priority"
+API_KEY_HEADER = "X-API-Key"
+# Lets a server relaying many users (the dashboard) keep them apart for the per-client limit
+CLIENT_ID_HEADER = "X-Client-ID"
+MAX_CLIENT_ID_LENGTH = 64
+
+class Priority(str, Enum):
+    interactive = "interactive"  # Dashboard and other users waiting on the answer
+    bulk        = "bulk"         # Batch ingest, served in the gaps with a guaranteed minimum share
+
+class ClientLimitExceeded(Exception):
+    """Raised when a client already has the maximum number of requests in flight."""
+
+class PriorityScheduler:
+    """Hands out a fixed number of inference slots.
+
+    Interactive requests are always served first, except that once `bulk_min_share`
+    of the slots is owed to waiting bulk requests one of them goes next. Each client
+    may have at most `max_client_concurrency` requests queued or running (0 = no limit).
+    """
+    def __init__(self, slots: int, bulk_min_share: float = 0.2, max_client_concurrency: int = 0):
+        self.slots = max(1, slots)
+        self.max_client_concurrency = max_client_concurrency
+        # Number of interactive grants in a row after which a waiting bulk request goes next
+        self.max_interactive_streak = (
+            max(1, round((1 - bulk_min_share) / bulk_min_share)) if bulk_min_share > 0 else None
+        )
+        self._free = self.slots
+        self._queues: Dict[Priority, deque] = {priority: deque() for priority in Priority}
+        self._clients: Dict[str, int] = {}
+        self._interactive_streak = 0
+
+    def queue_depth(self, priority: Priority) -> int:
+        return sum(1 for waiter in self._queues[priority] if not waiter.done())
+
+    def slots_in_use(self) -> int:
+        return self.slots - self._free
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, client_id: str, deadline: Deadline):
+        """Wait for an inference slot within the deadline. Yields the time spent queued."""
+        self._enter_client(client_id)
+        try:
+            queued_at = time.monotonic()
+            await self._acquire(priority, deadline)
+            try:
+                yield time.monotonic() - queued_at
+            finally:
+                self._release()
+        finally:
+            self._leave_client(client_id)
+
+    def _enter_client(self, client_id: str):
+        active = self._clients.get(client_id, 0)
+        if self.max_client_concurrency and active >= self.max_client_concurrency:
+            raise ClientLimitExceeded(
+                f"Client already has {active} requests in flight (limit {self.max_client_concurrency})"
+            )
+        self._clients[client_id] = active + 1
+
+    def _leave_client(self, client_id: str):
+        active = self._clients.get(client_id, 1) - 1
+        if active > 0:
+            self._clients[client_id] = active
+        else:
+            self._clients.pop(client_id, None)
+
+    async def _acquire(self, priority: Priority, deadline: Deadline):
+        if self._free > 0 and not any(self.queue_depth(p) for p in Priority):
+            self._free -= 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=deadline.remaining())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we gave up, hand it to the next in line
+                self._release()
+            else:
+                try:
+                    self._queues[priority].remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                raise TimeoutError(
+                    f"Waiting for inference exceeded the request deadline of {deadline.timeout:.1f}s"
+                ) from e
+            raise
+
+    def _release(self):
+        self._free += 1
+        while self._free > 0:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self._free -= 1
+            waiter.set_result(None)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        interactive, bulk = self._queues[Priority.interactive], self._queues[Priority.bulk]
+        for queue in (interactive, bulk):
+            while queue and queue[0].done():
+                queue.popleft()
+
+        bulk_is_owed = (
+            self.max_interactive_streak is not None
+            and self._interactive_streak >= self.max_interactive_streak
+        )
+        if bulk and (not interactive or bulk_is_owed):
+            self._interactive_streak = 0
+            return bulk.popleft()
+        if interactive:
+            # Only count interactive grants that made bulk work wait
+            self._interactive_streak = self._interactive_streak + 1 if bulk else 0
+            return interactive.popleft()
+        return None
+
+def parse_api_key_priorities(value: str) -> Dict[str, Priority]:
+    """Parse 'key1:bulk,key2:interactive' into a key -> priority mapping."""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        key, _, name = item.partition(":")
+        if name in Priority.__members__:
+            mapping[key] = Priority(name)
+    return mapping
+
+def resolve_priority(
+    headers: Mapping[str, str],
+    client_host: Optional[str],
+    api_key_priorities: Mapping[str, Priority],
+    default: Priority = Priority.interactive,
+) -> Tuple[Priority, str]:
+    """Return the priority class and client identity of a request.
+    A known API key decides the class, otherwise the X-Priority header does.
+    Without an API key the client is its host, split by X-Client-ID when sent."""
+    api_key = headers.get(API_KEY_HEADER)
+    if api_key and api_key in api_key_priorities:
+        return api_key_priorities[api_key], f"key:{api_key}"
+
+    requested = (headers.get(PRIORITY_HEADER) or "").strip().lower()
+    priority = Priority(requested) if requested in Priority.__members__ else default
+    if api_key:
+        client_id = f"key:{api_key}"
+    else:
+        client_id = f"host:{client_host or 'unknown'}"
+        # Namespaced by host, so an id cannot use up the limit of a client on another host
+        sub_client = (headers.get(CLIENT_ID_HEADER) or "").strip()[:MAX_CLIENT_ID_LENGTH]
+        if sub_client:
+            client_id = f"{client_id}/{sub_client}"
+    return priority, client_id
@@ -0,0 +1,161 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import onnxruntime as ort
+
+from models.model_utils import create_session
+
+logger = logging.getLogger(__name__)
+
+class PoolMode(str, Enum):
+    latency    = "latency"     # One session using every thread, lowest time per image
+    throughput = "throughput"  # Several narrow sessions, each running its own image
+
+def plan_sessions(mode: PoolMode, total_threads: int, session_threads: int = 1) -> Tuple[int, int]:
+    """(sessions, intra-op threads per session) of a preset for `total_threads` threads.
+    Latency with 0 threads keeps ONNX Runtime's default of one thread per physical core."""
+    if mode == PoolMode.latency:
+        return 1, total_threads
+    total_threads = total_threads or len(os.sched_getaffinity(0))
+    session_threads = max(1, min(session_threads, total_threads))
+    return max(1, total_threads // session_threads), session_threads
+
+def core_groups(cpus: Sequence[int], size: int, threads: int) -> Optional[List[List[int]]]:
+    """Disjoint groups of `threads` CPUs, one per session, or None if there are not enough."""
+    if not threads or size * threads > len(cpus):
+        return None
+    return [list(cpus[i * threads:(i + 1) * threads]) for i in range(size)]
+
+def should_pin(pin: str, cpus: Sequence[int], needed: int) -> bool:
+    """With "auto", pin only when the CPUs this process may run on are exactly the ones it uses,
+    e.g. an exclusive cpuset or a worker pinned by serve.py. With a plain CPU quota every
+    pod on the node sees all cores, and pinning would stack them on the same ones."""
+    if pin == "auto":
+        return len(cpus) == needed
+    return pin in ("1", "true", "yes")
+
+def pin_thread(cpus: Sequence[int]):
+    # On Linux pid 0 is the calling thread only
+    os.sched_setaffinity(0, cpus)
+
+class PooledSession:
+    """One ONNX Runtime session with the threads that call it."""
+    def __init__(self, index: int, session: ort.InferenceSession, executor: ThreadPoolExecutor,
+                 cpus: Optional[List[int]]):
+        self.index = index
+        self.session = session
+        self.executor = executor
+        self.cpus = cpus
+        self.in_flight = 0  # Runs submitted and not finished yet
+        self.busy_seconds = 0.0  # Time spent in finished runs
+        self.running: Dict[int, float] = {}  # Start of the runs executing now, by thread
+
+    def busy_time(self, now: float) -> float:
+        """Seconds spent running so far, including the runs still executing."""
+        return self.busy_seconds + sum(now - started for started in self.running.values())
+
+class SessionPool:
+    """`size` sessions of the same model (its bytes, or the path of a model with external
+    weights), each with `threads` intra-op threads and `runs_per_session` threads calling
+    it. Work goes to the session with the fewest runs in flight. When pinned, every session
+    owns a disjoint group of cores: ONNX Runtime's threads are bound to them and so is the
+    calling thread, which takes part in the run.
+
+    Sessions are created per process on first use, so a preloading server can fork safely."""
+    def __init__(self, model: Union[bytes, str], size: int, threads: int, runs_per_session: int = 1, pin: str = "auto"):
+        self.model = model
+        self.size = max(1, size)
+        self.threads = threads
+        self.runs_per_session = max(1, runs_per_session)
+        self.pin = pin
+        self._sessions: List[PooledSession] = []
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        """Runs that can execute at once."""
+        return self.size * self.runs_per_session
+
+    @property
+    def sessions(self) -> List[PooledSession]:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            return self._sessions
+
+    def _start(self):
+        cpus = sorted(os.sched_getaffinity(0))
+        groups = core_groups(cpus, self.size, self.threads)
+        if groups and not should_pin(self.pin, cpus, self.size * self.threads):
+            groups = None
+        # Idle threads spinning for work would take CPU time from the other sessions
+        allow_spinning = self.size == 1
+        self._sessions = []
+        for index in range(self.size):
+            group = groups[index] if groups else None
+            session = create_session(
+                self.model, self.threads,
+                # ONNX Runtime binds its threads 1..n-1 (1-based CPU ids), the caller is thread 0
+                thread_affinities=";".join(str(cpu + 1) for cpu in group[1:]) if group else None,
+                allow_spinning=allow_spinning
+            )
+            executor = ThreadPoolExecutor(
+                max_workers=self.runs_per_session, thread_name_prefix=f"inference-{index}",
+                initializer=pin_thread if group else None, initargs=(group,) if group else ()
+            )
+            self._sessions.append(PooledSession(index, session, executor, group))
+        self._pid = os.getpid()
+        logger.info(
+            "Created %d session(s) with %s thread(s) each in process %d%s",
+            self.size, self.threads or "default", self._pid,
+            f", pinned to {[s.cpus for s in self._sessions]}" if groups else ""
+        )
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Run fn(session, *args) on the least loaded session. Cancelling the returned
+        future drops the run if it has not started yet."""
+        sessions = self.sessions
+        with self._lock:
+            pooled = min(sessions, key=lambda s: s.in_flight)
+            pooled.in_flight += 1
+        # Carry the request's log context over to the pool thread
+        future = pooled.executor.submit(contextvars.copy_context().run, self._run, pooled, fn, *args)
+        future.add_done_callback(lambda _: self._release(pooled))
+        return future
+
+    def _run(self, pooled: PooledSession, fn: Callable, *args):
+        thread = threading.get_ident()
+        with self._lock:
+            pooled.running[thread] = time.monotonic()
+        try:
+            return fn(pooled.session, *args)
+        finally:
+            with self._lock:
+                pooled.busy_seconds += time.monotonic() - pooled.running.pop(thread)
+
+    def _release(self, pooled: PooledSession):
+        with self._lock:
+            pooled.in_flight -= 1
+
+    def in_flight(self) -> List[int]:
+        with self._lock:
+            return [s.in_flight for s in self._sessions]
+
+    def busy_time(self) -> List[float]:
+        """Seconds each session spent running, divide its rate by runs_per_session for the utilization."""
+        now = time.monotonic()
+        with self._lock:
+            return [s.busy_time(now) for s in self._sessions]
+
+    def shutdown(self, wait: bool = True):
+        if self._pid != os.getpid():
+            return
+        for pooled in self._sessions:
+            pooled.executor.shutdown(wait=wait)
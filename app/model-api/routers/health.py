@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException
 import logging 
-from predict import ort_session
+from routers.predict import get_session
 
 router = APIRouter()
 logger = logging.getLogger()
@@ -9,7 +9,7 @@ async def health_check():
     """Health check endpoint"""
     try:
         # Check if model is loaded
-        if ort_session is None:
+        if get_session() is None:
             error_msg = "Model not loaded"
             logger.error(error_msg)
             raise RuntimeError(error_msg)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from enum import Enum
+from typing import List, Optional
+
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query
+
+from routers import predict
+from routers.schema.history import SizeHistory, SizePeriod, SizeTimeline
+from routers.schema.predict_response import SizeDistribution
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+DEFAULT_PERCENTILES = [10, 25, 50, 75, 90]
+
+class Interval(str, Enum):
+    day   = "day"
+    month = "month"
+
+@router.get("/history/sizes", response_model=SizeHistory)
+async def size_history(
+    start: Optional[datetime] = Query(None, description="Only fragments detected at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only fragments detected before this time"),
+    site: Optional[List[str]] = Query(None, description="Only these sites (repeat the parameter for several)"),
+    percentile: List[float] = Query(DEFAULT_PERCENTILES, description="Percentiles of the fragment size to return"),
+    bins: int = Query(10, ge=1, le=100, description="Bins of the size histogram")
+):
+    """Size distribution and percentiles of the recorded fragments."""
+    check_percentiles(percentile)
+    table = await scan_history(["image_id", "size_cm"], start, end, site)
+    sizes = table.column("size_cm").to_numpy()
+    summary = summarise(sizes, table.column("image_id").to_numpy(zero_copy_only=False), percentile)
+    sizes = sizes[~np.isnan(sizes)]
+    if len(sizes):
+        counts, edges = np.histogram(sizes, bins=bins, range=(0.0, float(sizes.max())))
+        summary["size_distribution"] = SizeDistribution(bins=edges.tolist(), counts=counts.tolist())
+    return SizeHistory(**summary)
+
+@router.get("/history/sizes/timeline", response_model=SizeTimeline)
+async def size_timeline(
+    interval: Interval = Query(Interval.day, description="Length of each period"),
+    start: Optional[datetime] = Query(None, description="Only fragments detected at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only fragments detected before this time"),
+    site: Optional[List[str]] = Query(None, description="Only these sites (repeat the parameter for several)"),
+    percentile: List[float] = Query(DEFAULT_PERCENTILES, description="Percentiles of the fragment size to return")
+):
+    """Fragment size percentiles per day or month, oldest first."""
+    check_percentiles(percentile)
+    table = await scan_history(["image_id", "timestamp", "size_cm"], start, end, site)
+    unit = "D" if interval == Interval.day else "M"
+    periods = table.column("timestamp").to_numpy().astype(f"datetime64[{unit}]")
+    sizes = table.column("size_cm").to_numpy()
+    image_ids = table.column("image_id").to_numpy(zero_copy_only=False)
+
+    # Sort once by period, then every period is a contiguous slice
+    names, first_rows = np.unique(np.sort(periods), return_index=True)
+    order = np.argsort(periods, kind="stable")
+    bounds = list(first_rows) + [len(order)]
+    return SizeTimeline(interval=interval.value, periods=[
+        SizePeriod(period=str(name), **summarise(sizes[order[lo:hi]], image_ids[order[lo:hi]], percentile))
+        for name, lo, hi in zip(names, bounds[:-1], bounds[1:])
+    ])
+
+async def scan_history(columns: List[str], start, end, sites):
+    if predict.HISTORY is None:
+        raise HTTPException(status_code=404, detail="The history store is disabled, set HISTORY_DIR to enable it")
+    start_time = time.time()
+    # Scanning Parquet files is blocking, keep it off the event loop
+    table = await asyncio.get_running_loop().run_in_executor(
+        None, predict.HISTORY.query, columns, start, end, sites
+    )
+    logger.debug("Scanned %d rows in %.3fs", table.num_rows, time.time() - start_time)
+    return table
+
+def check_percentiles(percentiles: List[float]):
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+
+def summarise(sizes: np.ndarray, image_ids: np.ndarray, percentiles: List[float]) -> dict:
+    """Sizes are NaN in the rows of images without fragments, which only count as images."""
+    if not len(image_ids):
+        return {}
+    summary = {"images": int(len(np.unique(image_ids)))}
+    sizes = sizes[~np.isnan(sizes)]
+    if len(sizes):
+        values = np.percentile(sizes, percentiles)
+        summary.update({
+            "fragments": int(len(sizes)),
+            "mean_size": float(sizes.mean()),
+            "percentiles": {f"p{p:g}": float(value) for p, value in zip(percentiles, values)},
+        })
+    return summary
@@ -1,18 +1,50 @@
+import asyncio
+import contextvars
+import hashlib
 import logging
-import traceback
 import numpy as np
 import time
 import onnxruntime as ort
 import os
 import tempfile
 
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
-from fastapi import APIRouter, File, Query, UploadFile, HTTPException
+from fastapi import APIRouter, File, Query, Request, UploadFile, HTTPException
 from metrics import meter
-
+from logging_config import bind_log_context, dropped_records, sampled_logger
+from opentelemetry.metrics import CallbackOptions, Observation
+
+from maskcodec import encode_label_map, encode_polygon, encode_rle
+from models.model_utils import (
+    has_fused_postprocess,
+    has_roi_masks,
+    has_external_weights,
+    load_model_source,
+    model_inputs,
+    share_model_weights,
+)
 from routers.schema.predict_response import PredictResponse
+from routers.schema.fragment import LabelMapEncoding, MaskFormat
 from routers.core.config import ModelConfig
+from routers.core.deadline import Deadline
+from routers.core.history import FragmentHistory
+from routers.core.memory import (
+    DetectionWindow,
+    MemoryBudget,
+    estimate_request_memory,
+    measure_request_memory,
+)
+from routers.core.scheduler import (
+    ClientLimitExceeded,
+    Priority,
+    PriorityScheduler,
+    parse_api_key_priorities,
+    resolve_priority,
+)
+from routers.core.session_pool import PoolMode, SessionPool, plan_sessions
 
 #Utils
 from utils.image_processing import (
@@ -20,25 +52,57 @@ from utils.image_processing import (
     calculate_mask_metrics,
     calculate_size,
     conversion_func,
+    paste_roi_mask,
     preprocess_image,
 )
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
+# Messages repeated for every fragment are sampled
+fragment_logger = sampled_logger(f"{__name__}.fragments")
 
 # ============= Model Loading =============
 MODEL_CONFIG = ModelConfig()
 try:
     ort.set_default_logger_severity(3)
-    ort_session = ort.InferenceSession(
-        MODEL_CONFIG.model_path,
-        providers=['CPUExecutionProvider']  # Can be extended to include CUDA provider
-    )
-    logger = logging.getLogger(__name__)
-    logger.info(f"Model loaded successfully from {MODEL_CONFIG.model_path}")
+    # Only the model is read at import time. The session and its thread pools are created
+    # per process (see get_session), so a preloading server can safely fork its workers.
+    model_path = MODEL_CONFIG.model_path
+    if MODEL_CONFIG.share_weights and model_path.endswith(".onnx") and not has_external_weights(model_path):
+        model_path = share_model_weights(model_path, MODEL_CONFIG.model_cache_dir)
+    MODEL = load_model_source(model_path)
+    logger.info("Model read successfully from %s", model_path)
 except Exception as e:
-    logger.error(f"Failed to load model: {str(e)}")
+    logger.error("Failed to load model: %s", e)
     raise
 
+# Session runs cannot be interrupted from asyncio, so they run on the threads of the pool
+# and are stopped through RunOptions.terminate once the request deadline passes.
+SESSION_POOL = SessionPool(
+    MODEL,
+    *plan_sessions(PoolMode(MODEL_CONFIG.session_pool_mode), MODEL_CONFIG.intra_op_threads, MODEL_CONFIG.session_threads),
+    runs_per_session=MODEL_CONFIG.inference_workers,
+    pin=MODEL_CONFIG.pin_threads
+)
+
+def get_session() -> ort.InferenceSession:
+    """First ONNX Runtime session of the current process, created on first use. All sessions
+    of the pool hold the same model, use it to inspect the model."""
+    return SESSION_POOL.sessions[0].session
+
+# Decides which queued request gets the next inference thread
+SCHEDULER = PriorityScheduler(
+    slots=SESSION_POOL.capacity,
+    bulk_min_share=MODEL_CONFIG.bulk_min_share,
+    max_client_concurrency=MODEL_CONFIG.max_client_concurrency
+)
+API_KEY_PRIORITIES = parse_api_key_priorities(MODEL_CONFIG.api_key_priorities)
+# Admits requests while their estimated memory fits, mask probabilities dominate it
+MEMORY_BUDGET = MemoryBudget(MODEL_CONFIG.memory_budget_mb * 1024 * 1024)
+DETECTIONS = DetectionWindow(MODEL_CONFIG.expected_detections, MODEL_CONFIG.max_detections)
+# Optional record of every analysed image and its fragments, for the /history queries
+HISTORY = FragmentHistory(
+    MODEL_CONFIG.history_dir, MODEL_CONFIG.history_flush_rows, MODEL_CONFIG.history_flush_seconds
+) if MODEL_CONFIG.history_dir else None
+
 # ============= Router Setup =============
 router = APIRouter()
 BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
@@ -55,58 +119,165 @@ histogram = meter.create_histogram(
     description="Predict response histogram",
     unit="seconds",
 )
+
+queue_wait_histogram = meter.create_histogram(
+    name="predict_queue_wait_histogram",
+    description="Time spent waiting for an inference slot, per priority class",
+    unit="seconds",
+)
+memory_estimate_histogram = meter.create_histogram(
+    name="predict_memory_estimate_bytes",
+    description="Memory reserved for a request when it is admitted",
+    unit="bytes",
+)
+
+memory_peak_histogram = meter.create_histogram(
+    name="predict_memory_peak_bytes",
+    description="Memory a request actually held at its peak (input, model outputs, masks)",
+    unit="bytes",
+)
+
+memory_wait_histogram = meter.create_histogram(
+    name="predict_memory_wait_histogram",
+    description="Time spent waiting for the memory budget",
+    unit="seconds",
+)
+
+def observe_memory_budget(options: CallbackOptions):
+    yield Observation(MEMORY_BUDGET.reserved, {"state": "reserved"})
+    yield Observation(MEMORY_BUDGET.budget_bytes, {"state": "budget"})
+
+meter.create_observable_gauge(
+    name="predict_memory_budget_bytes",
+    callbacks=[observe_memory_budget],
+    description="Memory reserved by admitted requests, and the budget",
+    unit="bytes",
+)
+
+meter.create_observable_gauge(
+    name="predict_memory_queue_depth",
+    callbacks=[lambda options: [Observation(MEMORY_BUDGET.queue_depth())]],
+    description="Requests waiting for the memory budget",
+)
+
+def observe_sessions(options: CallbackOptions):
+    for index, in_flight in enumerate(SESSION_POOL.in_flight()):
+        yield Observation(in_flight, {"session": str(index)})
+
+meter.create_observable_gauge(
+    name="inference_session_in_flight",
+    callbacks=[observe_sessions],
+    description="Runs queued or executing on each session of the pool",
+)
+
+def observe_session_busy_time(options: CallbackOptions):
+    for index, busy in enumerate(SESSION_POOL.busy_time()):
+        yield Observation(busy, {"session": str(index)})
+
+meter.create_observable_counter(
+    name="inference_session_busy_seconds",
+    callbacks=[observe_session_busy_time],
+    description="Time each session spent running the model, its rate is the number of busy inference threads",
+    unit="seconds",
+)
+
+# Images being analysed by this worker, from admission to response, over every endpoint
+_in_flight = 0
+
+meter.create_observable_gauge(
+    name="predict_in_flight",
+    callbacks=[lambda options: [Observation(_in_flight)]],
+    description="Images admitted and not answered yet (waiting for a slot or memory, or running)",
+)
+
+def observe_inference_slots(options: CallbackOptions):
+    yield Observation(SCHEDULER.slots_in_use(), {"state": "used"})
+    yield Observation(SCHEDULER.slots, {"state": "total"})
+
+meter.create_observable_gauge(
+    name="predict_inference_slots",
+    callbacks=[observe_inference_slots],
+    description="Inference slots in use, and the number of slots",
+)
+
+def observe_queue_depth(options: CallbackOptions):
+    for priority in Priority:
+        yield Observation(SCHEDULER.queue_depth(priority), {"priority": priority.value})
+
+meter.create_observable_gauge(
+    name="predict_queue_depth",
+    callbacks=[observe_queue_depth],
+    description="Requests waiting for an inference slot, per priority class",
+)
+
+timeout_counter = meter.create_counter(
+    name="predict_timeouts",
+    description="Requests that ran out of time, by the stage they were in",
+)
+
+rejection_counter = meter.create_counter(
+    name="predict_rejections",
+    description="Requests refused without being analysed, by reason",
+)
+
+meter.create_observable_counter(
+    name="log_records_dropped",
+    callbacks=[lambda options: [Observation(dropped_records())]],
+    description="Log records dropped because the logging thread could not keep up",
+)
 # ============= Main =============
 @router.post("/predict")
 async def predict(
+    request: Request,
     file: UploadFile = File(...), 
     score_threshold: float = Query(MODEL_CONFIG.scrore_threshold, ge=0.0, le=1.0),
     include_mask: bool = Query(False, description="Include binary mask data in response"),
-    include_metrics: bool = Query(False, description="Include fragment metrics in response")
+    include_metrics: bool = Query(False, description="Include fragment metrics in response"),
+    mask_format: MaskFormat = Query(MaskFormat.rle, description="Mask layout: per-fragment 'rle' or 'polygon', or a single 'label_map' for the whole frame"),
+    label_map_encoding: LabelMapEncoding = Query(LabelMapEncoding.png, description="Compression of the label map ('png' or 'rle')"),
+    polygon_tolerance: float = Query(MODEL_CONFIG.polygon_tolerance, ge=0.0, description="Polygon simplification tolerance in pixels (0 keeps every contour point)"),
+    site: Optional[str] = Query(None, max_length=100, description="Blast site of the image, recorded in the history store"),
+    image_id: Optional[str] = Query(None, max_length=200, description="Identifier recorded in the history store (default: SHA-1 of the image)"),
+    captured_at: Optional[datetime] = Query(None, description="When the image was taken, recorded in the history store (default: now, UTC if no offset)")
 ):
     # Mark the starting point for the response
     start_time = time.time()
+    deadline = get_deadline(request)
+    priority, client_id = resolve_priority(
+        request.headers,
+        request.client.host if request.client else None,
+        API_KEY_PRIORITIES,
+        Priority(MODEL_CONFIG.default_priority)
+    )
     temp_path: Optional[str] = None
     logger.info("Sending POST /predict request!")
     try:
-        logger.debug(f"Received prediction request for file: {file.filename}")
+        logger.debug("Received prediction request for file: %s", file.filename)
 
         # Read file content
         contents = await file.read()
-        logger.debug(f"Read {len(contents)} bytes from file")
+        logger.debug("Read %d bytes from file", len(contents))
 
         # Save file temporarily
         temp_path = save_temp_file(contents)
 
         image_tensor = prepare_image(contents)
-
-        # Run inference with timeout
-        boxes, scores, mask_probs = run_inference(image_tensor, start_time)
-        
-        # Filter by score threshold
-        mask = scores > score_threshold
-        boxes = boxes[mask]
-        scores = scores[mask]
-        mask_probs = mask_probs[mask]
-
-        if len(boxes) == 0:
-            logger.warning("No fragments detected above threshold")
-            return PredictResponse()
-
-        # Calculate metrics for each mask only if requested
-        boxes, scores, processed_masks, mask_metrics_list = process_masks(
-            boxes, scores, mask_probs, start_time, include_metrics
+        response = await analyse_image(
+            image_tensor, deadline, priority, client_id, score_threshold, include_mask, include_metrics,
+            mask_format, label_map_encoding, polygon_tolerance
         )
-
-        # Ensure boxes is a numpy array
-        if not isinstance(boxes, np.ndarray):
-            boxes = np.array(boxes)
-
-        # Create fragments list with all required fields
-        return build_response(boxes, scores, processed_masks, mask_metrics_list, include_mask, include_metrics)
-
+        record_history(response, image_id or hashlib.sha1(contents).hexdigest(), site, captured_at)
+        return response
+
+    except ClientLimitExceeded as e:
+        logger.warning("Rejected request from %s: %s", client_id, e)
+        raise HTTPException(status_code=429, detail=str(e)) from e
+    except (TimeoutError, asyncio.TimeoutError) as e:
+        logger.warning("Prediction timed out: %s", e)
+        raise HTTPException(status_code=504, detail=str(e) or "Request deadline exceeded") from e
     except Exception as e:
-        logger.error(f"Error in prediction: {str(e)}")
-        logger.error(traceback.format_exc())
+        # The traceback is rendered by the logging thread
+        logger.exception("Error in prediction: %s", e)
         raise HTTPException(status_code=500, detail=str(e)) from e
     finally:
         ending_time = time.time()
@@ -115,10 +286,125 @@ async def predict(
         if temp_path and os.path.exists(temp_path):
             try:
                 os.unlink(temp_path)
-                logger.debug(f"Cleaned up temporary file: {temp_path}")
+                logger.debug("Cleaned up temporary file: %s", temp_path)
             except Exception as e:
-                logger.warning(f"Failed to clean up temporary file {temp_path}: {str(e)}")
+                logger.warning("Failed to clean up temporary file %s: %s", temp_path, e)
     
+async def analyse_image(
+    image_tensor: np.ndarray, deadline: Deadline, priority: Priority, client_id: str,
+    score_threshold: float, include_mask: bool = False, include_metrics: bool = False,
+    mask_format: MaskFormat = MaskFormat.rle, label_map_encoding: LabelMapEncoding = LabelMapEncoding.png,
+    polygon_tolerance: float = MODEL_CONFIG.polygon_tolerance
+):
+    """Schedule, run and post-process one preprocessed image within its deadline."""
+    global _in_flight
+    height, width = image_tensor.shape[2:]
+    binary_masks = include_mask or include_metrics
+    label_map = include_mask and mask_format == MaskFormat.label_map
+    session = get_session()
+
+    bind_log_context(priority=priority.value)
+    # Stage the request is in, for the timeout counter
+    stage = "queue"
+    _in_flight += 1
+    try:
+        async with AsyncExitStack() as stack:
+            # Wait for our turn first: queued requests hold no memory, so the scheduler
+            # alone decides who goes next, and bulk work cannot hold back interactive requests
+            async with SCHEDULER.slot(priority, client_id, deadline) as queue_wait:
+                queue_wait_histogram.record(queue_wait, {"priority": priority.value})
+
+                # Then wait until its memory fits, it is held until the response is built
+                stage = "memory"
+                estimate = estimate_request_memory(
+                    height, width, DETECTIONS.expected(), binary_masks, label_map,
+                    has_fused_postprocess(session), has_roi_masks(session)
+                )
+                waiting_since = time.monotonic()
+                reservation = await stack.enter_async_context(MEMORY_BUDGET.reserve(estimate, deadline))
+                memory_wait_histogram.record(time.monotonic() - waiting_since)
+                memory_estimate_histogram.record(estimate)
+
+                # Run inference within the request deadline
+                stage = "inference"
+                boxes, scores, mask_probs = await run_inference(image_tensor, deadline, score_threshold)
+
+            # The outputs exist now, account for what they really take
+            DETECTIONS.record(len(mask_probs))
+            kept = int(np.count_nonzero(scores > score_threshold))
+            reservation.resize(measure_request_memory(
+                image_tensor, (boxes, scores, mask_probs), kept, binary_masks, label_map
+            ))
+            memory_peak_histogram.record(reservation.peak)
+
+            # CPU-bound, keep it off the event loop. The log context follows it to the thread.
+            stage = "postprocess"
+            return await asyncio.get_running_loop().run_in_executor(
+                None, contextvars.copy_context().run, postprocess,
+                boxes, scores, mask_probs, deadline, score_threshold, include_mask, include_metrics,
+                mask_format, label_map_encoding, polygon_tolerance
+            )
+    except ClientLimitExceeded:
+        rejection_counter.add(1, {"reason": "client_limit"})
+        raise
+    except (TimeoutError, asyncio.TimeoutError):
+        timeout_counter.add(1, {"stage": stage})
+        raise
+    finally:
+        _in_flight -= 1
+
+def postprocess(
+    boxes: np.ndarray, scores: np.ndarray, mask_probs: np.ndarray, deadline: Deadline,
+    score_threshold: float, include_mask: bool = False, include_metrics: bool = False,
+    mask_format: MaskFormat = MaskFormat.rle, label_map_encoding: LabelMapEncoding = LabelMapEncoding.png,
+    polygon_tolerance: float = MODEL_CONFIG.polygon_tolerance
+):
+    """Turn raw model outputs into the response: threshold, masks, metrics and size analytics."""
+    # Filter by score threshold, fused graphs already did
+    mask = scores > score_threshold
+    if not mask.all():
+        boxes = boxes[mask]
+        scores = scores[mask]
+        mask_probs = mask_probs[mask]
+
+    if len(boxes) == 0:
+        logger.warning("No fragments detected above threshold")
+        return PredictResponse()
+
+    # Skip optional work rather than failing when the deadline is close
+    skipped = []
+    if include_mask and deadline.remaining() < MODEL_CONFIG.degrade_margin:
+        logger.warning("Deadline is close, skipping masks")
+        include_mask = False
+        skipped.append("mask")
+
+    if include_mask or include_metrics:
+        # Calculate metrics for each mask only if requested
+        detected = len(boxes)
+        boxes, scores, processed_masks, mask_metrics_list = process_masks(
+            boxes, scores, mask_probs, deadline, include_metrics
+        )
+        if len(boxes) < detected:
+            skipped.append("fragments")
+        if include_metrics and any(metrics is None for metrics in mask_metrics_list):
+            skipped.append("metrics")
+    else:
+        processed_masks = [None] * len(boxes)
+        mask_metrics_list = [None] * len(boxes)
+
+    # Ensure boxes is a numpy array
+    if not isinstance(boxes, np.ndarray):
+        boxes = np.array(boxes)
+
+    # Create fragments list with all required fields
+    response = build_response(
+        boxes, scores, processed_masks, mask_metrics_list, include_mask, include_metrics,
+        mask_format, label_map_encoding, polygon_tolerance
+    )
+    response["partial"] = bool(skipped)
+    response["skipped"] = skipped
+    return response
+
 def update_metrics(label: dict, starting_time, ending_time):
         # Increase the counter
         counter.add(1, label)
@@ -126,15 +412,26 @@ def update_metrics(label: dict, starting_time, ending_time):
         elapsed_time = ending_time - starting_time
 
         # Add histogram
-        logger.info("elapsed time: ", elapsed_time)
-        logger.info(elapsed_time)
+        logger.info("%s answered in %.3fs", label.get("api"), elapsed_time)
         histogram.record(elapsed_time, label)
     
 
+def record_history(response, image_id: str, site: Optional[str] = None, captured_at: Optional[datetime] = None):
+    """Add an analysed image to the history store when it is enabled, also without fragments."""
+    if HISTORY is None:
+        return
+    fragments = response["fragments"] if isinstance(response, dict) else []
+    HISTORY.append(image_id, site, captured_at or datetime.now(timezone.utc), fragments)
+
+def get_deadline(request: Request) -> Deadline:
+    """Deadline attached by TimeoutMiddleware, or the configured default."""
+    deadline = getattr(request.state, "deadline", None)
+    return deadline if deadline is not None else Deadline(MODEL_CONFIG.timeout)
+
 def prepare_image(contents: bytes) -> np.ndarray:
     # Preprocess image
     image_tensor = preprocess_image(contents)
-    logger.debug(f"Preprocessed image shape: {image_tensor.shape}, dtype: {image_tensor.dtype}")
+    logger.debug("Preprocessed image shape: %s, dtype: %s", image_tensor.shape, image_tensor.dtype)
 
     # Validate input shape
     if not validate_input_shape(image_tensor):
@@ -143,7 +440,10 @@ def prepare_image(contents: bytes) -> np.ndarray:
         raise ValueError(error_msg)
     return image_tensor
 
-def build_response(boxes, scores, processed_masks, mask_metrics_list, include_mask=False, include_metrics=False):
+def build_response(
+    boxes, scores, processed_masks, mask_metrics_list, include_mask=False, include_metrics=False,
+    mask_format=MaskFormat.rle, label_map_encoding=LabelMapEncoding.png, polygon_tolerance=MODEL_CONFIG.polygon_tolerance
+):
     size_metrics = analyze_fragment_sizes(boxes)
     fragments = []
     for i, (box, score, mask, metrics) in enumerate(zip(boxes, scores, processed_masks, mask_metrics_list)):
@@ -160,121 +460,126 @@ def build_response(boxes, scores, processed_masks, mask_metrics_list, include_ma
         }
 
         # Add optional fields if requested
-        if include_mask:
+        if include_mask and mask_format == MaskFormat.rle:
             # Convert mask to a more efficient format for visualization
             x1, y1, x2, y2 = [int(coord) for coord in box]
             # Crop mask to bounding box
             cropped_mask = mask[y1:y2, x1:x2]
             # Convert to run-length encoding for efficient storage
-            rle_mask = binary_mask_to_rle(cropped_mask)
+            rle_mask = encode_rle(cropped_mask)
             fragment_data["mask_data"] = {
                 "rle": rle_mask,
                 "bbox": [x1, y1, x2, y2],
                 "shape": [y2-y1, x2-x1]  # Height, Width
             }
+        elif include_mask and mask_format == MaskFormat.polygon:
+            x1, y1, x2, y2 = [int(coord) for coord in box]
+            fragment_data["mask_data"] = {
+                "polygons": encode_polygon(mask, (x1, y1, x2, y2), polygon_tolerance),
+                "bbox": [x1, y1, x2, y2]
+            }
         if include_metrics:
             fragment_data["metrics"] = metrics
 
         fragments.append(fragment_data)
 
-    return {
+    response = {
         "fragments": fragments,
         "size_metrics": size_metrics
     }
+    if include_mask and mask_format == MaskFormat.label_map:
+        label_map = build_label_map(boxes, scores, processed_masks)
+        response["label_map"] = encode_label_map(label_map, LabelMapEncoding(label_map_encoding).value)
+    return response
+
+def build_label_map(boxes, scores, masks) -> np.ndarray:
+    """Merge binary masks into a single uint16 instance-ID image.
+    Pixel value is fragment id + 1, 0 is background. Where fragments overlap
+    the one with the higher score wins."""
+    height, width = masks[0].shape if len(masks) else MODEL_CONFIG.input_size
+    label_map = np.zeros((height, width), dtype=np.uint16)
+
+    # Paint in ascending score order so higher scores overwrite lower ones
+    for i in np.argsort(scores, kind="stable"):
+        x1, y1, x2, y2 = [int(coord) for coord in boxes[i]]
+        crop = masks[i][y1:y2, x1:x2] > 0
+        label_map[y1:y2, x1:x2][crop] = i + 1
+    return label_map
+
+async def run_inference(image_tensor: np.ndarray, deadline: Deadline, score_threshold: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    deadline.check("Preprocessing")
+
+    run_options = ort.RunOptions()
+    future = asyncio.wrap_future(
+        SESSION_POOL.submit(run_session, image_tensor, run_options, deadline, score_threshold)
+    )
+    try:
+        # Cancelling the future drops it if it is still queued in the executor
+        ort_outs = await asyncio.wait_for(future, timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        # Stop the session run that is already executing on the worker thread
+        run_options.terminate = True
+        raise TimeoutError(f"Inference exceeded the request deadline of {deadline.timeout:.1f}s")
 
-def binary_mask_to_rle(mask: np.ndarray) -> list:
-    """Convert binary mask to run-length encoding format.
-    Returns a list of [start, length] pairs where start is the index of the first 1
-    and length is the number of consecutive 1s."""
-    # Flatten the mask
-    flat_mask = mask.flatten()
-    rle = []
-    start = None
-    
-    for i, val in enumerate(flat_mask):
-        if val == 1 and start is None:
-            start = i
-        elif val == 0 and start is not None:
-            rle.append([start, i - start])
-            start = None
-    
-    # Handle case where mask ends with 1s
-    if start is not None:
-        rle.append([start, len(flat_mask) - start])
-    
-    return rle
-
-def rle_to_binary_mask(rle, shape):
-    """Convert run-length encoding back to binary mask.
-    Args:
-        rle: List of [start, length] pairs
-        shape: [height, width] of the mask
-    Returns:
-        Binary mask of shape (height, width)
-    """
-    height, width = shape
-    mask = np.zeros(height * width, dtype=np.uint8)
-    
-    for start, length in rle:
-        if 0 <= start < len(mask) and length > 0:
-            end = min(start + length, len(mask))
-            mask[start:end] = 1
-    
-    return mask.reshape(height, width)
-
-def run_inference(image_tensor: np.ndarray,  start_time: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
-    ort_inputs = {ort_session.get_inputs()[0].name: image_tensor}
-    if time.time() - start_time > MODEL_CONFIG.timeout:
-            warning_msg = "Preprocessing took too long"
-            logger.warning(warning_msg)
-            raise TimeoutError(warning_msg)
+    return unpack_outputs(ort_outs)
 
-    logger.info("Running inference...")
-    ort_outs = ort_session.run(None, ort_inputs)
-    
+def unpack_outputs(ort_outs: list) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Boxes, scores and mask probabilities from the raw session outputs."""
     # Debug: Log the shape and content details of model outputs
     for i, out in enumerate(ort_outs):
-        logger.debug(f"Model output {i} shape: {out.shape}, dtype: {out.dtype}")
+        logger.debug("Model output %d shape: %s, dtype: %s", i, out.shape, out.dtype)
     
     # Important: The actual mask data is in ort_outs[3], not ort_outs[2]
     # ort_outs[2] contains scalar confidence values
     boxes, scores, mask_confidence = ort_outs[0], ort_outs[1], ort_outs[2]
     mask_probs = ort_outs[3]  # This contains the actual mask data
     
-    logger.debug(f"Boxes shape: {boxes.shape}, dtype: {boxes.dtype}")
-    logger.debug(f"Scores shape: {scores.shape}, dtype: {scores.dtype}")
-    logger.debug(f"Mask confidence shape: {mask_confidence.shape}, dtype: {mask_confidence.dtype}")
-    logger.debug(f"Mask probs shape: {mask_probs.shape}, dtype: {mask_probs.dtype}")
-    
-    # Check if we've exceeded the timeout
-    if time.time() - start_time > MODEL_CONFIG.timeout:
-        raise TimeoutError("Inference took too long")
+    logger.debug("Boxes shape: %s, dtype: %s", boxes.shape, boxes.dtype)
+    logger.debug("Scores shape: %s, dtype: %s", scores.shape, scores.dtype)
+    logger.debug("Mask confidence shape: %s, dtype: %s", mask_confidence.shape, mask_confidence.dtype)
+    logger.debug("Mask probs shape: %s, dtype: %s", mask_probs.shape, mask_probs.dtype)
     
     return boxes, scores, mask_probs
 
-def process_masks(boxes, scores, mask_probs, start_time, include_metrics=False):
+def run_session(session: ort.InferenceSession, image_tensor: np.ndarray, run_options, deadline: Deadline,
+                score_threshold: float) -> list:
+    """Executed on an inference thread of the pool. Work whose deadline already passed
+    while waiting in the queue never reaches the model."""
+    deadline.check("Queued inference")
+    ort_inputs = model_inputs(session, image_tensor, score_threshold)
+    logger.debug("Running inference...")
+    return session.run(None, ort_inputs, run_options)
+
+def process_masks(boxes, scores, mask_probs, deadline: Deadline, include_metrics=False):
+    """Binarize masks and optionally compute their metrics. Once the deadline is
+    close, metrics of the remaining fragments are left as None. Once it has passed,
+    the remaining fragments are dropped and only those finished so far are returned."""
     mask_metrics_list = []
     processed_masks = []
     MASK_THRESHOLD = 0.5
     for i, (box, score, mask_prob) in enumerate(zip(boxes, scores, mask_probs)):
-        # Check timeout
-        if time.time() - start_time > MODEL_CONFIG.timeout:
-            raise TimeoutError("Mask processing took too long")
+        if deadline.expired():
+            logger.warning("Deadline passed, returning %d of %d fragments", i, len(boxes))
+            boxes, scores = boxes[:i], scores[:i]
+            break
+        if include_metrics and deadline.remaining() < MODEL_CONFIG.degrade_margin:
+            logger.warning("Deadline is close, skipping metrics from mask %d", i)
+            include_metrics = False
 
-        logger.debug(f"Processing mask {i}")
+        # The statistics below scan the whole mask, only compute them when they are logged
+        debug = fragment_logger.isEnabledFor(logging.DEBUG)
 
         if mask_prob.ndim == 3:  # If shape is [1, H, W]
             mask_prob = mask_prob.squeeze(0) if mask_prob.shape[0] == 1 else mask_prob[0]
-        # Debug: Log mask probabilities
-        logger.debug(f"Mask {i} shape: {mask_prob.shape}, min: {np.min(mask_prob)}, max: {np.max(mask_prob)}, mean: {np.mean(mask_prob)}")
-
-        # Show histogram of mask probability values (debug)
-        unique_values, counts = np.unique(mask_prob, return_counts=True)
-        if len(unique_values) < 20:  # Only log if there aren't too many unique values
-            logger.debug(f"Mask {i} unique probability values: {unique_values}")
-            logger.debug(f"Mask {i} probability value counts: {counts}")
-        else:
-            logger.debug(f"Mask {i} has {len(unique_values)} unique values")
+        if debug:
+            fragment_logger.debug("Mask %d shape: %s, min: %s, max: %s, mean: %s",
+                                  i, mask_prob.shape, np.min(mask_prob), np.max(mask_prob), np.mean(mask_prob))
+            # Histogram of mask probability values
+            unique_values, counts = np.unique(mask_prob, return_counts=True)
+            if len(unique_values) < 20:  # Only log if there aren't too many unique values
+                fragment_logger.debug("Mask %d unique probability values: %s, counts: %s", i, unique_values, counts)
+            else:
+                fragment_logger.debug("Mask %d has %d unique values", i, len(unique_values))
 
         # Convert box coordinates to integers and ensure they're within bounds
         x1, y1, x2, y2 = [int(coord) for coord in box]
@@ -283,16 +588,24 @@ def process_masks(boxes, scores, mask_probs, start_time, include_metrics=False):
         x2 = max(0, min(x2, 511))
         y2 = max(0, min(y2, 511))
 
-        # Threshold the mask probabilities to get binary mask
-        binary_mask = (mask_prob > MASK_THRESHOLD).astype(np.uint8)
+        # Threshold the mask probabilities to get binary mask, fused graphs return it already
+        if mask_prob.shape != tuple(MODEL_CONFIG.input_size):
+            # Per-ROI mask, only pasted into the frame now that its pixels are needed
+            binary_mask = paste_roi_mask(mask_prob, box, MODEL_CONFIG.input_size, MASK_THRESHOLD)
+        elif mask_prob.dtype == np.uint8:
+            binary_mask = mask_prob
+        else:
+            binary_mask = (mask_prob > MASK_THRESHOLD).astype(np.uint8)
 
-        logger.debug(f"Binary mask {i} - min: {np.min(binary_mask)}, max: {np.max(binary_mask)}, mean: {np.mean(binary_mask)}")
+        if debug:
+            fragment_logger.debug("Binary mask %d - min: %s, max: %s, mean: %s",
+                                  i, np.min(binary_mask), np.max(binary_mask), np.mean(binary_mask))
 
         # Calculate metrics only if requested
         metrics = None
         if include_metrics:
             metrics = calculate_mask_metrics(binary_mask)
-            logger.debug(f"Mask {i} metrics: {metrics}")
+            fragment_logger.debug("Mask %d metrics: %s", i, metrics)
             mask_metrics_list.append(metrics)
         else:
             mask_metrics_list.append(None)
@@ -300,11 +613,11 @@ def process_masks(boxes, scores, mask_probs, start_time, include_metrics=False):
         processed_masks.append(binary_mask)
     return boxes, scores, processed_masks, mask_metrics_list
 
-def save_temp_file(contents: bytes) -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
+def save_temp_file(contents: bytes, suffix: str = '.jpg') -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
             temp_file.write(contents)
             temp_path = temp_file.name
-    logger.debug(f"Saved file to {temp_path}")
+    logger.debug("Saved file to %s", temp_path)
     return temp_path 
 
 def validate_input_shape(tensor: np.ndarray) -> bool:
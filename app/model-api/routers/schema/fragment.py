@@ -1,6 +1,16 @@
+from enum import Enum
 from pydantic import BaseModel, Field
 from typing import Annotated, Optional, List
 
+class MaskFormat(str, Enum):
+    rle       = "rle"        # One cropped RLE mask per fragment
+    label_map = "label_map"  # One uint16 instance-ID image for the whole frame
+    polygon   = "polygon"    # Simplified outlines per fragment, every part with its holes
+
+class LabelMapEncoding(str, Enum):
+    png = "png"  # 16-bit grayscale PNG, base64 encoded
+    rle = "rle"  # [start, length, instance_id] runs over the flattened image
+
 class FragmentMetrics(BaseModel):
     area:        float = Field(0, description="Area of the fragment in pixels")
     perimeter:   float = Field(0, description="Perimeter of the fragment in pixels")
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List
+from routers.schema.predict_response import SizeDistribution
+
+class SizeSummary(BaseModel):
+    fragments:   int = Field(0, description="Number of fragments")
+    images:      int = Field(0, description="Number of distinct images")
+    mean_size:   float = 0.0
+    percentiles: Dict[str, float] = Field({}, description="Fragment size (cm) by percentile, e.g. {'p50': 12.3}")
+
+class SizeHistory(SizeSummary):
+    size_distribution: SizeDistribution = SizeDistribution()
+
+class SizePeriod(SizeSummary):
+    period: str = Field(..., description="Day (YYYY-MM-DD) or month (YYYY-MM)")
+
+class SizeTimeline(BaseModel):
+    interval: str
+    periods:  List[SizePeriod] = []
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from routers.schema.fragment import Fragment
 class SizeDistribution(BaseModel):
     bins:   list = []
@@ -13,7 +13,17 @@ class SizeMetrics(BaseModel):
     std_size:   float = 0.0
     size_distribution: SizeDistribution
 
+class LabelMap(BaseModel):
+    encoding:   str = Field(..., description="Encoding of the instance-ID image ('png' or 'rle')")
+    shape:      List[int] = Field(..., description="Height, Width of the instance-ID image")
+    dtype:      str = "uint16"
+    data:       Optional[str] = Field(None, description="Base64 PNG data (png encoding)")
+    rle:        Optional[List[List[int]]] = Field(None, description="[start, length, instance_id] runs (rle encoding)")
+
 class PredictResponse(BaseModel):
     fragments: List[Fragment] = []
     size_mectrics: List[SizeMetrics] = []
+    label_map: Optional[LabelMap] = Field(None, description="Instance-ID image, pixel value = fragment id + 1 (only with mask_format=label_map)")
+    partial: bool = Field(False, description="True when optional outputs were skipped to meet the request deadline")
+    skipped: List[str] = Field([], description="Optional outputs that were skipped ('mask', 'metrics', or 'fragments' when only the first ones were processed)")
 
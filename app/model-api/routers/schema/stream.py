@@ -0,0 +1,32 @@
+from datetime import datetime
+from enum import Enum
+from pydantic import BaseModel, Field
+from typing import List, Optional, Union
+from routers.schema.fragment import LabelMapEncoding, MaskFormat
+
+class ChannelOrder(str, Enum):
+    rgb = "rgb"
+    bgr = "bgr"  # OpenCV order
+
+class FrameOptions(BaseModel):
+    """Options of the frames sent over /ws/predict. A JSON text message updates them for every
+    following frame, except frame_id which only names the next one."""
+    frame_id:           Optional[Union[int, str]] = Field(None, description="Identifier echoed in the result of the next frame (a sequence number by default)")
+    score_threshold:    float = Field(0.3, ge=0.0, le=1.0)
+    include_mask:       bool  = Field(False, description="Include binary mask data in results")
+    include_metrics:    bool  = Field(False, description="Include fragment metrics in results")
+    mask_format:        MaskFormat = MaskFormat.rle
+    label_map_encoding: LabelMapEncoding = LabelMapEncoding.png
+    polygon_tolerance:  float = Field(1.0, ge=0.0)
+    timeout:            Optional[float] = Field(None, gt=0.0, description="Deadline of each frame in seconds (capped at the server maximum)")
+    site:               Optional[str] = Field(None, max_length=100, description="Blast site of the frames, recorded in the history store")
+
+class SharedFrame(BaseModel):
+    """Handle of a decoded frame written by a co-located client, for /predict/shm."""
+    name:           str = Field(..., description="File name of the frame inside the shared-memory directory (a multiprocessing.shared_memory name on Linux)")
+    shape:          List[int] = Field(..., min_length=3, max_length=3, description="Height, Width, 3 of the uint8 frame")
+    offset:         int = Field(0, ge=0, description="Byte offset of the frame in the file")
+    channel_order:  ChannelOrder = ChannelOrder.rgb
+    site:           Optional[str] = Field(None, max_length=100, description="Blast site of the frame, recorded in the history store")
+    image_id:       Optional[str] = Field(None, max_length=200, description="Identifier recorded in the history store (default: a random id)")
+    captured_at:    Optional[datetime] = Field(None, description="When the frame was taken, recorded in the history store (default: now, UTC if no offset)")
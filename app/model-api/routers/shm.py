@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from routers.core.scheduler import ClientLimitExceeded, Priority, resolve_priority
+from routers.predict import (
+    API_KEY_PRIORITIES,
+    MODEL_CONFIG,
+    analyse_image,
+    get_deadline,
+    record_history,
+    update_metrics,
+)
+from routers.schema.fragment import LabelMapEncoding, MaskFormat
+from routers.schema.stream import ChannelOrder, SharedFrame
+from utils.image_processing import frame_to_tensor
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+SHM_ALLOWED_HOSTS = {host.strip() for host in MODEL_CONFIG.shm_allowed_hosts.split(",") if host.strip()}
+
+@router.post("/predict/shm")
+async def predict_shared_frame(
+    request: Request,
+    frame: SharedFrame,
+    score_threshold: float = Query(MODEL_CONFIG.scrore_threshold, ge=0.0, le=1.0),
+    include_mask: bool = Query(False, description="Include binary mask data in response"),
+    include_metrics: bool = Query(False, description="Include fragment metrics in response"),
+    mask_format: MaskFormat = Query(MaskFormat.rle, description="Mask layout: per-fragment 'rle' or 'polygon', or a single 'label_map' for the whole frame"),
+    label_map_encoding: LabelMapEncoding = Query(LabelMapEncoding.png, description="Compression of the label map ('png' or 'rle')"),
+    polygon_tolerance: float = Query(MODEL_CONFIG.polygon_tolerance, ge=0.0, description="Polygon simplification tolerance in pixels (0 keeps every contour point)")
+):
+    """Local fast path for co-located producers: the frame is read from shared memory
+    instead of an encoded upload, and converted straight into the model input."""
+    start_time = time.time()
+    client_host = request.client.host if request.client else None
+    if client_host not in SHM_ALLOWED_HOSTS:
+        raise HTTPException(status_code=403, detail="/predict/shm is only available to local clients")
+
+    deadline = get_deadline(request)
+    priority, client_id = resolve_priority(
+        request.headers, client_host, API_KEY_PRIORITIES, Priority(MODEL_CONFIG.default_priority)
+    )
+    try:
+        # Mapping and converting a large frame is blocking, keep it off the event loop
+        image_tensor = await asyncio.get_running_loop().run_in_executor(None, read_shared_frame, frame)
+        response = await analyse_image(
+            image_tensor, deadline, priority, client_id, score_threshold, include_mask, include_metrics,
+            mask_format, label_map_encoding, polygon_tolerance
+        )
+        # Hashing the raw frame would cost more than the conversion, ids are random by default
+        record_history(response, frame.image_id or uuid.uuid4().hex, frame.site, frame.captured_at)
+        return response
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    except ClientLimitExceeded as e:
+        logger.warning("Rejected request from %s: %s", client_id, e)
+        raise HTTPException(status_code=429, detail=str(e)) from e
+    except (TimeoutError, asyncio.TimeoutError) as e:
+        logger.warning("Prediction timed out: %s", e)
+        raise HTTPException(status_code=504, detail=str(e) or "Request deadline exceeded") from e
+    except Exception as e:
+        logger.exception("Error in prediction: %s", e)
+        raise HTTPException(status_code=500, detail=str(e)) from e
+    finally:
+        update_metrics({"api": "/predict/shm"}, start_time, time.time())
+
+def read_shared_frame(frame: SharedFrame) -> np.ndarray:
+    """Map the frame read-only and convert it to the 1x3xHxW float32 model input in one pass."""
+    height, width, channels = frame.shape
+    if channels != 3 or height <= 0 or width <= 0:
+        raise ValueError(f"Expected a HxWx3 frame, got shape {frame.shape}")
+
+    path = resolve_shared_path(frame.name)
+    size = height * width * channels
+    if os.path.getsize(path) < frame.offset + size:
+        raise ValueError(f"{frame.name} is smaller than offset {frame.offset} + a {height}x{width}x3 frame")
+
+    mapped = np.memmap(path, dtype=np.uint8, mode="r", offset=frame.offset, shape=(height, width, channels))
+    image_tensor = frame_to_tensor(mapped, MODEL_CONFIG.input_size, bgr=frame.channel_order == ChannelOrder.bgr)
+    # The tensor is a new array, dropping the map unmaps the segment
+    del mapped
+    return image_tensor
+
+def resolve_shared_path(name: str) -> str:
+    """Path of a frame inside shm_dir; names that would escape the directory are rejected."""
+    shm_dir = os.path.realpath(MODEL_CONFIG.shm_dir)
+    path = os.path.realpath(os.path.join(shm_dir, name))
+    if os.path.dirname(path) != shm_dir:
+        raise ValueError(f"Frame {name!r} must be a file directly inside the shared-memory directory")
+    if not os.path.isfile(path):
+        raise ValueError(f"Frame {name!r} not found in the shared-memory directory")
+    return path
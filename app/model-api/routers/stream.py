@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+
+from logging_config import bind_log_context
+from routers.core.deadline import Deadline
+from routers.core.scheduler import ClientLimitExceeded, Priority, resolve_priority
+from routers.predict import (
+    API_KEY_PRIORITIES,
+    MODEL_CONFIG,
+    analyse_image,
+    prepare_image,
+    record_history,
+    update_metrics,
+)
+from routers.schema.stream import FrameOptions
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.websocket("/ws/predict")
+async def predict_stream(websocket: WebSocket):
+    """Persistent connection for cameras. Binary messages are image frames, JSON text messages
+    update the options of the following frames. Results are sent as each frame completes,
+    tagged with its frame_id. Once max in-flight frames are running, the server stops reading
+    from the socket until one finishes, which pushes back on the client."""
+    await websocket.accept()
+    # WebSockets bypass the HTTP middleware, the connection gets its own id. Frame tasks inherit it.
+    bind_log_context(
+        request_id=websocket.headers.get("X-Request-ID") or uuid.uuid4().hex[:16],
+        client=websocket.client.host if websocket.client else None, path="/ws/predict"
+    )
+    priority, client_id = resolve_priority(
+        websocket.headers,
+        websocket.client.host if websocket.client else None,
+        API_KEY_PRIORITIES,
+        Priority(MODEL_CONFIG.default_priority)
+    )
+    # More frames in flight than the per-client scheduler limit would only be rejected
+    max_in_flight = MODEL_CONFIG.ws_max_in_flight
+    if MODEL_CONFIG.max_client_concurrency:
+        max_in_flight = min(max_in_flight, MODEL_CONFIG.max_client_concurrency)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    send_lock = asyncio.Lock()
+    options = FrameOptions(
+        score_threshold=MODEL_CONFIG.scrore_threshold,
+        polygon_tolerance=MODEL_CONFIG.polygon_tolerance
+    )
+    tasks = set()
+    sequence = 0
+    logger.info("WebSocket stream opened by %s", client_id)
+
+    try:
+        while True:
+            await in_flight.acquire()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                in_flight.release()
+                break
+
+            if message.get("bytes") is not None:
+                frame_id = options.frame_id if options.frame_id is not None else sequence
+                sequence += 1
+                task = asyncio.create_task(process_frame(
+                    websocket, send_lock, frame_id, message["bytes"], options, priority, client_id
+                ))
+                tasks.add(task)
+                task.add_done_callback(lambda task: (tasks.discard(task), in_flight.release()))
+                # frame_id only names a single frame
+                options = options.model_copy(update={"frame_id": None})
+                continue
+
+            in_flight.release()
+            try:
+                update = json.loads(message.get("text") or "")
+                if not isinstance(update, dict):
+                    raise ValueError("Options must be a JSON object")
+                options = FrameOptions.model_validate({**options.model_dump(), **update})
+            except (ValueError, ValidationError) as e:
+                await send_result(websocket, send_lock, {"error": f"Invalid options: {str(e)}", "status": 400})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Nobody is left to receive the results of frames still queued or running
+        pending = list(tasks)
+        for task in pending:
+            task.cancel()
+        # Their slots, memory and metrics are released before the connection is gone
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.info("WebSocket stream closed by %s", client_id)
+
+async def process_frame(websocket: WebSocket, send_lock: asyncio.Lock, frame_id, contents: bytes,
+                        options: FrameOptions, priority: Priority, client_id: str):
+    start_time = time.time()
+    bind_log_context(frame_id=frame_id)
+    deadline = Deadline(min(options.timeout or MODEL_CONFIG.timeout, MODEL_CONFIG.max_timeout))
+    try:
+        # Image decoding is blocking, keep it off the event loop
+        image_tensor = await asyncio.get_running_loop().run_in_executor(None, prepare_image, contents)
+        response = await analyse_image(
+            image_tensor, deadline, priority, client_id, options.score_threshold,
+            options.include_mask, options.include_metrics, options.mask_format,
+            options.label_map_encoding, options.polygon_tolerance
+        )
+        record_history(response, hashlib.sha1(contents).hexdigest(), options.site)
+        result = {"frame_id": frame_id, **jsonable_encoder(response)}
+    except ClientLimitExceeded as e:
+        result = {"frame_id": frame_id, "error": str(e), "status": 429}
+    except (TimeoutError, asyncio.TimeoutError) as e:
+        result = {"frame_id": frame_id, "error": str(e) or "Frame deadline exceeded", "status": 504}
+    except Exception as e:
+        logger.error("Error in frame %s: %s", frame_id, e)
+        result = {"frame_id": frame_id, "error": str(e), "status": 500}
+    finally:
+        update_metrics({"api": "/ws/predict"}, start_time, time.time())
+    await send_result(websocket, send_lock, result)
+
+async def send_result(websocket: WebSocket, send_lock: asyncio.Lock, result: dict):
+    # Frames complete concurrently, but messages must go out one at a time
+    async with send_lock:
+        try:
+            await websocket.send_json(result)
+        except (WebSocketDisconnect, RuntimeError):
+            logger.debug("Client disconnected before the result could be sent")
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from metrics import meter
+
+from routers.core.deadline import Deadline
+from routers.core.scheduler import ClientLimitExceeded, Priority, resolve_priority
+from routers.predict import (
+    API_KEY_PRIORITIES,
+    MODEL_CONFIG,
+    analyse_image,
+    record_history,
+    update_metrics,
+)
+from routers.schema.fragment import LabelMapEncoding, MaskFormat
+from utils.image_processing import frame_to_tensor
+from utils.video import dhash, hamming_distance, open_video, sample_frames
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+video_frames_counter = meter.create_counter(
+    name="predict_video_frames_counter",
+    description="Sampled video frames, by result (analysed, duplicate or failed)"
+)
+
+@router.post("/predict/video")
+async def predict_video(
+    request: Request,
+    file: UploadFile = File(...),
+    sample_fps: float = Query(MODEL_CONFIG.video_sample_fps, gt=0.0, le=30.0, description="Frames per second of video to sample"),
+    duplicate_distance: int = Query(MODEL_CONFIG.video_duplicate_distance, ge=0, le=64, description="Skip frames whose perceptual hash differs from the last analysed frame by at most this many bits (0 only skips identical frames)"),
+    score_threshold: float = Query(MODEL_CONFIG.scrore_threshold, ge=0.0, le=1.0),
+    include_mask: bool = Query(False, description="Include binary mask data in response"),
+    include_metrics: bool = Query(False, description="Include fragment metrics in response"),
+    mask_format: MaskFormat = Query(MaskFormat.rle, description="Mask layout: per-fragment 'rle' or 'polygon', or a single 'label_map' for the whole frame"),
+    label_map_encoding: LabelMapEncoding = Query(LabelMapEncoding.png, description="Compression of the label map ('png' or 'rle')"),
+    polygon_tolerance: float = Query(MODEL_CONFIG.polygon_tolerance, ge=0.0, description="Polygon simplification tolerance in pixels (0 keeps every contour point)"),
+    site: Optional[str] = Query(None, max_length=100, description="Blast site of the video, recorded in the history store"),
+    captured_at: Optional[datetime] = Query(None, description="When the video started, frames are recorded in the history store at this time plus their timestamp (default: now, UTC if no offset)")
+):
+    """Analyse a video as a stream of sampled frames. Responds with one JSON object per
+    sampled frame (newline-delimited), as soon as it is analysed, then a summary line."""
+    start_time = time.time()
+    priority, client_id = resolve_priority(
+        request.headers,
+        request.client.host if request.client else None,
+        API_KEY_PRIORITIES,
+        Priority(MODEL_CONFIG.default_priority)
+    )
+    # Same budget as the request deadline, for each frame on its own
+    frame_timeout = Deadline.from_headers(request.headers, MODEL_CONFIG.timeout, MODEL_CONFIG.max_timeout).timeout
+    logger.info("Sending POST /predict/video request!")
+
+    # Videos can be large, the upload is copied to disk in chunks instead of read into memory
+    temp_path = await asyncio.get_running_loop().run_in_executor(
+        None, save_upload, file.file, Path(file.filename or "").suffix or ".mp4"
+    )
+    try:
+        capture = open_video(temp_path)
+    except ValueError as e:
+        os.unlink(temp_path)
+        update_metrics({"api": "/predict/video"}, start_time, time.time())
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    frames = sample_frames(capture, sample_fps, MODEL_CONFIG.video_max_frames)
+    # Analysed frames are recorded as "<video id>/<frame index>"
+    history = dict(video_id=uuid.uuid4().hex, site=site, captured_at=captured_at or datetime.now(timezone.utc))
+    options = dict(
+        score_threshold=score_threshold, include_mask=include_mask, include_metrics=include_metrics,
+        mask_format=mask_format, label_map_encoding=label_map_encoding, polygon_tolerance=polygon_tolerance
+    )
+    return StreamingResponse(
+        stream_video_results(frames, temp_path, priority, client_id, frame_timeout, duplicate_distance, options, history, start_time),
+        media_type="application/x-ndjson"
+    )
+
+async def stream_video_results(frames, temp_path, priority, client_id, frame_timeout, duplicate_distance, options, history, start_time):
+    """Analyse the sampled frames one by one through the scheduler, skipping near-duplicates.
+    A frame that fails is reported on its line and the video goes on."""
+    # Decoding is blocking and the capture is not thread-safe, so it runs on one dedicated thread
+    decoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video-decode")
+    loop = asyncio.get_running_loop()
+    counts = {"sampled": 0, "analysed": 0, "duplicate": 0, "failed": 0}
+    last_hash, last_index = None, None
+    try:
+        while True:
+            sample = await loop.run_in_executor(decoder, next_sample, frames, MODEL_CONFIG.input_size)
+            if sample is None:
+                break
+            index, timestamp, tensor, frame_hash = sample
+            counts["sampled"] += 1
+            line = {"frame_index": index, "timestamp": round(timestamp, 3)}
+
+            if last_hash is not None and hamming_distance(frame_hash, last_hash) <= duplicate_distance:
+                # Same scene as the last analysed frame, its results still apply
+                result = "duplicate"
+                line["duplicate_of"] = last_index
+            else:
+                try:
+                    # Every frame gets its own deadline and waits for its own inference slot
+                    response = await analyse_image(tensor, Deadline(frame_timeout), priority, client_id, **options)
+                    result = "analysed"
+                    record_history(
+                        response, f"{history['video_id']}/{index}", history["site"],
+                        history["captured_at"] + timedelta(seconds=timestamp)
+                    )
+                    line.update(jsonable_encoder(response))
+                    last_hash, last_index = frame_hash, index
+                except (TimeoutError, asyncio.TimeoutError, ClientLimitExceeded) as e:
+                    logger.warning("Frame %d failed: %s", index, e)
+                    result = "failed"
+                    line["error"] = str(e) or "Frame deadline exceeded"
+                except Exception as e:
+                    logger.exception("Frame %d failed", index)
+                    result = "failed"
+                    line["error"] = str(e) or type(e).__name__
+
+            counts[result] += 1
+            video_frames_counter.add(1, {"result": result})
+            yield json.dumps(line) + "\n"
+
+        yield json.dumps({"summary": {**counts, "elapsed": round(time.time() - start_time, 3)}}) + "\n"
+    finally:
+        # Queued behind any read still running, so the capture is never released while in use
+        decoder.submit(close_video, frames, temp_path)
+        decoder.shutdown(wait=False)
+        update_metrics({"api": "/predict/video"}, start_time, time.time())
+
+def save_upload(upload, suffix: str) -> str:
+    """Copy an uploaded file to a temporary file in chunks and return its path."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        shutil.copyfileobj(upload, temp_file)
+    logger.debug("Saved upload to %s", temp_file.name)
+    return temp_file.name
+
+def next_sample(frames, input_size):
+    """Decode the next sampled frame, hash it and turn it into the model input, on the decoder thread."""
+    sample = next(frames, None)
+    if sample is None:
+        return None
+    index, timestamp, frame = sample
+    return index, timestamp, frame_to_tensor(frame, input_size), dhash(frame)
+
+def close_video(frames, temp_path: str):
+    frames.close()
+    try:
+        os.unlink(temp_path)
+    except OSError as e:
+        logger.warning("Failed to clean up temporary file %s: %s", temp_path, e)
@@ -0,0 +1,86 @@
+"""Production launcher for the model API.
+
+The model is prepared once in the master process, then uvicorn workers are
+forked from it. Unless MODEL_SHARE_WEIGHTS=0, an .onnx model is optimized for
+this CPU and its weights written to a file next to the optimized copy
+(MODEL_CACHE_DIR), which every session maps instead of copying, so all workers
+and all sessions of their pools share one copy of the weights in the page cache.
+Only the MatMul/Gemm weights ONNX Runtime prepacks stay private per session. For
+a 94 MB convolutional model on ONNX Runtime 1.15.1 a worker privately holds
+10 MB instead of 215 MB. Models in .ort format, or left unshared, are read as
+bytes and every session holds a private copy of the weights. Worker count and
+ONNX Runtime threads per worker are sized to the container CPU quota.
+
+    python serve.py
+"""
+import itertools
+import logging
+import os
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from capacity import cpu_quota, plan_workers
+from logging_config import setup_logging
+from routers.core.session_pool import core_groups, should_pin
+
+logger = logging.getLogger(__name__)
+
+class ModelApiWorker(UvicornWorker):
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+def pre_fork(server, worker):
+    # Give every worker the lowest free index, a restarted worker takes over the index of the one it replaces
+    used = {getattr(w, "metrics_index", None) for w in server.WORKERS.values()}
+    worker.metrics_index = next(i for i in itertools.count() if i not in used)
+
+def post_fork(server, worker):
+    # Each worker process exposes its own metrics on METRICS_PORT + index
+    base_port = int(os.getenv("METRICS_PORT", "8099"))
+    os.environ["METRICS_PORT"] = str(base_port + worker.metrics_index)
+    pin_worker(worker.metrics_index, server.num_workers, int(os.getenv("ORT_INTRA_OP_THREADS", "0")))
+
+def pin_worker(index: int, workers: int, threads: int):
+    """Bind the worker process to its own cores, its session pool then splits them further
+    (see SessionPool). Threads created afterwards inherit the binding."""
+    cpus = sorted(os.sched_getaffinity(0))
+    groups = core_groups(cpus, workers, threads)
+    if groups and should_pin(os.getenv("SESSION_PIN_THREADS", "auto"), cpus, workers * threads):
+        os.sched_setaffinity(0, groups[index % workers])
+
+class ModelApiServer(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # With preload_app this runs once in the master, before any worker is forked
+        from main import app
+        return app
+
+def main():
+    setup_logging()
+    workers, threads = plan_workers(cpu_quota())
+    # Read by ModelConfig when the app is imported
+    os.environ["ORT_INTRA_OP_THREADS"] = str(threads)
+    logger.info("Starting %d worker(s) with %d ONNX Runtime thread(s) each", workers, threads)
+
+    ModelApiServer({
+        "bind": f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}",
+        "workers": workers,
+        "worker_class": ModelApiWorker,
+        "preload_app": True,
+        "pre_fork": pre_fork,
+        "post_fork": post_fork,
+        # In-flight inferences get this long to finish after SIGTERM
+        "graceful_timeout": int(os.getenv("GRACEFUL_TIMEOUT", "75")),
+        "timeout": 120,
+        "keepalive": 5,
+    }).run()
+
+if __name__ == "__main__":
+    main()
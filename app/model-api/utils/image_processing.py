@@ -5,11 +5,13 @@ import cv2 # type: ignore
 import logging
 import tempfile
 import os
-import traceback
 from routers.schema.predict_response  import SizeMetrics, SizeDistribution
 from routers.schema.fragment          import FragmentMetrics
+from logging_config import sampled_logger
 
 logger = logging.getLogger(__name__)
+# Messages repeated for every fragment are sampled
+fragment_logger = sampled_logger(f"{__name__}.fragments")
 
 def preprocess_image(image_bytes):
     try:
@@ -25,15 +27,14 @@ def preprocess_image(image_bytes):
             os.unlink(temp_path)
 
     except Exception as e:
-        logger.error(f"Error preprocessing image: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error preprocessing image: %s", e)
         raise
 
 
 def load_image(temp_path):
     # Read image using torchvision.io
     image = io.read_image(temp_path)
-    logger.info(f"Image loaded successfully. Shape: {image.shape}, dtype: {image.dtype}")
+    logger.debug("Image loaded successfully. Shape: %s, dtype: %s", image.shape, image.dtype)
 
     # Add batch dimension and convert to float32
     image = image.unsqueeze(0)
@@ -42,9 +43,47 @@ def load_image(temp_path):
     # Convert to numpy array
     image_np = image.numpy()
 
-    logger.info(f"Image array shape after preprocessing: {image_np.shape}")
+    logger.debug("Image array shape after preprocessing: %s", image_np.shape)
     return image_np
 
+def frame_to_tensor(frame, input_size, bgr=True):
+    """Convert a decoded HxWx3 uint8 frame to the model input: 1x3xHxW float32 RGB, resized to
+    input_size (H, W) if needed. Converted in a single pass straight from the frame's buffer."""
+    height, width = input_size
+    if frame.shape[:2] != (height, width):
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    channels = frame.transpose(2, 0, 1)
+    if bgr:
+        channels = channels[::-1]
+    tensor = np.empty((1, 3, height, width), dtype=np.float32)
+    tensor[0] = channels
+    return tensor
+
+def paste_roi_mask(roi_mask, box, image_shape, threshold=0.5, padding=1):
+    """Upsample the M x M mask probabilities of one detection to its box and binarize them into
+    a full-frame uint8 mask, zero outside the box. Follows torchvision's paste_masks_in_image:
+    the mask is padded by one pixel and the box expanded to match before the bilinear resize."""
+    roi_mask = np.asarray(roi_mask, dtype=np.float32)
+    roi_mask = roi_mask.reshape(roi_mask.shape[-2:])
+    scale = (roi_mask.shape[-1] + 2 * padding) / roi_mask.shape[-1]
+    padded = np.pad(roi_mask, padding)
+
+    x1, y1, x2, y2 = [float(coord) for coord in box]
+    w_half, h_half = (x2 - x1) * 0.5 * scale, (y2 - y1) * 0.5 * scale
+    x_c, y_c = (x2 + x1) * 0.5, (y2 + y1) * 0.5
+    # int() truncates like the int64 cast in torchvision
+    x0, x1, y0, y1 = int(x_c - w_half), int(x_c + w_half), int(y_c - h_half), int(y_c + h_half)
+    width, height = max(x1 - x0 + 1, 1), max(y1 - y0 + 1, 1)
+    resized = cv2.resize(padded, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    image_height, image_width = image_shape
+    mask = np.zeros((image_height, image_width), dtype=np.uint8)
+    left, right = max(x0, 0), min(x1 + 1, image_width)
+    top, bottom = max(y0, 0), min(y1 + 1, image_height)
+    if left < right and top < bottom:
+        mask[top:bottom, left:right] = resized[top - y0:bottom - y0, left - x0:right - x0] > threshold
+    return mask
+
 def calculate_size(boxes):
     x1, y1, x2, y2 = boxes
     return (y2 - y1) * (x2 - x1)
@@ -59,8 +98,7 @@ def calculate_mask_metrics(mask):
     try:
         return try_calculate_mask_metrics(mask)
     except Exception as e:
-        logger.error(f"Error in calculate_mask_metrics: {str(e)}")
-        logger.error(traceback.format_exc())
+        fragment_logger.exception("Error in calculate_mask_metrics: %s", e)
         return FragmentMetrics()
 
 def try_calculate_mask_metrics(mask):
@@ -70,98 +108,64 @@ def try_calculate_mask_metrics(mask):
     else:
         mask_np = np.array(mask)
 
-    # Debug logging before processing
-    logger.info(f"Initial mask shape: {mask_np.shape}, dtype: {mask_np.dtype}, min: {np.min(mask_np)}, max: {np.max(mask_np)}")
-    
     # Handle scalar or empty arrays
     if mask_np.size == 0 or mask_np.ndim == 0:
-        logger.warning("Empty or scalar mask received")
+        fragment_logger.warning("Empty or scalar mask received")
         return FragmentMetrics()
 
     # Ensure the mask is 2D and binary (0 or 1)
     if len(mask_np.shape) > 2:
-        logger.info(f"Squeezing mask from shape {mask_np.shape}")
+        fragment_logger.debug("Squeezing mask from shape %s", mask_np.shape)
         mask_np = mask_np.squeeze()  # Remove extra dimensions
-        logger.info(f"After squeeze: {mask_np.shape}")
 
     # Ensure 2D array with correct dimensions (512x512)
     if mask_np.ndim == 1:
-        logger.info(f"Converting 1D mask of length {mask_np.size} to 2D")
+        fragment_logger.debug("Converting 1D mask of length %d to 2D", mask_np.size)
         if mask_np.size == 512 * 512:
             mask_np = mask_np.reshape(512, 512)
         else:
             # If it's not the right size, create a 512x512 array with the mask value
             mask_np = np.full((512, 512), mask_np[0] if mask_np.size > 0 else 0)
 
-    # Convert to binary and ensure uint8
-    if not np.issubdtype(mask_np.dtype, np.integer):
-        logger.info(f"Converting mask from {mask_np.dtype} to binary uint8")
-    
-    # Count non-zero values before thresholding
-    non_zero_count = np.count_nonzero(mask_np)
-    logger.info(f"Non-zero values before thresholding: {non_zero_count} out of {mask_np.size} ({non_zero_count/mask_np.size*100:.2f}%)")
-    
     # Apply threshold
     mask_np = (mask_np > 0.5).astype(np.uint8)
 
-    # Debug logging after processing
-    logger.info(f"Processed mask shape: {mask_np.shape}, dtype: {mask_np.dtype}, min: {np.min(mask_np)}, max: {np.max(mask_np)}")
-    print("Mask min:", np.min(mask_np), "max:", np.max(mask_np), "shape:", mask_np.shape)
-    
-    # Count non-zero pixels in binary mask
-    non_zero_binary = np.count_nonzero(mask_np)
-    logger.info(f"Non-zero values after thresholding: {non_zero_binary} out of {mask_np.size} ({non_zero_binary/mask_np.size*100:.2f}%)")
-    
+    # Counting pixels scans the whole mask, only do it when it is logged
+    if fragment_logger.isEnabledFor(logging.DEBUG):
+        non_zero_binary = np.count_nonzero(mask_np)
+        fragment_logger.debug("Non-zero values after thresholding: %d out of %d (%.2f%%)",
+                              non_zero_binary, mask_np.size, non_zero_binary / mask_np.size * 100)
+
     try:
         return find_contour(mask_np)
     except Exception as e:
-        logger.error(f"Error in contour processing: {str(e)}")
-        logger.error(f"Mask details - shape: {mask_np.shape}, dtype: {mask_np.dtype}, min: {np.min(mask_np)}, max: {np.max(mask_np)}")
+        fragment_logger.error("Error in contour processing: %s, mask shape: %s, dtype: %s",
+                              e, mask_np.shape, mask_np.dtype)
         return FragmentMetrics()
 
 def find_contour(mask_np):
-    # Save the input mask to the contour function
-    cv2.imwrite('contour_input_mask.png', mask_np * 255)
-    
     # Handle the case of an empty mask
-    if np.all(mask_np == 0):
-        logger.warning("find_contour received an empty mask with no non-zero pixels")
+    if not mask_np.any():
+        fragment_logger.warning("find_contour received an empty mask with no non-zero pixels")
         return FragmentMetrics()
-    
+
     # Find contours
     try:
         contours, _ = cv2.findContours(mask_np, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        print("Contours found:", len(contours))
-        # Debug logging for contours
-        logger.info(f"Found {len(contours)} contours")
-        
-        # Draw contours on a blank image for debugging
-        if contours:
-            contour_debug = np.zeros_like(mask_np)
-            cv2.drawContours(contour_debug, contours, -1, 255, 1)
-            cv2.imwrite('debug_contours.png', contour_debug)
-            
-            logger.info(f"First contour points: {len(contours[0])}")
+        fragment_logger.debug("Found %d contours", len(contours))
     except Exception as e:
-        logger.error(f"Error finding contours: {str(e)}")
+        fragment_logger.error("Error finding contours: %s", e)
         return FragmentMetrics()
 
     if not contours:
-        logger.warning("No contours found in the binary mask")
+        fragment_logger.warning("No contours found in the binary mask")
         return FragmentMetrics()
 
     # Calculate metrics for the largest contour
     largest_contour = max(contours, key=cv2.contourArea)
     area = cv2.contourArea(largest_contour)
     perimeter = cv2.arcLength(largest_contour, True)
-
-    # Debug logging for metrics
-    logger.info(f"Largest contour - Area: {area}, Perimeter: {perimeter}")
-    
-    # Draw the largest contour on a separate image
-    largest_contour_debug = np.zeros_like(mask_np)
-    cv2.drawContours(largest_contour_debug, [largest_contour], -1, 255, 1)
-    cv2.imwrite('debug_largest_contour.png', largest_contour_debug)
+    fragment_logger.debug("Largest contour - Area: %s, Perimeter: %s", area, perimeter)
 
     # Calculate circularity (4π * area / perimeter^2)
     circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
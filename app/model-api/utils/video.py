@@ -0,0 +1,46 @@
+import logging
+from typing import Iterator, Tuple
+
+import cv2 # type: ignore
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def open_video(path: str) -> cv2.VideoCapture:
+    """Open a video file, raising ValueError when it cannot be decoded."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError("Unsupported or corrupted video file")
+    return capture
+
+def sample_frames(capture: cv2.VideoCapture, sample_fps: float, max_frames: int) -> Iterator[Tuple[int, float, np.ndarray]]:
+    """Yield (frame index, timestamp in seconds, BGR frame) at `sample_fps`.
+    Frames in between are only grabbed, never decoded into images."""
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    interval = 1.0 / sample_fps
+    next_sample, index, sampled = 0.0, 0, 0
+    try:
+        while sampled < max_frames and capture.grab():
+            timestamp = index / fps
+            if timestamp + 1e-6 >= next_sample:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield index, timestamp, frame
+                sampled += 1
+                next_sample += interval
+            index += 1
+    finally:
+        capture.release()
+
+def dhash(frame: np.ndarray, hash_size: int = 8) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a tiny grayscale copy.
+    Near-identical frames get hashes that differ in only a few bits."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
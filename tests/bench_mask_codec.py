@@ -0,0 +1,71 @@
+"""Benchmark of the shared mask codec against the original per-pixel loops.
+
+    python tests/bench_mask_codec.py [--fragments 200] [--size 96] [--repeat 3]
+
+Encodes and decodes a frame's worth of fragment masks, then paints them into a
+full-frame label image the way the dashboard overlay does.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from maskcodec import decode_rle, decode_rle_into, encode_rle  # noqa: E402
+from test_mask_codec import legacy_decode_rle, legacy_encode_rle, random_mask  # noqa: E402
+
+FRAME_SHAPE = (1024, 1024)
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def paint_legacy(fragments, frame):
+    for i, (rle, shape, (x, y)) in enumerate(fragments):
+        mask = legacy_decode_rle(rle, shape)
+        h = min(mask.shape[0], frame.shape[0] - y)
+        w = min(mask.shape[1], frame.shape[1] - x)
+        frame[y:y+h, x:x+w][mask[:h, :w] > 0] = i + 1
+
+def paint_vectorized(fragments, frame):
+    for i, (rle, shape, offset) in enumerate(fragments):
+        decode_rle_into(rle, shape, frame, offset, value=i + 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fragments", type=int, default=200)
+    parser.add_argument("--size", type=int, default=96, help="Side of each fragment mask in pixels")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    masks = [random_mask(rng, (args.size, args.size)) for _ in range(args.fragments)]
+    rles = [legacy_encode_rle(mask) for mask in masks]
+    offsets = rng.integers(0, FRAME_SHAPE[0] - args.size // 2, size=(args.fragments, 2))
+    fragments = [(rle, mask.shape, tuple(offset)) for rle, mask, offset in zip(rles, masks, offsets)]
+
+    cases = [
+        ("encode", lambda: [legacy_encode_rle(m) for m in masks], lambda: [encode_rle(m) for m in masks]),
+        ("decode", lambda: [legacy_decode_rle(r, m.shape) for r, m in zip(rles, masks)],
+                   lambda: [decode_rle(r, m.shape) for r, m in zip(rles, masks)]),
+        ("paint frame", lambda: paint_legacy(fragments, np.zeros(FRAME_SHAPE, dtype=np.int32)),
+                        lambda: paint_vectorized(fragments, np.zeros(FRAME_SHAPE, dtype=np.int32))),
+    ]
+
+    print(f"{args.fragments} fragments of {args.size}x{args.size} px, best of {args.repeat}")
+    print(f"{'case':<12} {'legacy (ms)':>12} {'maskcodec (ms)':>15} {'speedup':>8}")
+    for name, legacy, vectorized in cases:
+        legacy_time = best_of(args.repeat, legacy)
+        vectorized_time = best_of(args.repeat, vectorized)
+        print(f"{name:<12} {legacy_time * 1000:>12.1f} {vectorized_time * 1000:>15.1f} {legacy_time / vectorized_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
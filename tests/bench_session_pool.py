@@ -0,0 +1,91 @@
+"""Benchmark of the session pool presets: images/s against p95 latency.
+
+    python tests/bench_session_pool.py [--model app/model-api/models/model.onnx]
+        [--threads 8] [--session-threads 1] [--clients 1 4 8] [--requests 32]
+
+Each client sends the next image as soon as the previous answer is back, the
+way busy /predict callers do. Only the session runs are timed, the rest of the
+request pipeline is the same for every preset.
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "model-api")
+sys.path.insert(0, API_DIR)
+
+import cv2  # noqa: E402
+
+from models.model_utils import load_model_source, model_inputs  # noqa: E402
+from routers.core.session_pool import PoolMode, SessionPool, plan_sessions  # noqa: E402
+from utils.image_processing import frame_to_tensor  # noqa: E402
+
+INPUT_SIZE = (512, 512)
+
+def load_images():
+    paths = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.jpg")))
+    return [frame_to_tensor(cv2.imread(path), INPUT_SIZE) for path in paths]
+
+def run(session, image_tensor):
+    return session.run(None, model_inputs(session, image_tensor, 0.3))
+
+def measure(pool, images, clients, requests):
+    """(images/s, p50 ms, p95 ms) of `requests` images sent by `clients` closed-loop clients."""
+    latencies = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            pool.submit(run, images[index % len(images)]).result()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return requests / elapsed, p50, p95
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(API_DIR, "models", "model.onnx"))
+    parser.add_argument("--threads", type=int, default=len(os.sched_getaffinity(0)),
+                        help="Intra-op threads shared by the sessions of a preset")
+    parser.add_argument("--session-threads", type=int, default=1, help="Threads per session in throughput mode")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=32, help="Images per measurement")
+    parser.add_argument("--pin", default="auto", help="Bind sessions to cores: 1, 0 or auto")
+    args = parser.parse_args()
+
+    model = load_model_source(args.model)
+    images = load_images()
+    print(f"{args.threads} thread(s), {args.requests} images per run")
+    print(f"{'preset':<11} {'sessions':>8} {'threads':>8} {'clients':>8} {'images/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for mode in PoolMode:
+        size, threads = plan_sessions(mode, args.threads, args.session_threads)
+        pool = SessionPool(model, size, threads, pin=args.pin)
+        # Warm up every session, first runs allocate their buffers
+        for pooled in pool.sessions:
+            run(pooled.session, images[0])
+        for clients in args.clients:
+            rate, p50, p95 = measure(pool, images, clients, args.requests)
+            print(f"{mode.value:<11} {size:>8} {threads:>8} {clients:>8} {rate:>9.2f} {p50:>9.0f} {p95:>9.0f}")
+        pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Compatibility of the shared mask codec with the original per-pixel RLE format.
+
+    pytest tests/test_mask_codec.py
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from maskcodec import (  # noqa: E402
+    decode_label_map,
+    decode_rle,
+    decode_rle_into,
+    encode_label_map,
+    encode_polygon,
+    encode_rle,
+)
+
+# ============= Reference implementation (the loops both services used before) =============
+def legacy_encode_rle(mask):
+    flat_mask = mask.flatten()
+    rle = []
+    start = None
+    for i, val in enumerate(flat_mask):
+        if val == 1 and start is None:
+            start = i
+        elif val == 0 and start is not None:
+            rle.append([start, i - start])
+            start = None
+    if start is not None:
+        rle.append([start, len(flat_mask) - start])
+    return rle
+
+def legacy_decode_rle(rle, shape):
+    height, width = shape
+    mask = np.zeros(height * width, dtype=np.uint8)
+    for start, length in rle:
+        if 0 <= start < len(mask) and length > 0:
+            end = min(start + length, len(mask))
+            mask[start:end] = 1
+    return mask.reshape(height, width)
+
+def random_mask(rng, shape, density=0.5):
+    """Blobby binary mask so that runs have realistic lengths."""
+    coarse = rng.random((max(1, shape[0] // 4), max(1, shape[1] // 4))) < density
+    mask = np.kron(coarse, np.ones((4, 4), dtype=bool))[:shape[0], :shape[1]]
+    return np.pad(mask, ((0, shape[0] - mask.shape[0]), (0, shape[1] - mask.shape[1]))).astype(np.uint8)
+
+MASKS = [
+    np.zeros((5, 7), dtype=np.uint8),
+    np.ones((5, 7), dtype=np.uint8),
+    np.eye(6, dtype=np.uint8),
+    np.array([[1, 0, 1], [1, 1, 0]], dtype=np.uint8),
+] + [random_mask(np.random.default_rng(seed), (37, 53)) for seed in range(10)]
+
+# ============= Tests =============
+@pytest.mark.parametrize("mask", MASKS)
+def test_encode_matches_legacy(mask):
+    assert encode_rle(mask) == legacy_encode_rle(mask)
+
+@pytest.mark.parametrize("mask", MASKS)
+def test_decode_matches_legacy(mask):
+    rle = legacy_encode_rle(mask)
+    decoded = decode_rle(rle, mask.shape)
+    assert decoded.dtype == np.uint8
+    np.testing.assert_array_equal(decoded, legacy_decode_rle(rle, mask.shape))
+    np.testing.assert_array_equal(decoded, mask)
+
+def test_decode_tolerates_malformed_runs_like_legacy():
+    shape = (4, 5)
+    rle = [[-3, 2], [2, 0], [3, 4], [18, 10], [25, 3], [6, -1]]
+    np.testing.assert_array_equal(decode_rle(rle, shape), legacy_decode_rle(rle, shape))
+
+def test_decode_empty():
+    np.testing.assert_array_equal(decode_rle([], (3, 3)), np.zeros((3, 3), dtype=np.uint8))
+
+def test_decode_into_frame_at_offset():
+    mask = random_mask(np.random.default_rng(0), (12, 9))
+    frame = np.zeros((20, 20), dtype=np.int32)
+    decode_rle_into(encode_rle(mask), mask.shape, frame, (15, 4), value=7)
+
+    # Only the part of the mask inside the frame is painted
+    expected = np.zeros_like(frame)
+    expected[4:16, 15:20][mask[:, :5] > 0] = 7
+    np.testing.assert_array_equal(frame, expected)
+
+@pytest.mark.parametrize("encoding", ["png", "rle"])
+def test_label_map_round_trip(encoding):
+    rng = np.random.default_rng(1)
+    label_map = np.zeros((40, 60), dtype=np.uint16)
+    for instance_id in range(1, 6):
+        label_map[random_mask(rng, label_map.shape, density=0.2) > 0] = instance_id
+    np.testing.assert_array_equal(decode_label_map(encode_label_map(label_map, encoding)), label_map)
+
+def test_polygon_keeps_every_part_and_hole():
+    mask = np.zeros((40, 60), dtype=np.uint8)
+    mask[5:30, 5:30] = 1
+    mask[12:20, 12:20] = 0  # Hole
+    mask[5:10, 40:55] = 1   # Second, smaller part
+    polygons = encode_polygon(mask, (2, 2, 58, 38), tolerance=0)
+    assert [len(rings) for rings in polygons] == [2, 1]
+
+    # Filling the outer rings and cutting the holes gives the mask back, up to the hole borders
+    filled = np.zeros_like(mask)
+    for outer, *holes in polygons:
+        cv2.fillPoly(filled, [np.asarray(outer, dtype=np.int32)], 1)
+        for hole in holes:
+            cv2.fillPoly(filled, [np.asarray(hole, dtype=np.int32)], 0)
+    assert np.count_nonzero(filled != mask) <= 4 * 8
+
+def test_polygon_empty():
+    assert encode_polygon(np.zeros((5, 5), dtype=np.uint8), (0, 0, 5, 5)) == []
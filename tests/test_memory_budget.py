@@ -0,0 +1,153 @@
+"""Admission of requests by the per-worker memory budget of the model API, and how it combines with the scheduler.
+
+    pytest tests/test_memory_budget.py
+"""
+import asyncio
+import os
+import sys
+from contextlib import AsyncExitStack
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "model-api"))
+
+from routers.core.deadline import Deadline  # noqa: E402
+from routers.core.memory import MemoryBudget  # noqa: E402
+from routers.core.scheduler import Priority, PriorityScheduler  # noqa: E402
+
+MB = 1024 * 1024
+
+async def hold(budget, name, nbytes, order, release, timeout=5.0):
+    async with budget.reserve(nbytes, Deadline(timeout)):
+        order.append(name)
+        await release.wait()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_admits_while_it_fits():
+    async def scenario():
+        budget = MemoryBudget(300 * MB)
+        order, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(budget, f"r{i}", 100 * MB, order, release)) for i in range(4)]
+        await settle()
+        assert order == ["r0", "r1", "r2"]
+        assert budget.reserved == 300 * MB
+        assert budget.queue_depth() == 1
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == ["r0", "r1", "r2", "r3"]
+        assert budget.reserved == 0
+    asyncio.run(scenario())
+
+def test_first_in_first_out():
+    async def scenario():
+        budget = MemoryBudget(200 * MB)
+        order = []
+        first, big, small = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        tasks = [asyncio.create_task(hold(budget, "first", 150 * MB, order, first))]
+        await settle()
+        # The large request arrived first, the small one that would fit must not overtake it
+        tasks.append(asyncio.create_task(hold(budget, "big", 150 * MB, order, big)))
+        await settle()
+        tasks.append(asyncio.create_task(hold(budget, "small", 10 * MB, order, small)))
+        await settle()
+        assert order == ["first"]
+        first.set()
+        await settle()
+        assert order == ["first", "big", "small"]
+        big.set()
+        small.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(scenario())
+
+def test_oversize_request_runs_alone():
+    async def scenario():
+        budget = MemoryBudget(100 * MB)
+        order, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(budget, "small", 50 * MB, order, release))]
+        await settle()
+        tasks.append(asyncio.create_task(hold(budget, "huge", 500 * MB, order, release)))
+        await settle()
+        assert order == ["small"]
+        release.set()
+        await settle()
+        assert order == ["small", "huge"]
+        await asyncio.gather(*tasks)
+
+        # Alone, it is admitted at once
+        async with budget.reserve(500 * MB, Deadline(1.0)):
+            assert budget.reserved == 500 * MB
+        assert budget.reserved == 0
+    asyncio.run(scenario())
+
+def test_timeout_leaves_the_queue():
+    async def scenario():
+        budget = MemoryBudget(100 * MB)
+        order, release = [], asyncio.Event()
+        holder = asyncio.create_task(hold(budget, "holder", 100 * MB, order, release))
+        await settle()
+        with pytest.raises(TimeoutError, match="Waiting for memory"):
+            await hold(budget, "late", 50 * MB, order, release, timeout=0.05)
+        assert budget.queue_depth() == 0
+        release.set()
+        await holder
+        assert order == ["holder"]
+        assert budget.reserved == 0
+    asyncio.run(scenario())
+
+def test_resize_follows_the_actual_memory():
+    async def scenario():
+        budget = MemoryBudget(200 * MB)
+        order, release = [], asyncio.Event()
+        async with budget.reserve(150 * MB, Deadline(1.0)) as reservation:
+            waiter = asyncio.create_task(hold(budget, "next", 100 * MB, order, release))
+            await settle()
+            assert order == []
+            # Fewer detections than estimated, the next request fits now
+            reservation.resize(50 * MB)
+            await settle()
+            assert order == ["next"]
+            assert reservation.peak == 50 * MB
+            release.set()
+            await waiter
+        assert budget.reserved == 0
+    asyncio.run(scenario())
+
+def test_no_budget_only_accounts():
+    async def scenario():
+        budget = MemoryBudget(0)
+        async with budget.reserve(10_000 * MB, Deadline(1.0)):
+            async with budget.reserve(10_000 * MB, Deadline(1.0)):
+                assert budget.reserved == 20_000 * MB
+        assert budget.reserved == 0
+    asyncio.run(scenario())
+
+def test_bulk_does_not_hold_memory_while_queued():
+    """Requests take their memory once they hold a slot, the way analyse_image does.
+    Bulk requests queued first must not make an interactive request wait for memory."""
+    async def scenario():
+        scheduler = PriorityScheduler(slots=1, bulk_min_share=0)
+        budget = MemoryBudget(200 * MB)
+        order, release = [], asyncio.Event()
+
+        async def analyse(name, priority):
+            async with AsyncExitStack() as stack:
+                async with scheduler.slot(priority, name, Deadline(5.0)):
+                    await stack.enter_async_context(budget.reserve(100 * MB, Deadline(5.0)))
+                    order.append(name)
+                    await release.wait()
+                # Post-processing still holds the memory
+                await asyncio.sleep(0)
+
+        tasks = []
+        for i in range(6):
+            tasks.append(asyncio.create_task(analyse(f"bulk{i}", Priority.bulk)))
+            await settle()
+        tasks.append(asyncio.create_task(analyse("interactive", Priority.interactive)))
+        await settle()
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+    assert asyncio.run(scenario()) == ["bulk0", "interactive", "bulk1", "bulk2", "bulk3", "bulk4", "bulk5"]
@@ -0,0 +1,119 @@
+"""Order in which the model API hands out inference slots: priority classes, the bulk share and per-client limits.
+
+    pytest tests/test_scheduler.py
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "model-api"))
+
+from routers.core.deadline import Deadline  # noqa: E402
+from routers.core.scheduler import (  # noqa: E402
+    ClientLimitExceeded,
+    Priority,
+    PriorityScheduler,
+    parse_api_key_priorities,
+    resolve_priority,
+)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def run(scheduler, name, priority, order, client_id=None, timeout=5.0):
+    async with scheduler.slot(priority, client_id or name, Deadline(timeout)):
+        order.append(name)
+        await asyncio.sleep(0)
+
+async def queue_behind_holder(scheduler, requests):
+    """Start `requests` (name, priority) while the only slot is held, then free it.
+    Returns the order in which they got the slot."""
+    order, release = [], asyncio.Event()
+
+    async def holder():
+        async with scheduler.slot(Priority.bulk, "holder", Deadline(5.0)):
+            await release.wait()
+
+    tasks = [asyncio.create_task(holder())]
+    await settle()
+    for name, priority in requests:
+        tasks.append(asyncio.create_task(run(scheduler, name, priority, order)))
+        await settle()
+    release.set()
+    await asyncio.gather(*tasks)
+    return order
+
+def test_interactive_goes_first():
+    async def scenario():
+        scheduler = PriorityScheduler(slots=1, bulk_min_share=0)
+        return await queue_behind_holder(scheduler, [
+            ("bulk0", Priority.bulk), ("bulk1", Priority.bulk), ("interactive", Priority.interactive)
+        ])
+    assert asyncio.run(scenario()) == ["interactive", "bulk0", "bulk1"]
+
+def test_bulk_gets_its_minimum_share():
+    async def scenario():
+        # 20% for bulk: one bulk grant after every 4 interactive ones while bulk waits
+        scheduler = PriorityScheduler(slots=1, bulk_min_share=0.2)
+        return await queue_behind_holder(
+            scheduler, [("bulk", Priority.bulk)] + [(f"i{i}", Priority.interactive) for i in range(6)]
+        )
+    assert asyncio.run(scenario()) == ["i0", "i1", "i2", "i3", "bulk", "i4", "i5"]
+
+def test_client_limit():
+    async def scenario():
+        scheduler = PriorityScheduler(slots=1, max_client_concurrency=2)
+        order, release = [], asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot(Priority.interactive, "dashboard", Deadline(5.0)):
+                await release.wait()
+
+        tasks = [asyncio.create_task(holder())]
+        await settle()
+        tasks.append(asyncio.create_task(run(scheduler, "queued", Priority.interactive, order, "dashboard")))
+        await settle()
+        with pytest.raises(ClientLimitExceeded):
+            await run(scheduler, "third", Priority.interactive, order, "dashboard")
+        # Other clients are not affected
+        tasks.append(asyncio.create_task(run(scheduler, "other", Priority.interactive, order)))
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+    assert asyncio.run(scenario()) == ["queued", "other"]
+
+def test_timeout_while_queued():
+    async def scenario():
+        scheduler = PriorityScheduler(slots=1)
+        order, release = [], asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot(Priority.interactive, "holder", Deadline(5.0)):
+                await release.wait()
+
+        task = asyncio.create_task(holder())
+        await settle()
+        with pytest.raises(TimeoutError, match="Waiting for inference"):
+            await run(scheduler, "late", Priority.interactive, order, timeout=0.05)
+        assert scheduler.queue_depth(Priority.interactive) == 0
+        release.set()
+        await task
+        # The slot went back to the pool instead of the request that gave up
+        assert scheduler.slots_in_use() == 0
+        await run(scheduler, "next", Priority.interactive, order)
+        return order
+    assert asyncio.run(scenario()) == ["next"]
+
+def test_resolve_priority():
+    keys = parse_api_key_priorities("ingest:bulk,ops:interactive,bad:unknown")
+    assert keys == {"ingest": Priority.bulk, "ops": Priority.interactive}
+    assert resolve_priority({"X-API-Key": "ingest", "X-Priority": "interactive"}, "10.0.0.1", keys) \
+        == (Priority.bulk, "key:ingest")
+    assert resolve_priority({"X-Priority": "bulk"}, "10.0.0.1", keys) == (Priority.bulk, "host:10.0.0.1")
+    assert resolve_priority({}, None, keys) == (Priority.interactive, "host:unknown")
+    # Dashboard sessions behind one server get a limit each
+    assert resolve_priority({"X-Client-ID": "abc"}, "10.0.0.2", keys) == (Priority.interactive, "host:10.0.0.2/abc")
+    assert resolve_priority({"X-API-Key": "ops", "X-Client-ID": "abc"}, "10.0.0.2", keys)[1] == "key:ops"